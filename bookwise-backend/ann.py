@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+# Catalogs with at least this many books get an ANN index at fit time
+ANN_MIN_BOOKS = int(os.getenv("RECOMMENDER_ANN_MIN_BOOKS", 50000))
+
+# Number of clusters (0: about the square root of the catalog size) and how
+# many of the closest ones a query scans; more probes trade speed for recall
+ANN_LISTS = int(os.getenv("RECOMMENDER_ANN_LISTS", 0))
+ANN_PROBES = int(os.getenv("RECOMMENDER_ANN_PROBES", 8))
+
+# Rows per matrix product when assigning rows to clusters, to bound memory
+ASSIGN_CHUNK = 8192
+
+
+class IVFIndex:
+    """
+    Inverted-file index over L2-normalized sparse feature rows.
+
+    Rows are clustered with spherical k-means; each cluster keeps a sparse
+    centroid (its largest max_centroid_terms weights) and the list of its
+    rows. A query scans only the rows of the n_probe clusters whose centroids
+    are most similar to it, instead of the whole catalog, and those rows are
+    then scored exactly.
+    """
+
+    def __init__(self, n_lists=ANN_LISTS, n_probe=ANN_PROBES, max_centroid_terms=256, iterations=8, seed=0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.max_centroid_terms = max_centroid_terms
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None    # sparse (n_lists x features)
+        self.assignments = None  # cluster of every row
+        self.list_indptr = None  # rows of cluster i: list_rows[list_indptr[i]:list_indptr[i + 1]]
+        self.list_rows = None
+
+    def fit(self, features):
+        n_rows = features.shape[0]
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(n_rows))), n_rows)
+        rng = np.random.default_rng(self.seed)
+
+        # k-means on a sample of about 32 rows per cluster
+        sample = features[np.sort(rng.choice(n_rows, min(n_rows, 32 * n_lists), replace=False))]
+        centroids = sample[rng.choice(sample.shape[0], n_lists, replace=False)]
+        for _ in range(self.iterations):
+            assignments = self.nearest(sample, centroids)
+            membership = sp.csr_matrix(
+                (np.ones(len(assignments)), (assignments, np.arange(len(assignments)))),
+                shape=(n_lists, sample.shape[0]),
+            )
+            # An empty cluster keeps its previous centroid
+            empty = sp.diags((np.diff(membership.indptr) == 0).astype(float))
+            centroids = self.truncate(normalize(membership @ sample + empty @ centroids))
+
+        self.n_lists = n_lists
+        self.centroids = centroids
+        self.set_assignments(self.nearest(features, centroids))
+        return self
+
+    def truncate(self, centroids):
+        """Keep the max_centroid_terms largest weights of every centroid."""
+        centroids = centroids.tocsr()
+        rows, cols, values = [], [], []
+        for i in range(centroids.shape[0]):
+            start, end = centroids.indptr[i], centroids.indptr[i + 1]
+            data, indices = centroids.data[start:end], centroids.indices[start:end]
+            if len(data) > self.max_centroid_terms:
+                top = np.argpartition(-data, self.max_centroid_terms - 1)[:self.max_centroid_terms]
+                data, indices = data[top], indices[top]
+            rows.append(np.full(len(data), i))
+            cols.append(indices)
+            values.append(data)
+        truncated = sp.csr_matrix(
+            (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=centroids.shape
+        )
+        return normalize(truncated)
+
+    def nearest(self, features, centroids=None):
+        """Return the most similar centroid of every row."""
+        centroids_t = (self.centroids if centroids is None else centroids).T.tocsc()
+        nearest = np.empty(features.shape[0], dtype=np.int32)
+        for start in range(0, features.shape[0], ASSIGN_CHUNK):
+            similarity = (features[start:start + ASSIGN_CHUNK] @ centroids_t).toarray()
+            nearest[start:start + ASSIGN_CHUNK] = similarity.argmax(axis=1)
+        return nearest
+
+    def set_assignments(self, assignments):
+        """Set the cluster of every row and rebuild the inverted lists."""
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.list_rows = np.argsort(self.assignments, kind='stable').astype(np.int32)
+        self.list_indptr = np.concatenate(([0], np.cumsum(np.bincount(self.assignments, minlength=self.n_lists))))
+
+    def candidates(self, profile, n_probe=None, allowed=None, min_candidates=0):
+        """
+        Return the sorted row ids to score for a query profile (a 1 x features
+        vector). With allowed (sorted row ids, e.g. one category's books), only
+        those rows are returned; if they are fewer than the rows the probed
+        clusters hold, they are all returned, since scoring them exactly is
+        cheaper. Probes are doubled until at least min_candidates rows are
+        found or every cluster has been probed.
+        """
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        centroid_scores = np.asarray(self.centroids @ np.asarray(profile).ravel()).ravel()
+        order = np.argsort(-centroid_scores)
+        sizes = np.diff(self.list_indptr)[order]
+
+        while True:
+            if allowed is not None and len(allowed) <= sizes[:n_probe].sum():
+                return allowed
+            rows = np.sort(np.concatenate([
+                self.list_rows[self.list_indptr[cluster]:self.list_indptr[cluster + 1]]
+                for cluster in order[:n_probe]
+            ]))
+            if allowed is not None:
+                rows = rows[np.isin(rows, allowed, assume_unique=True)]
+            if len(rows) >= min_candidates or n_probe >= self.n_lists:
+                return rows
+            n_probe = min(2 * n_probe, self.n_lists)
+
+    def save(self, path):
+        np.save(os.path.join(path, 'ann_centroids_data.npy'), self.centroids.data)
+        np.save(os.path.join(path, 'ann_centroids_indices.npy'), self.centroids.indices)
+        np.save(os.path.join(path, 'ann_centroids_indptr.npy'), self.centroids.indptr)
+        np.save(os.path.join(path, 'ann_assignments.npy'), self.assignments)
+        return {'n_lists': self.n_lists, 'n_probe': self.n_probe, 'n_features': self.centroids.shape[1]}
+
+    @classmethod
+    def load(cls, path, manifest):
+        index = cls(n_lists=manifest['n_lists'], n_probe=int(os.getenv("RECOMMENDER_ANN_PROBES", manifest['n_probe'])))
+        index.centroids = sp.csr_matrix((
+            np.load(os.path.join(path, 'ann_centroids_data.npy')),
+            np.load(os.path.join(path, 'ann_centroids_indices.npy')),
+            np.load(os.path.join(path, 'ann_centroids_indptr.npy')),
+        ), shape=(manifest['n_lists'], manifest['n_features']))
+        index.set_assignments(np.load(os.path.join(path, 'ann_assignments.npy')))
+        return index
@@ -1,23 +1,33 @@
-from flask import Flask, jsonify, request, session
+from flask import Flask, Response, jsonify, request, session
 from flask_cors import CORS
+import base64
+import gzip
+import hmac
+import json
 import os
+import time
+import zlib
 import psycopg2
+import psycopg2.errors
+import psycopg2.extras
 from dotenv import load_dotenv
-from recommender import BookRecommender, get_data_from_postgresql
-import recommender
+from recommender import get_recommender, get_loaded_recommender, ingest_recommender
+from cache import create_catalog_cache, create_recommendation_cache
+from model_manager import ModelManager
+from db import db_connection, get_pool
+from thumbnails import LOOKUP_AGE_SQL, ThumbnailResolver
+from search import FUZZY_AUTHOR_SQL, MAX_SEARCH_LENGTH, search_books, set_fuzzy_threshold
+from werkzeug.http import is_resource_modified
 from werkzeug.security import generate_password_hash, check_password_hash
+from contextlib import ExitStack
+from datetime import datetime, timezone
 from functools import wraps  
-import requests
 
 app = Flask(__name__)
 CORS(app, supports_credentials=True)
 load_dotenv()
-app.config['DEBUG'] = True
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY")
-# Initialize and fit the recommender
-df = get_data_from_postgresql()
-recommender = BookRecommender()  # Globally defined recommender object
-recommender.fit(df)
+# The recommender is loaded lazily by get_recommender() on first use
 
 # Decorator for database connection
 
@@ -25,74 +35,230 @@ def db_operation(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         try:
-            connection = get_db_connection()
-            cursor = connection.cursor()
-            result = func(cursor, *args, **kwargs)
-            connection.commit()
-            return result
+            with db_connection() as connection, connection.cursor() as cursor:
+                result = func(cursor, *args, **kwargs)
+                connection.commit()
+                return result
         except psycopg2.Error as e:
             return jsonify({'error': f'Veritabanı hatası: {e}'}), 500
-        finally:
-            if cursor:
-                cursor.close()
-            if connection:
-                connection.close()
     return wrapper
 
-def get_db_connection():
-    url = os.getenv("DATABASE_URL")
-    connection = psycopg2.connect(url)
-    return connection
-
 # Test the database connection
 def test_db_connection():
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute("SELECT 1")  # Simple test query
-        cursor.close()
-        connection.close()
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT 1")  # Simple test query
         print("Database connection successful.")
     except Exception as e:
         print("Database connection error:", e)
 
 test_db_connection()
 
-def get_book_thumbnail(isbn):
+# Maximum number of (user, category) pairs accepted by the batch suggestions endpoint
+MAX_SUGGESTION_BATCH = 500
+
+# Longest free text accepted by /api/ai-suggestions/text
+MAX_QUERY_TEXT_LENGTH = 2000
+
+# Maximum number of ISBN13s accepted by /books/batch
+MAX_BOOK_BATCH = 200
+
+# Cached /api/ai-suggestions results, invalidated per user when their ratings or likes change
+recommendation_cache = create_recommendation_cache()
+# Cached catalog responses, keyed on the catalog version and ratings window
+catalog_cache = create_catalog_cache()
+
+# Seconds browsers may reuse a catalog response without asking again; at 0 they
+# revalidate every time, which costs an empty 304 while the catalog is unchanged
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_CACHE_MAX_AGE", 0))
+
+# Rating aggregates do not bump the catalog version (migration 008), so
+# catalog responses are also renewed every this many seconds; a new rating
+# shows up in them at most this late
+CATALOG_RATINGS_LAG = max(int(os.getenv("CATALOG_RATINGS_LAG", 60)), 1)
+
+# gzip/deflate level (1-9) of JSON responses, for clients that accept it
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", 6))
+
+# Smaller bodies are sent uncompressed; compression would barely shrink them
+MIN_COMPRESS_SIZE = 500
+
+# Rows read per round trip from the server-side cursor of a streamed list
+STREAM_BATCH_SIZE = 500
+thumbnail_resolver = ThumbnailResolver()
+model_manager = ModelManager()
+
+@app.before_request
+def start_model_manager():
+    # Start the scheduled rebuild checks in this (possibly forked) process
+    model_manager.start()
+
+def accepted_encoding():
+    """The compression the client accepts, 'gzip' or 'deflate', or None."""
+    return request.accept_encodings.best_match(['gzip', 'deflate'])
+
+def compress_chunks(chunks, compressor):
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.after_request
+def compress_response(response):
     """
- 
-    Returns the book thumbnail by ISBN number. Checks the database first, 
-    uses the Open Library API if not found.
-    Args:
-      isbn: ISBN number of the book.
-    Returns:
-      The URL of the book thumbnail, or None if the image was not found.
+    gzip or deflate JSON responses for clients that accept it. Streamed
+    responses are compressed chunk by chunk as they are sent.
     """
-    try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute("SELECT thumbnail FROM books WHERE isbn13 = %s", (isbn,))
-        result = cursor.fetchone()
-        if result and result[0]:  # If there is thumbnail in the database
-            return result[0]
-
-        #  If thumbnail is not available in the database, use the Open Library API
-
-        url = f"https://covers.openlibrary.org/b/isbn/{isbn}-L.jpg"  
-        response = requests.get(url)
-        if response.status_code == 200:
-            return url
+    if (response.status_code != 200 or response.mimetype != 'application/json'
+            or response.direct_passthrough or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # wbits selects the gzip (31) or zlib (15) container
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+        response.response = compress_chunks(response.response, compressor)
+    else:
+        data = response.get_data()
+        if len(data) < MIN_COMPRESS_SIZE:
+            return response
+        if encoding == 'gzip':
+            response.set_data(gzip.compress(data, COMPRESS_LEVEL, mtime=0))
         else:
-            return None
-    except psycopg2.Error as e:
-        print(f"Database error: {e}")
+            response.set_data(zlib.compress(data, COMPRESS_LEVEL))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def update_user_profiles(user_id, apply):
+    """
+    Invalidate the user's cached suggestions and apply a rating or like change to
+    the user profiles of the loaded recommender, so AI suggestions use it without
+    a refit. The profiles are left alone until the model is loaded, since loading
+    reads the latest profiles from the database anyway.
+    """
+    recommendation_cache.invalidate_user(user_id)
+    model = get_loaded_recommender()
+    if model is not None:
+        apply(model.user_profiles)
+
+def refresh_user_profiles(model):
+    """
+    Pick up ratings and likes written by other processes, and invalidate the
+    cached suggestions of the users they changed. This is the only place the
+    profiles are polled, so no change is applied without its invalidation.
+    """
+    for changed_user_id in model.user_profiles.maybe_refresh():
+        recommendation_cache.invalidate_user(changed_user_id)
+
+def fetch_book_cards(cursor, where, params):
+    """
+    Fetch full book records matching a WHERE clause on books b in one query.
+    Stored cover lookups are joined in, so missing thumbnails are resolved
+    without further queries or HTTP requests.
+    """
+    cursor.execute(f"""
+        SELECT b.isbn13, b.title, b.subtitle, b.authors, b.categories, b.thumbnail,
+               b.description, b.published_year, b.average_rating, b.num_pages, b.ratings_count,
+               {LOOKUP_AGE_SQL}
+        FROM books b
+        LEFT JOIN book_thumbnail_lookups tl ON tl.isbn13 = b.isbn13
+        WHERE {where};
+    """, params)
+    return [
+        {
+            "isbn13": book[0],
+            "title": book[1],
+            "subtitle": book[2],
+            "authors": book[3],
+            "categories": book[4],
+            "thumbnail": thumbnail_resolver.resolve(book[0], book[5], book[11]),
+            "description": book[6],
+            "published_year": book[7],
+            "average_rating": book[8],
+            "num_pages": book[9],
+            "ratings_count": book[10]
+        }
+        for book in cursor.fetchall()
+    ]
+
+# Columns of books b that book lists return, by field name. The fields
+# parameter selects some of them (see parse_fields), and only those are read.
+BOOK_FIELDS = {
+    "isbn13": "b.isbn13",
+    "title": "b.title",
+    "subtitle": "b.subtitle",
+    "authors": "b.authors",
+    "categories": "b.categories",
+    "thumbnail": "b.thumbnail",
+    "description": "b.description",
+    "published_year": "b.published_year",
+    "average_rating": "b.average_rating",
+    "num_pages": "b.num_pages",
+    "ratings_count": "b.ratings_count",
+}
+
+def parse_fields(available, default=None):
+    """
+    Field names selected by the repeated or comma-separated fields parameter,
+    in the order of available, always with isbn13; without the parameter, all
+    of default (or available). Raises ValueError for unknown fields.
+    """
+    requested = {field.strip() for value in request.args.getlist('fields') for field in value.split(',') if field.strip()}
+    if not requested:
+        return list(default or available)
+    unknown = requested - available.keys()
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}; available: {', '.join(available)}")
+    return [field for field in available if field in requested or field == 'isbn13']
+
+def stream_json_list(query, params, fields, key=None, **envelope):
+    """
+    Respond with the rows of a query as a JSON list of {field: value} objects,
+    serialized batch by batch as they are read from a server-side cursor, so
+    neither the rows nor the JSON are held in memory at once. With key, the
+    list is sent as {**envelope, key: [...]}.
+
+    Returns None if the query has no rows. The connection is returned to the
+    pool once the response is closed.
+    """
+    stack = ExitStack()
+    try:
+        connection = stack.enter_context(db_connection())
+        cursor = stack.enter_context(connection.cursor(name='json_list'))
+        cursor.execute(query, params)
+        rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+    except BaseException:
+        stack.close()
+        raise
+    if not rows:
+        stack.close()
         return None
-    finally:
-        if cursor:
-            cursor.close()
-        if connection:
-            connection.close()
 
+    def dumps(value):
+        return app.json.dumps(value, separators=(',', ':'))
+
+    if key is None:
+        head, tail = '[', ']'
+    else:
+        head = '{' + ''.join(f"{dumps(name)}:{dumps(value)}," for name, value in envelope.items()) + f"{dumps(key)}:["
+        tail = ']}'
+
+    def generate(rows):
+        yield head
+        separator = ''
+        while rows:
+            yield separator + ','.join(dumps(dict(zip(fields, row))) for row in rows)
+            separator = ','
+            rows = cursor.fetchmany(STREAM_BATCH_SIZE)
+        yield tail
+
+    response = Response(generate(rows), mimetype='application/json')
+    response.call_on_close(stack.close)
+    return response
 
 @app.route('/register', methods=['POST'])
 @db_operation  # Using a decorator
@@ -173,7 +339,7 @@ def logout(cursor):
 def delete_user(cursor, user_id):
     """
     Deletes the user account.
-    Associated likes and comments are also deleted before the user is deleted.
+    Associated likes and comments are deleted with it (ON DELETE CASCADE).
     Args:
         user_id (int): ID of the user to delete.
     Returns:
@@ -200,12 +366,9 @@ def delete_user(cursor, user_id):
         if not check_password_hash(user[0], current_password):
             return jsonify({'error': 'Incorrect current password'}), 401
 
-        # Delete likes and comments before deleting the user
-        cursor.execute("DELETE FROM book_likes WHERE user_id = CAST(%s AS VARCHAR)", (user_id,))
-        cursor.execute("DELETE FROM book_reviews WHERE user_id = CAST(%s AS VARCHAR)", (user_id,))
-
-        # Delete the user
+        # Delete the user; their likes and comments cascade
         cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+        update_user_profiles(user_id, lambda profiles: profiles.remove_user(user_id))
 
         return jsonify({'message': 'User successfully deleted'}), 200
 
@@ -314,23 +477,29 @@ def ai_suggestions(user_id):
 
     Parameters:
         category (str): The category from which to retrieve recommendations.
+        n (int): Number of recommendations (default 30).
 
     Return Value:
         json: List of recommended books.
     """
 
-    print(user_id)
-    
-
     try:
         
         category = request.args.get('category', '')
-        print(category)
-        # Get the recommendations
-        recommendations = recommender.recommend_books(user_id, category)
+        n_recommendations = int(request.args.get('n', 30))
+        model = get_recommender()
+
+        # Pick up ratings and likes written by other processes before trusting the cache
+        refresh_user_profiles(model)
 
-        # Convert DataFrame to JSON format
-        recommendations_list = recommendations.to_dict('records')
+        recommendations_list = recommendation_cache.get(user_id, category, n_recommendations, model.model_version)
+        if recommendations_list is None:
+            # Get the recommendations
+            recommendations = model.recommend_books(user_id, category, n_recommendations)
+
+            # Convert DataFrame to JSON format
+            recommendations_list = recommendations.to_dict('records')
+            recommendation_cache.set(user_id, category, n_recommendations, model.model_version, recommendations_list)
 
         return jsonify(recommendations_list)
 
@@ -339,121 +508,466 @@ def ai_suggestions(user_id):
         return jsonify({"error": "An error occurred", "message": str(e)}), 500
 
 
+@app.route('/api/ai-suggestions/text', methods=['GET'])
+def ai_suggestions_for_text():
+    """
+    Endpoint for AI-powered recommendations of the books most similar to a
+    free text, such as a description of the book the user is looking for.
+    Answered from the recommender in memory, without a database query.
+
+    Parameters:
+        q (str): The text.
+        category (str): Only recommend books of this category (optional).
+        n (int): Number of recommendations (default 15).
+
+    Return Value:
+        json: List of recommended books with their similarity_score; books
+        sharing no term with the text are left out.
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "q is required"}), 400
+    if len(text) > MAX_QUERY_TEXT_LENGTH:
+        return jsonify({"error": f"q must be at most {MAX_QUERY_TEXT_LENGTH} characters"}), 400
+
+    try:
+        category = request.args.get('category') or None
+        n_recommendations = int(request.args.get('n', 15))
+        recommendations = get_recommender().recommend_for_text(text, category, n_recommendations)
+        return jsonify(recommendations.to_dict('records'))
+
+    except ValueError as e:
+        return jsonify({"error": "Invalid request", "message": str(e)}), 400
+    except Exception as e:
+        print("An error occurred while getting AI suggestions for a text:", e)
+        return jsonify({"error": "An error occurred", "message": str(e)}), 500
+
+
+@app.route('/api/ai-suggestions/batch', methods=['POST'])
+def ai_suggestions_batch():
+    """
+    Endpoint for AI-powered book recommendations for many users and categories at once.
+
+    Request Body:
+        pairs (list): Objects with user_id and category, or
+        user_ids (list) and categories (list): Every combination of the two.
+        n (int): Number of recommendations per pair (default 30).
+
+    Send "Accept: application/x-ndjson" (or ?stream=1) to receive one JSON
+    line per pair as soon as it is scored.
+
+    Return Value:
+        json: {"results": [{"user_id", "category", "recommendations"}, ...]}
+    """
+    try:
+        data = request.get_json() or {}
+        if 'pairs' in data:
+            pairs = [(int(pair['user_id']), pair.get('category', '')) for pair in data['pairs']]
+        else:
+            pairs = [(int(user_id), category)
+                     for user_id in data.get('user_ids', [])
+                     for category in data.get('categories', [])]
+        n_recommendations = int(data.get('n', 30))
+
+        if not pairs:
+            return jsonify({"error": "pairs, or user_ids and categories, are required"}), 400
+        if len(pairs) > MAX_SUGGESTION_BATCH:
+            return jsonify({"error": f"At most {MAX_SUGGESTION_BATCH} pairs are allowed per request"}), 400
+
+        model = get_recommender()
+        refresh_user_profiles(model)
+        results = model.iter_recommend_batch(pairs, n_recommendations)
+
+        def result_record(pair, recommendations):
+            return {"user_id": pair[0], "category": pair[1],
+                    "recommendations": recommendations.to_dict('records')}
+
+        stream = request.args.get('stream') == '1' or \
+            request.accept_mimetypes.best == 'application/x-ndjson'
+        if stream:
+            def generate():
+                for pair, recommendations in results:
+                    yield app.json.dumps(result_record(pair, recommendations)) + "\n"
+            return Response(generate(), mimetype='application/x-ndjson')
+
+        return jsonify({"results": [result_record(pair, recommendations) for pair, recommendations in results]})
+
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": "Invalid batch request", "message": str(e)}), 400
+    except Exception as e:
+        print("An error occurred while getting batch AI suggestions:", e)
+        return jsonify({"error": "An error occurred", "message": str(e)}), 500
+
+
+def admin_required(func):
+    """Allow the request only with an "Authorization: Bearer <ADMIN_TOKEN>" header."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        token = os.getenv("ADMIN_TOKEN")
+        if not token:
+            return jsonify({"error": "Admin endpoints are disabled; set ADMIN_TOKEN to enable them"}), 403
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+            return jsonify({"error": "Unauthorized"}), 401
+        return func(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/admin/recommender/ingest', methods=['POST'])
+@admin_required
+def admin_ingest():
+    """
+    Add books that are new or changed in the database to the recommender
+    without a full refit. needs_refit in the response reports whether enough
+    has drifted since the last fit to warrant one.
+    """
+    try:
+        model, ingested = ingest_recommender()
+        if model is None:
+            return jsonify({"error": "Books were deleted; the recommender needs a full refit", "needs_refit": True}), 409
+        return jsonify({
+            "model_version": model.model_version,
+            "ingested": ingested,
+            "ingested_since_fit": model.ingested_books,
+            "needs_refit": model.needs_refit,
+        })
+    except Exception as e:
+        print("An error occurred while ingesting books:", e)
+        return jsonify({"error": "An error occurred while ingesting books", "message": str(e)}), 500
+
+
+@app.route('/admin/recommender/rebuild', methods=['POST'])
+@admin_required
+def admin_rebuild():
+    """
+    Rebuild the recommender in the background and swap it in once it is
+    validated; ?refit=1 fits a new model even if ingesting would do. Poll
+    GET /admin/recommender for the outcome.
+    """
+    refit = request.args.get('refit') == '1'
+    if not model_manager.rebuild(refit=refit):
+        return jsonify({"error": "A rebuild is already running", **model_manager.stats()}), 409
+    return jsonify(model_manager.stats()), 202
+
+
+@app.route('/admin/recommender', methods=['GET'])
+@admin_required
+def admin_recommender():
+    """Version of the shared recommender and the state of its rebuilds."""
+    return jsonify(model_manager.stats())
+
+
+@app.route('/admin/stats', methods=['GET'])
+@admin_required
+def admin_stats():
+    """Runtime counters of the backend's caches and database pool."""
+    return jsonify({
+        "recommendation_cache": recommendation_cache.stats(),
+        "catalog_cache": catalog_cache.stats(),
+        "db_pool": get_pool().stats(),
+        "thumbnails": thumbnail_resolver.stats(),
+        "recommender": model_manager.stats(),
+    })
+
+
+def catalog_response(func):
+    """
+    Serve a read-only catalog endpoint with conditional GET and caching.
+
+    The ETag and Last-Modified come from the catalog_version row (migration
+    008), read before the endpoint runs, and the current CATALOG_RATINGS_LAG
+    window, which picks up rating aggregates. A request whose If-None-Match or
+    If-Modified-Since still matches gets an empty 304, and a repeated request
+    is answered from catalog_cache without running the endpoint. Responses
+    other than 200 are neither cached nor tagged.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            with db_connection() as connection, connection.cursor() as cursor:
+                cursor.execute("SELECT version, updated_at FROM catalog_version;")
+                version, updated_at = cursor.fetchone()
+        except psycopg2.Error as e:
+            print("Could not read the catalog version, serving without caching:", e)
+            return func(*args, **kwargs)
+
+        window = int(time.time()) // CATALOG_RATINGS_LAG
+        etag = f"catalog-{version}-{window}"
+        last_modified = max(updated_at, datetime.fromtimestamp(window * CATALOG_RATINGS_LAG, timezone.utc))
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            catalog_cache.not_modified += 1
+            response = Response(status=304)
+        else:
+            # Bodies are kept as sent, compressed once per accepted encoding
+            key = f"{accepted_encoding()}:{request.full_path}"
+            cached = catalog_cache.get(etag, key)
+            if cached is not None:
+                mimetype, body, content_encoding = cached
+                response = Response(body, mimetype=mimetype)
+                if content_encoding:
+                    response.headers['Content-Encoding'] = content_encoding
+                    response.vary.add('Accept-Encoding')
+            else:
+                response = app.make_response(func(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if not response.is_streamed:  # Large lists are streamed instead of kept
+                    response = compress_response(response)
+                    catalog_cache.set(etag, key, response.mimetype, response.get_data(),
+                                      response.headers.get('Content-Encoding'))
+        # Weak, since the same version may be sent with different encodings
+        response.set_etag(etag, weak=True)
+        response.last_modified = last_modified
+        response.cache_control.public = True
+        response.cache_control.max_age = CATALOG_MAX_AGE
+        return response
+    return wrapper
+
+
 @app.route('/book/<isbn13>', methods=['GET'])
+@catalog_response
 def get_book_by_isbn(isbn13):
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-        cursor.execute("""
-            SELECT isbn13, title, subtitle, authors, categories, 
-                   description, published_year, average_rating, num_pages, ratings_count 
-            FROM books
-            WHERE isbn13 = %s;
-        """, (isbn13,))
-        book = cursor.fetchone()
-
-        if book:
-            book_data = {
-                "isbn13": book[0],
-                "title": book[1],
-                "subtitle": book[2],
-                "authors": book[3],
-                "categories": book[4],
-                "thumbnail": get_book_thumbnail(isbn13),  # Thumbnail'i al
-                "description": book[5],
-                "published_year": book[6],
-                "average_rating": book[7],
-                "num_pages": book[8],
-                "ratings_count": book[9]
-            }
-            cursor.close()
-            connection.close()
-            return jsonify(book_data)
-        else:
-            return jsonify({"error": "Book not found"}), 404
+        with db_connection() as connection, connection.cursor() as cursor:
+            books = fetch_book_cards(cursor, "b.isbn13 = %s", (isbn13,))
+
+            if books:
+                return jsonify(books[0])
+            else:
+                return jsonify({"error": "Book not found"}), 404
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def parse_isbn13_list():
+    """ISBN13s of the repeated or comma-separated isbn13 parameters, without duplicates, in order."""
+    isbn13_list = []
+    for value in request.args.getlist('isbn13'):
+        isbn13_list.extend(isbn13.strip() for isbn13 in value.split(',') if isbn13.strip())
+    return list(dict.fromkeys(isbn13_list))
+
+@app.route('/books/batch', methods=['GET'])
+def get_books_batch():
+    """
+    Return the books for many ISBN13s in one query, in the requested order.
+    ISBN13s are passed as repeated or comma-separated isbn13 parameters;
+    unknown ones are left out.
+    """
+    isbn13_list = parse_isbn13_list()
+
+    if not isbn13_list:
+        return jsonify({"error": "At least one isbn13 is required"}), 400
+    if len(isbn13_list) > MAX_BOOK_BATCH:
+        return jsonify({"error": f"At most {MAX_BOOK_BATCH} books are allowed per request"}), 400
+
+    try:
+        with db_connection() as connection, connection.cursor() as cursor:
+            books = fetch_book_cards(cursor, "b.isbn13 = ANY(%s)", (isbn13_list,))
+
+        by_isbn13 = {book["isbn13"]: book for book in books}
+        return jsonify([by_isbn13[isbn13] for isbn13 in isbn13_list if isbn13 in by_isbn13])
+
+    except Exception as e:
+        print("An error occurred while fetching books in batch:", e)
+        return jsonify({"error": "An error occurred", "message": str(e)}), 500
+
+# Keyset orders of /books: sort name -> (key columns, comparison with the cursor, direction).
+# {t} is the table whose isbn13 is used, so category pages walk book_categories' primary key.
+BOOK_SORTS = {
+    'isbn13': (["{t}.isbn13"], ">", "ASC"),
+    'rating': (["COALESCE(b.average_rating, 0)", "{t}.isbn13"], "<", "DESC"),
+}
+
+# Largest page returned by cursor pagination
+MAX_PAGE_SIZE = 200
+
+def encode_cursor(sort, key):
+    """Opaque cursor pointing after the row with the given sort key."""
+    return base64.urlsafe_b64encode(json.dumps([sort, list(key)]).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor, sort, key_length=None):
+    """
+    Return the sort key stored in a cursor, or raise ValueError if it is not
+    valid for this sort. key_length defaults to the key columns of BOOK_SORTS[sort].
+    """
+    if key_length is None:
+        key_length = len(BOOK_SORTS[sort][0])
+    try:
+        cursor_sort, key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if cursor_sort != sort or not isinstance(key, list) or len(key) != key_length:
+        raise ValueError("Cursor does not match the requested sort")
+    return key
+
+def offset_page_query(fields, category, limit, offset):
+    """Query and parameters of an OFFSET page of /books, optionally in one category."""
+    query = f"""
+        SELECT {', '.join(BOOK_FIELDS[field] for field in fields)}
+        FROM {"book_categories bc JOIN books b ON b.isbn13 = bc.isbn13 WHERE bc.category = %s" if category else "books b"}
+        ORDER BY {"bc" if category else "b"}.isbn13
+        LIMIT %s OFFSET %s;
+    """
+    return query, (category, limit, offset) if category else (limit, offset)
+
+def keyset_page_query(fields, sort, category, key, limit):
+    """
+    Query and parameters of a keyset page of /books: the books after key (or
+    the first ones) in the order of BOOK_SORTS[sort], followed by their key
+    columns, with one extra row telling whether there is a next page.
+    """
+    table = "bc" if category else "b"
+    key_columns, comparison, direction = BOOK_SORTS[sort]
+    key_columns = [column.format(t=table) for column in key_columns]
+    conditions, params = [], []
+    if category:
+        conditions.append("bc.category = %s")
+        params.append(category)
+    if key is not None:
+        conditions.append(f"({', '.join(key_columns)}) {comparison} ({', '.join(['%s'] * len(key))})")
+        params.extend(key)
+    query = f"""
+        SELECT {', '.join(BOOK_FIELDS[field] for field in fields)},
+               {', '.join(key_columns)}
+        FROM {"book_categories bc JOIN books b ON b.isbn13 = bc.isbn13" if category else "books b"}
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY {', '.join(f"{column} {direction}" for column in key_columns)}
+        LIMIT %s;
+    """
+    return query, (*params, limit + 1)
+
 @app.route('/books', methods=['GET'])
+@catalog_response
 def get_books():
+    """
+    List books, optionally filtered by category.
+
+    With a cursor parameter (empty for the first page) the list is paginated
+    by keyset on an indexed sort key (sort=isbn13, the default, or
+    sort=rating) and returned as {"books": [...], "next_cursor": ...}, where
+    next_cursor is null on the last page. Without one, the page/limit
+    parameters select an OFFSET page as before.
+
+    fields (e.g. fields=title,authors,thumbnail) limits the books to those
+    fields; isbn13 is always included.
+    """
+    if 'cursor' in request.args:
+        return get_books_by_cursor()
     try:
         page = int(request.args.get('page', 1))  # Default to page 1 if not provided
         limit = int(request.args.get('limit', 50))  # Default to 50 books per page
         category = request.args.get('category', '')  # Kategori parametresi
+        fields = parse_fields(BOOK_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        offset = (page - 1) * limit  # Calculate the offset
+    offset = (page - 1) * limit  # Calculate the offset
+    # If there is a category parameter, filter by category
+    query, params = offset_page_query(fields, category, limit, offset)
 
-        connection = get_db_connection()
-        cursor = connection.cursor()
+    try:
+        # Pages larger than cursor pages are streamed instead of built in memory
+        if limit > MAX_PAGE_SIZE:
+            return stream_json_list(query, params, fields) or jsonify([])
 
-        # If there is a category parameter, filter by category
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute(query, params)
+            books = cursor.fetchall()
 
-        if category:
-            cursor.execute("""
-                SELECT isbn13, title, subtitle, authors, categories, thumbnail, 
-                       description, published_year, average_rating, num_pages, ratings_count 
-                FROM books
-                WHERE categories LIKE %s
-                LIMIT %s OFFSET %s;
-            """, (f'%{category}%', limit, offset))
-        else:
-            cursor.execute("""
-                SELECT isbn13, title, subtitle, authors, categories, thumbnail, 
-                       description, published_year, average_rating, num_pages, ratings_count 
-                FROM books
-                LIMIT %s OFFSET %s;
-            """, (limit, offset))
+        return jsonify([dict(zip(fields, book)) for book in books])
 
-        books = cursor.fetchall()
+    except Exception as e:
+        print("An error occurred:", e)
+        return jsonify({"error": "An error occurred", "message": str(e)}), 500
 
-        book_list = [{
-            "isbn13": book[0],
-            "title": book[1],
-            "subtitle": book[2],
-            "authors": book[3],
-            "categories": book[4],
-            "thumbnail": book[5],
-            "description": book[6],
-            "published_year": book[7],
-            "average_rating": book[8],
-            "num_pages": book[9],
-            "ratings_count": book[10]
-        } for book in books]
+def get_books_by_cursor():
+    sort = request.args.get('sort', 'isbn13')
+    if sort not in BOOK_SORTS:
+        return jsonify({"error": f"sort must be one of {', '.join(BOOK_SORTS)}"}), 400
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), MAX_PAGE_SIZE)
+        key = decode_cursor(request.args['cursor'], sort) if request.args['cursor'] else None
+        fields = parse_fields(BOOK_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    category = request.args.get('category', '')
 
-        cursor.close()
-        connection.close()
+    try:
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute(*keyset_page_query(fields, sort, category, key, limit))
+            books = cursor.fetchall()
 
-        return jsonify(book_list)
-        
+        next_cursor = encode_cursor(sort, books[limit - 1][len(fields):]) if len(books) > limit else None
+        book_list = [dict(zip(fields, book)) for book in books[:limit]]
+
+        return jsonify({"books": book_list, "next_cursor": next_cursor})
 
     except Exception as e:
         print("An error occurred:", e)
         return jsonify({"error": "An error occurred", "message": str(e)}), 500
 
-@app.route('/categories/with-book-count', methods=['GET'])
-def get_categories_with_book_count():
+@app.route('/search', methods=['GET'])
+def search():
+    """
+    Search books by title, subtitle, authors and description, best match first.
+
+    q is the search text: words, "quoted phrases", -excluded words and or, as
+    in web search; titles and authors also match with typos. category limits
+    the results to one category. Pages are returned as {"books": [...],
+    "next_cursor": ...} like /books; pass next_cursor back as cursor for the
+    next page, with the same q and category.
+    """
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({"error": "q is required"}), 400
+    if len(text) > MAX_SEARCH_LENGTH:
+        return jsonify({"error": f"q must be at most {MAX_SEARCH_LENGTH} characters"}), 400
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
+        limit = min(max(int(request.args.get('limit', 20)), 1), MAX_PAGE_SIZE)
+        cursor_param = request.args.get('cursor', '')
+        after = decode_cursor(cursor_param, 'search', key_length=2) if cursor_param else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    category = request.args.get('category', '')
 
-        cursor.execute("""
-            SELECT categories, COUNT(*) 
-            FROM books
-            GROUP BY categories;
-        """)
-        categories_with_count = cursor.fetchall()
+    try:
+        with db_connection() as connection, connection.cursor() as cursor:
+            matches = search_books(cursor, text, category=category, limit=limit + 1, after=after)
+            books = fetch_book_cards(cursor, "b.isbn13 = ANY(%s)", ([isbn13 for isbn13, _ in matches[:limit]],))
+
+        # One extra match tells whether there is a next page; the cursor is (score, isbn13)
+        next_cursor = None
+        if len(matches) > limit:
+            last_isbn13, last_score = matches[limit - 1]
+            next_cursor = encode_cursor('search', [last_score, last_isbn13])
+        by_isbn13 = {book["isbn13"]: book for book in books}
+        return jsonify({
+            "books": [by_isbn13[isbn13] for isbn13, _ in matches[:limit] if isbn13 in by_isbn13],
+            "next_cursor": next_cursor,
+        })
+
+    except Exception as e:
+        print("An error occurred while searching books:", e)
+        return jsonify({"error": "An error occurred", "message": str(e)}), 500
 
-        #  combine the name of the categories and the number of books
-        categories_list = [{
-            "category": category[0],
-            "book_count": category[1]
-        } for category in categories_with_count]
+@app.route('/categories/with-book-count', methods=['GET'])
+@catalog_response
+def get_categories_with_book_count():
+    try:
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("""
+                SELECT category, book_count
+                FROM category_counts
+                ORDER BY category;
+            """)
+            categories_with_count = cursor.fetchall()
 
-        cursor.close()
-        connection.close()
+            #  combine the name of the categories and the number of books
+            categories_list = [{
+                "category": category[0],
+                "book_count": category[1]
+            } for category in categories_with_count]
 
-        return jsonify(categories_list)
+            return jsonify(categories_list)
 
     except Exception as e:
         print("An error occurred:", e)
@@ -462,29 +976,38 @@ def get_categories_with_book_count():
 
 @app.route('/books/by-author/<string:author_name>', methods=['GET'])
 def books_by_author(author_name):
-    try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
+    """
+    Return the ISBN13s of an author's books. With ?expand=1 the full book
+    records are included as well, fetched by the same single query.
 
-        # Query to get ISBN13 numbers of books by the author's name
-        cursor.execute("""
-            SELECT b.isbn13
-            FROM books b
-            WHERE b.authors ILIKE %s;  -- Fetch books matching the author's name
-        """, (f"%{author_name}%",))  # Search using the author's name as a parameter
+    Authors containing the name are found through the authors trigram index;
+    if there are none, authors similar to the name (e.g. misspelled) are used.
+    """
+    expand = request.args.get('expand', '').lower() in ('1', 'true')
 
-        books = cursor.fetchall()
+    def find_books(cursor, where, param):
+        if expand:
+            return fetch_book_cards(cursor, where, (param,))
+        # Query to get ISBN13 numbers of books by the author's name
+        cursor.execute(f"SELECT b.isbn13 FROM books b WHERE {where};", (param,))
+        return [{"isbn13": book[0]} for book in cursor.fetchall()]
 
-        if not books:
-            return jsonify({"error": "No books found for this author."}), 404
+    try:
+        with db_connection() as connection, connection.cursor() as cursor:
+            books = find_books(cursor, "b.authors ILIKE %s", f"%{author_name}%")
+            if not books:
+                set_fuzzy_threshold(cursor)
+                books = find_books(cursor, FUZZY_AUTHOR_SQL, author_name)
 
-        # Return the ISBN13 numbers as a list
-        isbn13_list = [book[0] for book in books]
+            if not books:
+                return jsonify({"error": "No books found for this author."}), 404
 
-        cursor.close()
-        connection.close()
+            # Return the ISBN13 numbers as a list
+            isbn13_list = [book["isbn13"] for book in books]
 
-        return jsonify({"author": author_name, "isbn13_list": isbn13_list})
+            if expand:
+                return jsonify({"author": author_name, "isbn13_list": isbn13_list, "books": books})
+            return jsonify({"author": author_name, "isbn13_list": isbn13_list})
 
     except Exception as e:
         print("An error occurred while fetching books by author:", e)
@@ -496,44 +1019,21 @@ def books_by_author(author_name):
 def liked_books(user_id):
     if request.method == 'GET':
         try:
-            connection = get_db_connection()
-            cursor = connection.cursor()
-
-            # Fetch books liked by the user, including all book details
-            cursor.execute("""
-                SELECT b.isbn13, b.title, b.subtitle, b.authors, b.categories, b.thumbnail, 
-                       b.description, b.published_year, b.average_rating, b.num_pages, b.ratings_count
+            fields = parse_fields(BOOK_FIELDS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            # Fetch books liked by the user, with the requested details
+            response = stream_json_list(f"""
+                SELECT {', '.join(BOOK_FIELDS[field] for field in fields)}
                 FROM books b
                 JOIN book_likes bl ON b.isbn13 = bl.isbn13
-                WHERE CAST(bl.user_id AS INTEGER) = %s;  -- Cast bl.user_id to integer
-            """, (user_id,))
-            
-            liked_books = cursor.fetchall()
+                WHERE bl.user_id = %s;
+            """, (user_id,), fields, key="liked_books", user_id=user_id)
 
-            if not liked_books:
+            if response is None:
                 return jsonify({"error": "No liked books found for this user."}), 404
-
-            liked_books_list = []
-            for book in liked_books:
-                liked_book = {
-                    "isbn13": book[0],
-                    "title": book[1],
-                    "subtitle": book[2],
-                    "authors": book[3],
-                    "categories": book[4],
-                    "thumbnail": book[5],
-                    "description": book[6],
-                    "published_year": book[7],
-                    "average_rating": book[8],
-                    "num_pages": book[9],
-                    "ratings_count": book[10]
-                }
-                liked_books_list.append(liked_book)
-
-            cursor.close()
-            connection.close()
-
-            return jsonify({"user_id": user_id, "liked_books": liked_books_list})
+            return response
 
         except Exception as e:
             print("An error occurred while fetching liked books:", e)
@@ -546,20 +1046,17 @@ def liked_books(user_id):
             if not isbn13:
                 return jsonify({"error": "ISBN13 is required to like a book."}), 400
 
-            connection = get_db_connection()
-            cursor = connection.cursor()
-
-            cursor.execute("""
-                INSERT INTO book_likes (user_id, isbn13)
-                VALUES (%s, %s)
-                ON CONFLICT (user_id, isbn13) DO NOTHING;
-            """, (user_id, isbn13))
+            with db_connection() as connection, connection.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO book_likes (user_id, isbn13)
+                    VALUES (%s, %s)
+                    ON CONFLICT (user_id, isbn13) DO NOTHING;
+                """, (user_id, isbn13))
 
-            connection.commit()
-            cursor.close()
-            connection.close()
+                connection.commit()
+                update_user_profiles(user_id, lambda profiles: profiles.add_like(user_id, isbn13))
 
-            return jsonify({"message": f"Book with ISBN13 {isbn13} liked by user {user_id}."}), 201
+                return jsonify({"message": f"Book with ISBN13 {isbn13} liked by user {user_id}."}), 201
 
         except Exception as e:
             print("An error occurred while liking the book:", e)
@@ -572,65 +1069,43 @@ def liked_books(user_id):
             if not isbn13:
                 return jsonify({"error": "ISBN13 is required to delete a like."}), 400
 
-            connection = get_db_connection()
-            cursor = connection.cursor()
-
-            cursor.execute("""
-                DELETE FROM book_likes 
-                WHERE CAST(user_id AS INTEGER) = %s AND isbn13 = %s;
-            """, (user_id, isbn13))
+            with db_connection() as connection, connection.cursor() as cursor:
+                cursor.execute("""
+                    DELETE FROM book_likes 
+                    WHERE user_id = %s AND isbn13 = %s;
+                """, (user_id, isbn13))
 
-            connection.commit()
-            cursor.close()
-            connection.close()
+                connection.commit()
+                update_user_profiles(user_id, lambda profiles: profiles.remove_like(user_id, isbn13))
 
-            return jsonify({"message": f"Like for book with ISBN13 {isbn13} deleted by user {user_id}."}), 200
+                return jsonify({"message": f"Like for book with ISBN13 {isbn13} deleted by user {user_id}."}), 200
 
         except Exception as e:
             print("An error occurred while deleting the book like:", e)
             return jsonify({"error": "An error occurred while deleting the book like", "message": str(e)}), 500
         
+# Fields of the user's rated books, with the user's rating as user_rating
+REVIEW_FIELDS = {**BOOK_FIELDS, "user_rating": "br.rating"}
+DEFAULT_REVIEW_FIELDS = [field for field in REVIEW_FIELDS if field != "subtitle"]
+
 @app.route('/books/review/user/<int:userId>', methods=['GET', 'POST'])
 def review_book(userId):
     if request.method == 'GET':
         try:
-            connection = get_db_connection()
-            cursor = connection.cursor()
-
-            cursor.execute("""
-                SELECT b.isbn13, b.title, b.authors, b.categories, b.thumbnail, 
-                       b.description, b.published_year, b.average_rating, b.num_pages, b.ratings_count,
-                       br.rating
-                FROM books b
-                LEFT JOIN book_reviews br ON b.isbn13 = br.isbn13
-                WHERE CAST(br.user_id AS INTEGER) = %s;
-            """, (userId,))
-
-            result = cursor.fetchall()
-
-            if not result:
+            fields = parse_fields(REVIEW_FIELDS, default=DEFAULT_REVIEW_FIELDS)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            response = stream_json_list(f"""
+                SELECT {', '.join(REVIEW_FIELDS[field] for field in fields)}
+                FROM book_reviews br
+                JOIN books b ON b.isbn13 = br.isbn13
+                WHERE br.user_id = %s;
+            """, (userId,), fields, key="reviews", user_id=userId)
+
+            if response is None:
                 return jsonify({"error": "No books found or no reviews available for this user"}), 404
-
-            books_reviews = []
-            for row in result:
-                books_reviews.append({
-                    "isbn13": row[0],
-                    "title": row[1],
-                    "authors": row[2],
-                    "categories": row[3],
-                    "thumbnail": row[4],
-                    "description": row[5],
-                    "published_year": row[6],
-                    "average_rating": row[7],
-                    "num_pages": row[8],
-                    "ratings_count": row[9],
-                    "user_rating": row[10]
-                })
-
-            cursor.close()
-            connection.close()
-
-            return jsonify({"user_id": userId, "reviews": books_reviews})
+            return response
 
         except Exception as e:
             print("An error occurred while fetching books and reviews for user:", e)
@@ -645,45 +1120,12 @@ def review_book(userId):
             if not isbn13 or not rating:
                 return jsonify({"error": "ISBN and rating are required"}), 400
 
-            connection = get_db_connection()
-            cursor = connection.cursor()
+            with db_connection() as connection, connection.cursor() as cursor:
+                # Upsert the rating, update the book's aggregates and read the card back in one statement
+                result = rate_books(cursor, [(userId, isbn13, int(rating))])[0]
+                connection.commit()
+                update_user_profiles(userId, lambda profiles: profiles.set_rating(userId, isbn13, int(rating)))
 
-            # Add or update the rating using ON CONFLICT
-            cursor.execute("""
-                INSERT INTO book_reviews (user_id, isbn13, rating)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (user_id, isbn13) 
-                DO UPDATE SET rating = EXCLUDED.rating
-                RETURNING user_id, isbn13, 
-                        CASE WHEN xmax = 0 THEN 1 ELSE 0 END AS is_new_review;
-            """, (userId, isbn13, rating))
-
-            is_new_row = cursor.fetchone()[0]
-
-            if is_new_row:
-                cursor.execute("""
-                    UPDATE books 
-                    SET ratings_count = ratings_count + 1
-                    WHERE isbn13 = %s;
-                """, (isbn13,))
-
-            connection.commit()
-
-            # Get updated book and rating information
-            cursor.execute("""
-                SELECT b.isbn13, b.title, b.authors, b.categories, b.thumbnail, 
-                b.description, b.published_year, b.average_rating, b.num_pages, b.ratings_count,
-                br.rating
-                FROM books b
-                LEFT JOIN book_reviews br ON b.isbn13 = br.isbn13
-                WHERE br.user_id = %s AND b.isbn13 = %s;
-            """, (userId, isbn13))  
-            result = cursor.fetchone()
-
-            cursor.close()
-            connection.close()
-
-            if result:
                 book_review = {
                     "isbn13": result[0],
                     "title": result[1],
@@ -695,78 +1137,271 @@ def review_book(userId):
                     "average_rating": result[7],
                     "num_pages": result[8],
                     "ratings_count": result[9],
-                    "user_rating": result[10]
+                    "user_rating": result[11]
                 }
                 return jsonify({"reviews": [book_review]}), 200
-            else:
-                return jsonify({"error": "Book not found"}), 404
 
+        except psycopg2.errors.ForeignKeyViolation:
+            return jsonify({"error": "Book or user not found"}), 404
+        except psycopg2.errors.CheckViolation:
+            return jsonify({"error": "Rating must be between 1 and 5"}), 400
         except Exception as e:
             print("An error occurred while submitting rating:", e)
             return jsonify({"error": "An error occurred while submitting rating", "message": str(e)}), 500
 
 
+def rate_books(cursor, ratings):
+    """
+    Save (user_id, isbn13, rating) triples with a single statement. Each
+    rating is upserted into book_reviews, and each book's ratings_count,
+    rating_sum and average_rating are adjusted by the change: a first
+    rating adds to the count, a changed rating only moves the sum.
+    A (user_id, isbn13) pair may appear only once per call.
+
+    The raters' users rows, which the state_version trigger updates, and
+    then the rated books are locked first, in user_id and isbn13 order, so
+    concurrent calls sharing users or books cannot deadlock. The upsert then
+    runs in a new snapshot, taken once every concurrent rating of those
+    books has committed, so it reads the latest previous ratings and counts
+    each first rating once.
+
+    Returns one row per rating: the book's card columns as updated
+    (isbn13, title, authors, categories, thumbnail, description,
+    published_year, average_rating, num_pages, ratings_count), then
+    user_id and rating.
+    """
+    cursor.execute("SELECT 1 FROM users WHERE user_id = ANY(%s) ORDER BY user_id FOR UPDATE;",
+                   (sorted({user_id for user_id, _, _ in ratings}),))
+    cursor.execute("SELECT 1 FROM books WHERE isbn13 = ANY(%s) ORDER BY isbn13 FOR UPDATE;",
+                   (sorted({isbn13 for _, isbn13, _ in ratings}),))
+    return psycopg2.extras.execute_values(cursor, """
+        WITH input (user_id, isbn13, rating) AS (
+            VALUES %s
+        ), previous AS (
+            SELECT br.user_id, br.isbn13, br.rating
+            FROM book_reviews br
+            JOIN input i ON i.user_id = br.user_id AND i.isbn13 = br.isbn13
+        ), review AS (  -- previous was read before this upsert, and the locked books keep it current
+            INSERT INTO book_reviews (user_id, isbn13, rating)
+            SELECT user_id, isbn13, rating FROM input
+            ON CONFLICT (user_id, isbn13)
+            DO UPDATE SET rating = EXCLUDED.rating, review_date = CURRENT_TIMESTAMP
+            RETURNING user_id, isbn13, rating
+        ), change AS (
+            SELECT r.isbn13,
+                   COUNT(*) FILTER (WHERE p.rating IS NULL) AS count_delta,
+                   SUM(r.rating - COALESCE(p.rating, 0)) AS sum_delta
+            FROM review r
+            LEFT JOIN previous p ON p.user_id = r.user_id AND p.isbn13 = r.isbn13
+            GROUP BY r.isbn13
+        ), book AS (
+            UPDATE books b
+            SET ratings_count = COALESCE(b.ratings_count, 0) + c.count_delta,
+                rating_sum = COALESCE(b.rating_sum, 0) + c.sum_delta,
+                average_rating = (COALESCE(b.rating_sum, 0) + c.sum_delta)
+                                 / NULLIF(COALESCE(b.ratings_count, 0) + c.count_delta, 0)
+            FROM change c
+            WHERE b.isbn13 = c.isbn13
+            RETURNING b.isbn13, b.title, b.authors, b.categories, b.thumbnail,
+                      b.description, b.published_year, b.average_rating, b.num_pages, b.ratings_count
+        )
+        SELECT book.*, review.user_id, review.rating
+        FROM review
+        JOIN book ON book.isbn13 = review.isbn13;
+    """, sorted(ratings), template="(%s::integer, %s, %s::integer)", page_size=len(ratings), fetch=True)
+
+
+# Maximum number of ratings accepted by /books/review/batch
+MAX_RATING_BATCH = 1000
+
+@app.route('/books/review/batch', methods=['POST'])
+def review_books_batch():
+    """
+    Save many ratings in one statement.
+
+    Request body:
+        ratings (list): Objects with user_id, isbn13 and rating (1-5). If the
+        same user rates the same book more than once, the last rating wins.
+
+    Returns:
+        json: {"books": [{"isbn13", "average_rating", "ratings_count"}, ...]}
+        with the updated aggregates of every rated book.
+    """
+    try:
+        data = request.get_json() or {}
+        ratings = {}
+        for item in data.get('ratings', []):
+            rating = int(item['rating'])
+            if not 1 <= rating <= 5:
+                return jsonify({"error": "Rating must be between 1 and 5"}), 400
+            ratings[(int(item['user_id']), str(item['isbn13']))] = rating
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Each rating needs a user_id, isbn13 and rating"}), 400
+
+    if not ratings:
+        return jsonify({"error": "ratings are required"}), 400
+    if len(ratings) > MAX_RATING_BATCH:
+        return jsonify({"error": f"At most {MAX_RATING_BATCH} ratings are allowed per request"}), 400
+
+    try:
+        with db_connection() as connection, connection.cursor() as cursor:
+            rows = rate_books(cursor, [(user_id, isbn13, rating) for (user_id, isbn13), rating in ratings.items()])
+            connection.commit()
+
+        for (user_id, isbn13), rating in ratings.items():
+            update_user_profiles(user_id, lambda profiles: profiles.set_rating(user_id, isbn13, rating))
+
+        books = {row[0]: {"isbn13": row[0], "average_rating": row[7], "ratings_count": row[9]} for row in rows}
+        return jsonify({"books": list(books.values())}), 200
+
+    except psycopg2.errors.ForeignKeyViolation:
+        return jsonify({"error": "Book or user not found"}), 404
+    except Exception as e:
+        print("An error occurred while submitting ratings:", e)
+        return jsonify({"error": "An error occurred while submitting ratings", "message": str(e)}), 500
+
+
+@app.route('/books/state/<int:user_id>', methods=['GET'])
+def book_states(user_id):
+    """
+    Whether the user liked and how they rated each of the given books.
+
+    ISBN13s are passed as repeated or comma-separated isbn13 parameters
+    (at most MAX_BOOK_BATCH). Each one is looked up on the (user_id, isbn13)
+    unique indexes, so the cost does not depend on the user's history.
+
+    Returns:
+        json: {"user_id", "version", "books": [{"isbn13", "liked", "rating"}, ...]}
+        in the requested order; rating is null for books the user has not
+        rated. version is the user's state version (see /books/state/<id>/ids).
+    """
+    isbn13_list = parse_isbn13_list()
+
+    if not isbn13_list:
+        return jsonify({"error": "At least one isbn13 is required"}), 400
+    if len(isbn13_list) > MAX_BOOK_BATCH:
+        return jsonify({"error": f"At most {MAX_BOOK_BATCH} books are allowed per request"}), 400
+
+    try:
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT state_version FROM users WHERE user_id = %s;", (user_id,))
+            user = cursor.fetchone()
+            if user is None:
+                return jsonify({"error": "User not found"}), 404
+
+            cursor.execute("""
+                SELECT i.isbn13, bl.isbn13 IS NOT NULL, br.rating
+                FROM unnest(%s::text[]) WITH ORDINALITY AS i(isbn13, position)
+                LEFT JOIN book_likes bl ON bl.user_id = %s AND bl.isbn13 = i.isbn13
+                LEFT JOIN book_reviews br ON br.user_id = %s AND br.isbn13 = i.isbn13
+                ORDER BY i.position;
+            """, (isbn13_list, user_id, user_id))
+
+            books = [{"isbn13": row[0], "liked": row[1], "rating": row[2]} for row in cursor.fetchall()]
+            return jsonify({"user_id": user_id, "version": user[0], "books": books})
+
+    except Exception as e:
+        print("An error occurred while fetching book states:", e)
+        return jsonify({"error": "An error occurred", "message": str(e)}), 500
+
+@app.route('/books/state/<int:user_id>/ids', methods=['GET'])
+def book_state_ids(user_id):
+    """
+    The ISBN13s the user liked and rated, with their state version.
+
+    The version changes whenever the user's likes or ratings change. A
+    client that already holds the ids passes the version it got as the
+    version parameter: if nothing changed, the answer is 304 Not Modified
+    with no body, from a single primary key lookup.
+
+    Returns:
+        json: {"user_id", "version", "liked": [isbn13, ...], "ratings": {isbn13: rating, ...}}
+    """
+    try:
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("SELECT state_version FROM users WHERE user_id = %s;", (user_id,))
+            user = cursor.fetchone()
+            if user is None:
+                return jsonify({"error": "User not found"}), 404
+
+            version = user[0]
+            if request.args.get('version') == str(version):
+                return Response(status=304)
+
+            # The version is read first: a write committed in between can only make it older
+            # than the ids, which costs the client one extra refresh, never a missed one
+            cursor.execute("""
+                SELECT 'liked', isbn13, NULL FROM book_likes WHERE user_id = %s
+                UNION ALL
+                SELECT 'rated', isbn13, rating FROM book_reviews WHERE user_id = %s AND rating IS NOT NULL;
+            """, (user_id, user_id))
+
+            liked, ratings = [], {}
+            for kind, isbn13, rating in cursor.fetchall():
+                if kind == 'liked':
+                    liked.append(isbn13)
+                else:
+                    ratings[isbn13] = rating
+
+            return jsonify({"user_id": user_id, "version": version, "liked": liked, "ratings": ratings})
+
+    except Exception as e:
+        print("An error occurred while fetching book state ids:", e)
+        return jsonify({"error": "An error occurred", "message": str(e)}), 500
+
+
 @app.route('/books/top-categories', methods=['GET'])
+@catalog_response
 def get_top_categories():
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        #Calculate the number of books by category and get the 5 categories with the most books
-        cursor.execute("""
-            SELECT categories, COUNT(*) AS book_count
-            FROM books
-            GROUP BY categories
-            ORDER BY book_count DESC
-            LIMIT 5;
-        """)
+        with db_connection() as connection, connection.cursor() as cursor:
+            #Calculate the number of books by category and get the 5 categories with the most books
+            cursor.execute("""
+                SELECT category, book_count
+                FROM category_counts
+                ORDER BY book_count DESC, category
+                LIMIT 5;
+            """)
         
-        categories = cursor.fetchall()
-
-        # Edit data from a database query
-        top_categories = [{
-            "category": category[0],
-            "book_count": category[1]
-        } for category in categories]
+            categories = cursor.fetchall()
 
-        cursor.close()
-        connection.close()
+            # Edit data from a database query
+            top_categories = [{
+                "category": category[0],
+                "book_count": category[1]
+            } for category in categories]
 
-        # Return results in JSON format
-        return jsonify(top_categories)
+            # Return results in JSON format
+            return jsonify(top_categories)
 
     except Exception as e:
         print("An error occurred:", e)
         return jsonify({"error": "An error occurred", "message": str(e)}), 500
 
 @app.route('/books/categories', methods=['GET'])
+@catalog_response
 def get_all_categories():
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor()
-
-        # SQL query to retrieve categories
-        cursor.execute("""
-            SELECT DISTINCT categories
-            FROM books
-            WHERE categories IS NOT NULL AND categories != ''
-            ORDER BY categories;
-        """)
+        with db_connection() as connection, connection.cursor() as cursor:
+            # SQL query to retrieve categories
+            cursor.execute("""
+                SELECT category
+                FROM category_counts
+                ORDER BY category;
+            """)
         
-        categories = cursor.fetchall()
+            categories = cursor.fetchall()
         
-        # Return categories as a list
-
-        category_list = [{"category": category[0]} for category in categories]
+            # Return categories as a list
 
-        cursor.close()
-        connection.close()
+            category_list = [{"category": category[0]} for category in categories]
 
-        return jsonify(category_list)
+            return jsonify(category_list)
 
     except Exception as e:
         print("An error occurred while fetching categories:", e)
         return jsonify({"error": "An error occurred", "message": str(e)}), 500
     
 if __name__ == "__main__":
+    get_recommender()  # Load the model before accepting requests
     app.run(debug=False, host="0.0.0.0", port=5005)
\ No newline at end of file
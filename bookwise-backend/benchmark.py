@@ -0,0 +1,333 @@
+"""
+Micro-benchmarks for the recommender, run against synthetic catalogs so they
+need no database:
+
+    python benchmark.py topk --sizes 1000 10000 100000
+    python benchmark.py ingest --catalog 100000 --books 1000
+    python benchmark.py ann --sizes 10000 100000 1000000
+
+and search latency against the ILIKE author lookup, on the database in
+DATABASE_URL:
+
+    python benchmark.py search --queries 200
+
+and HTTP throughput of a running backend (dev server or gunicorn):
+
+    python benchmark.py serve --url http://localhost:5005 --concurrency 16
+"""
+import argparse
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+from recommender import BookRecommender
+
+
+def synthetic_recommender(n_books, n_features=5007, nnz_per_row=40, n_categories=50, n_topics=0, seed=0):
+    """
+    Build a fitted-looking BookRecommender over random sparse features. With
+    n_topics, every book draws its terms from one of n_topics shifted term
+    distributions, so that similar books form clusters as in a real catalog.
+    """
+    rng = np.random.default_rng(seed)
+    indptr = np.arange(0, (n_books + 1) * nnz_per_row, nnz_per_row)
+    # Zipf-like column popularity, like real term frequencies
+    indices = np.minimum(rng.zipf(1.3, n_books * nnz_per_row) - 1, n_features - 1).astype(np.int32)
+    if n_topics:
+        topics = np.repeat(rng.integers(0, n_topics, n_books), nnz_per_row)
+        indices = ((indices + topics * (n_features // n_topics)) % n_features).astype(np.int32)
+    data = rng.random(n_books * nnz_per_row, dtype=np.float32)
+    features = sp.csr_matrix((data, indices, indptr), shape=(n_books, n_features))
+    features.sum_duplicates()
+
+    categories = rng.integers(0, n_categories, n_books)
+    model = BookRecommender()
+    model.feature_matrix = normalize(features, norm='l2')
+    model.df = pd.DataFrame({
+        'isbn13': [f"{978000000000 + i:013d}" for i in range(n_books)],
+        'title': [f"Book {i}" for i in range(n_books)],
+        'authors': 'Author',
+        'categories': pd.Categorical([f"Category {c}" for c in categories]),
+        'average_rating': rng.uniform(1, 5, n_books),
+        'thumbnail': None,
+        'description': '',
+    })
+    model.build_indexes()
+    return model
+
+
+def synthetic_catalog(n_books, start=0, n_words=20000, words_per_book=60, n_categories=50, seed=0):
+    """Books table rows with Zipf-distributed pseudo-word descriptions, for fit/ingest timings."""
+    rng = np.random.default_rng(seed)
+    vocabulary = np.array([f"w{i:05d}" for i in range(n_words)])
+    words = vocabulary[np.minimum(rng.zipf(1.2, (n_books, words_per_book)) - 1, n_words - 1)]
+    return pd.DataFrame({
+        'isbn13': [f"{979000000000 + start + i:013d}" for i in range(n_books)],
+        'title': [' '.join(row[:4]) for row in words],
+        'subtitle': None,
+        'authors': [f"Author {i}" for i in rng.integers(0, n_books // 5 + 1, n_books)],
+        'categories': [f"Category {c}" for c in rng.integers(0, n_categories, n_books)],
+        'thumbnail': None,
+        'description': [' '.join(row[4:]) for row in words],
+        'published_year': rng.integers(1900, 2024, n_books).astype(float),
+        'average_rating': rng.uniform(1, 5, n_books),
+        'row_hash': None,
+    })
+
+
+def legacy_recommendations(model, book_indices, n_recommendations=15):
+    """The pre-vectorization selection: Python tuples, full sort, list filter."""
+    sim_scores = model.score_books(book_indices)
+    sim_scores = sorted(enumerate(sim_scores), key=lambda x: x[1], reverse=True)
+    sim_scores = [(i, score) for i, score in sim_scores if i not in book_indices]
+    sim_scores = sim_scores[:n_recommendations]
+    return model.result_frame([i[0] for i in sim_scores], [i[1] for i in sim_scores])
+
+
+def percentiles(samples):
+    samples_ms = np.array(samples) * 1000
+    return np.percentile(samples_ms, 50), np.percentile(samples_ms, 99)
+
+
+def bench_topk(args):
+    print(f"{'books':>9} {'path':>8} {'p50 ms':>9} {'p99 ms':>9}")
+    for n_books in args.sizes:
+        model = synthetic_recommender(n_books)
+        rng = np.random.default_rng(1)
+        queries = [list(rng.choice(n_books, rng.integers(1, 6), replace=False)) for _ in range(args.queries)]
+
+        paths = [('numpy', lambda q: model.get_recommendations(q, args.n))]
+        if n_books <= args.legacy_max:
+            paths.append(('legacy', lambda q: legacy_recommendations(model, q, args.n)))
+
+        for name, run in paths:
+            timings = []
+            for query in queries:
+                start = time.perf_counter()
+                run(query)
+                timings.append(time.perf_counter() - start)
+            p50, p99 = percentiles(timings)
+            print(f"{n_books:>9} {name:>8} {p50:>9.2f} {p99:>9.2f}")
+
+
+def bench_ann(args):
+    print(f"{'books':>9} {'lists':>6} {'probes':>6} {'category':>8} {'recall@k':>9} {'QPS':>8} {'exact QPS':>9}")
+    for n_books in args.sizes:
+        model = synthetic_recommender(n_books, n_topics=args.topics)
+        start = time.perf_counter()
+        model.build_ann_index()
+        print(f"# {n_books} books: index built in {time.perf_counter() - start:.1f}s")
+        index = model.ann_index
+
+        rng = np.random.default_rng(1)
+        queries = [list(rng.choice(n_books, rng.integers(1, 4), replace=False)) for _ in range(args.queries)]
+        for category in (None, 'Category 0'):
+            model.ann_index = None
+            start = time.perf_counter()
+            exact = [set(model.get_recommendations(q, args.k, category)['isbn13']) for q in queries]
+            exact_qps = len(queries) / (time.perf_counter() - start)
+
+            model.ann_index = index
+            for n_probe in args.probes:
+                index.n_probe = n_probe
+                start = time.perf_counter()
+                approximate = [set(model.get_recommendations(q, args.k, category)['isbn13']) for q in queries]
+                qps = len(queries) / (time.perf_counter() - start)
+                recall = np.mean([len(a & e) / len(e) for a, e in zip(approximate, exact) if e])
+                print(f"{n_books:>9} {index.n_lists:>6} {n_probe:>6} {category or '-':>8} "
+                      f"{recall:>9.3f} {qps:>8.0f} {exact_qps:>9.0f}")
+
+
+def bench_ingest(args):
+    catalog = synthetic_catalog(args.catalog)
+    model = BookRecommender(args.vectorizer)
+    start = time.perf_counter()
+    model.fit(catalog)
+    fit_seconds = time.perf_counter() - start
+
+    # Half new books, half updates of existing ones
+    n_changed = args.books // 2
+    books = pd.concat((
+        synthetic_catalog(args.books - n_changed, start=args.catalog, seed=1),
+        synthetic_catalog(n_changed, seed=2),
+    ), ignore_index=True)
+    start = time.perf_counter()
+    updated = model.ingest(books)
+    ingest_seconds = time.perf_counter() - start
+
+    print(f"full fit of {args.catalog} books ({args.vectorizer}): {fit_seconds:.2f}s")
+    print(f"ingest of {args.books} books ({args.books - n_changed} new, {n_changed} changed): "
+          f"{ingest_seconds:.2f}s -> {updated.feature_matrix.shape[0]} books, needs_refit={updated.needs_refit}")
+
+
+def misspell(text, rng):
+    """Swap two adjacent letters inside the longest word of text."""
+    words = text.split()
+    longest = max(range(len(words)), key=lambda i: len(words[i]))
+    word = words[longest]
+    if len(word) >= 4:
+        i = rng.integers(1, len(word) - 2)
+        words[longest] = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return ' '.join(words)
+
+
+def bench_search(args):
+    import psycopg2
+    from search import search_books
+
+    rng = np.random.default_rng(0)
+    connection = psycopg2.connect(os.getenv("DATABASE_URL"))
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM books")
+            n_books = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT isbn13, title, split_part(authors, ';', 1)
+                FROM books
+                WHERE title <> '' AND authors <> ''
+                ORDER BY md5(isbn13 || %s)
+                LIMIT %s;
+            """, (str(args.seed), args.queries))
+            samples = cursor.fetchall()
+        connection.rollback()
+
+        def ilike(cursor, author, seq_scan):
+            if seq_scan:
+                # The plan books_by_author had before the trigram index
+                cursor.execute("SET LOCAL enable_bitmapscan = off")
+                cursor.execute("SET LOCAL enable_indexscan = off")
+            cursor.execute("SELECT b.isbn13 FROM books b WHERE b.authors ILIKE %s;", (f"%{author}%",))
+            return [row[0] for row in cursor.fetchall()]
+
+        def search(cursor, text):
+            return [isbn13 for isbn13, _ in search_books(cursor, text, limit=args.limit)]
+
+        modes = [
+            ("author ILIKE, seq scan", lambda cursor, isbn13, title, author: ilike(cursor, author, True)),
+            ("author ILIKE, trigram", lambda cursor, isbn13, title, author: ilike(cursor, author, False)),
+            ("search author", lambda cursor, isbn13, title, author: search(cursor, author)),
+            ("search author typo", lambda cursor, isbn13, title, author: search(cursor, misspell(author, rng))),
+            ("search title words", lambda cursor, isbn13, title, author: search(cursor, ' '.join(title.split()[:3]))),
+            ("search title typo", lambda cursor, isbn13, title, author: search(cursor, misspell(' '.join(title.split()[:3]), rng))),
+        ]
+        print(f"{n_books} books, {len(samples)} queries, search returns {args.limit}; found = the sampled book is returned")
+        print(f"{'mode':<24} {'p50 ms':>9} {'p99 ms':>9} {'found':>7}")
+        for name, run in modes:
+            timings, found = [], 0
+            for isbn13, title, author in samples:
+                with connection.cursor() as cursor:
+                    start = time.perf_counter()
+                    result = run(cursor, isbn13, title, author)
+                    timings.append(time.perf_counter() - start)
+                connection.rollback()
+                found += isbn13 in result
+            p50, p99 = percentiles(timings)
+            print(f"{name:<24} {p50:>9.2f} {p99:>9.2f} {found / len(samples):>7.1%}")
+    finally:
+        connection.close()
+
+
+# Request mix for the serve benchmark; {user_id} is drawn from --users so the
+# AI suggestions are not all answered from the cache
+SERVE_PATHS = [
+    '/books?page=1',
+    '/book/9780002005883',
+    '/books/top-categories',
+    '/api/ai-suggestions/{user_id}?category=Fiction',
+]
+
+
+def bench_serve(args):
+    import requests
+
+    rng = np.random.default_rng(0)
+    deadline = time.perf_counter() + args.duration
+    timings, errors, sizes = [], [], []
+
+    def client(seed):
+        session = requests.Session()
+        rng = np.random.default_rng(seed)
+        etags = {}  # path -> ETag of the last response, sent back like a browser cache would
+        while time.perf_counter() < deadline:
+            path = args.paths[rng.integers(len(args.paths))].format(user_id=rng.integers(1, args.users + 1))
+            headers = {'If-None-Match': etags[path]} if args.revalidate and path in etags else {}
+            if args.no_compression:
+                headers['Accept-Encoding'] = 'identity'
+            start = time.perf_counter()
+            try:
+                response = session.get(args.url.rstrip('/') + path, headers=headers, timeout=30, stream=True)
+                body = response.raw.read(decode_content=False)  # Bytes on the wire, before decompression
+                ok = response.status_code < 500
+            except requests.RequestException:
+                ok = False
+            (timings if ok else errors).append(time.perf_counter() - start)
+            if ok:
+                sizes.append(len(body))
+                if 'ETag' in response.headers:
+                    etags[path] = response.headers['ETag']
+
+    clients = [threading.Thread(target=client, args=(seed,)) for seed in rng.integers(0, 2**32, args.concurrency)]
+    started = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    p50, p99 = percentiles(timings) if timings else (0.0, 0.0)
+    mean_bytes = sum(sizes) / len(sizes) if sizes else 0.0
+    print(f"{'clients':>7} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'bytes':>9}")
+    print(f"{args.concurrency:>7} {len(timings):>9} {len(errors):>7} {len(timings) / elapsed:>8.1f} "
+          f"{p50:>9.2f} {p99:>9.2f} {mean_bytes:>9.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    topk = subparsers.add_parser('topk', help="get_recommendations latency against catalog size")
+    topk.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    topk.add_argument('--queries', type=int, default=200)
+    topk.add_argument('--n', type=int, default=15)
+    topk.add_argument('--legacy-max', type=int, default=100000,
+                      help="largest catalog to also time the old sort-based selection on")
+    topk.set_defaults(run=bench_topk)
+
+    ann = subparsers.add_parser('ann', help="IVF index recall@k and QPS against exact search")
+    ann.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    ann.add_argument('--probes', type=int, nargs='+', default=[4, 8, 16, 32])
+    ann.add_argument('--queries', type=int, default=200)
+    ann.add_argument('--k', type=int, default=15)
+    ann.add_argument('--topics', type=int, default=200, help="term clusters in the synthetic catalog")
+    ann.set_defaults(run=bench_ann)
+
+    ingest = subparsers.add_parser('ingest', help="incremental ingest time against a full fit")
+    ingest.add_argument('--catalog', type=int, default=100000)
+    ingest.add_argument('--books', type=int, default=1000)
+    ingest.add_argument('--vectorizer', choices=['tfidf', 'hashing'], default='tfidf')
+    ingest.set_defaults(run=bench_ingest)
+
+    search = subparsers.add_parser('search', help="search latency and recall against the ILIKE author lookup")
+    search.add_argument('--queries', type=int, default=200, help="books sampled to build queries from")
+    search.add_argument('--limit', type=int, default=20, help="results per search")
+    search.add_argument('--seed', type=int, default=0)
+    search.set_defaults(run=bench_search)
+
+    serve = subparsers.add_parser('serve', help="requests per second and latency of a running backend")
+    serve.add_argument('--url', default='http://localhost:5005')
+    serve.add_argument('--concurrency', type=int, default=16, help="concurrent clients")
+    serve.add_argument('--duration', type=float, default=20, help="seconds")
+    serve.add_argument('--users', type=int, default=100, help="user ids to spread AI suggestions over")
+    serve.add_argument('--paths', nargs='+', default=SERVE_PATHS)
+    serve.add_argument('--revalidate', action='store_true',
+                       help="send each path's last ETag back as If-None-Match, like a browser cache")
+    serve.add_argument('--no-compression', action='store_true', help="ask for uncompressed responses")
+    serve.set_defaults(run=bench_serve)
+
+    args = parser.parse_args()
+    args.run(args)
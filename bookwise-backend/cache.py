@@ -0,0 +1,188 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCacheBackend:
+    """
+    In-process LRU cache with a per-entry TTL. This is the default backend and
+    the local stand-in for a shared one: any object with the same get/set/incr
+    methods (see RedisCacheBackend) can replace it.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def incr(self, key):
+        """Atomically increment and return an integer counter (never evicted)."""
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def stats(self):
+        with self._lock:
+            return {"backend": "local", "size": len(self._entries), "max_entries": self.max_entries,
+                    "ttl": self.ttl, "evictions": self.evictions, "expirations": self.expirations}
+
+
+class RedisCacheBackend:
+    """Shared cache backend on Redis, so that every worker sees the same entries."""
+
+    def __init__(self, url, ttl=300):
+        import redis  # Optional dependency, only needed when RECOMMENDATION_CACHE_URL is set
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(key, json.dumps(value), ex=self.ttl)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def get_counter(self, key):
+        return int(self.client.get(key) or 0)
+
+    def stats(self):
+        # Redis evicts on its own; its INFO stats cover evictions and expirations
+        return {"backend": "redis", "ttl": self.ttl}
+
+
+class RecommendationCache:
+    """
+    Cache of AI suggestion results keyed on (model version, user, category, n).
+
+    Every user has a generation counter that is part of the key. Invalidating
+    a user bumps the counter, so their old entries are never read again and
+    age out through the LRU/TTL, and this works the same on a shared backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _key(self, user_id, category, n_recommendations, model_version):
+        generation = self.backend.get_counter(f"recommendations:generation:{user_id}")
+        return f"recommendations:{model_version}:{user_id}:{generation}:{n_recommendations}:{category}"
+
+    def get(self, user_id, category, n_recommendations, model_version):
+        value = self.backend.get(self._key(user_id, category, n_recommendations, model_version))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, user_id, category, n_recommendations, model_version, value):
+        self.backend.set(self._key(user_id, category, n_recommendations, model_version), value)
+
+    def invalidate_user(self, user_id):
+        """Drop every cached result of a user, after their ratings or likes change."""
+        self.backend.incr(f"recommendations:generation:{user_id}")
+        self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "invalidations": self.invalidations,
+            **self.backend.stats(),
+        }
+
+
+class CatalogResponseCache:
+    """
+    In-process cache of catalog response bodies keyed on (catalog version,
+    request path and query); the version is the ETag of catalog_response(). A
+    change to books or a new ratings window changes it, so bodies of older
+    versions are never read again and age out through the LRU.
+    Bodies are kept as bytes, so this cache is always local to the process.
+    """
+
+    # Larger bodies (e.g. /books with a huge limit) are served but not kept
+    MAX_BODY = 1 << 20
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, version, key):
+        """Return the (mimetype, body, content encoding) cached for a request, or None."""
+        value = self.backend.get(f"catalog:{version}:{key}")
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, version, key, mimetype, body, encoding=None):
+        if len(body) <= self.MAX_BODY:
+            self.backend.set(f"catalog:{version}:{key}", (mimetype, body, encoding))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else None,
+            "not_modified": self.not_modified,
+            **self.backend.stats(),
+        }
+
+
+def create_catalog_cache():
+    """Build the catalog response cache from CATALOG_CACHE_* environment variables."""
+    return CatalogResponseCache(LocalCacheBackend(int(os.getenv("CATALOG_CACHE_SIZE", 1000)), ttl=3600))
+
+
+def create_recommendation_cache():
+    """Build the cache from RECOMMENDATION_CACHE_* environment variables."""
+    ttl = int(os.getenv("RECOMMENDATION_CACHE_TTL", 300))
+    url = os.getenv("RECOMMENDATION_CACHE_URL")
+    if url:
+        backend = RedisCacheBackend(url, ttl=ttl)
+    else:
+        backend = LocalCacheBackend(int(os.getenv("RECOMMENDATION_CACHE_SIZE", 10000)), ttl=ttl)
+    return RecommendationCache(backend)
@@ -0,0 +1,207 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.pool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """Raised when no connection becomes free within the checkout timeout."""
+
+
+class ConnectionPool:
+    """
+    psycopg2 ThreadedConnectionPool with a checkout timeout, health checks and
+    usage counters.
+
+    Like psycopg2's pool, at most minconn idle connections are kept open; up to
+    maxconn can be checked out at once, and further checkouts wait up to
+    timeout seconds for one to be returned.
+    """
+
+    def __init__(self, dsn, minconn=4, maxconn=20, timeout=5.0, health_check_after=30.0):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._returned_at = {}  # id(connection) -> time it was last returned
+        self._lock = threading.Lock()
+        self.idle = minconn  # psycopg2 opens minconn connections up front
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.in_use = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _healthy(self, connection):
+        if connection.closed:
+            return False
+        returned_at = self._returned_at.get(id(connection))
+        if returned_at is None or time.monotonic() - returned_at < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _take(self):
+        """Check a connection out of the psycopg2 pool, counting the idle one it reuses."""
+        with self._lock:
+            connection = self._pool.getconn()
+            if self.idle:  # psycopg2 reuses an idle connection whenever it has one
+                self.idle -= 1
+        return connection
+
+    def _give_back(self, connection, close=False):
+        """Put a connection back into the psycopg2 pool, counting it if it stays idle."""
+        with self._lock:
+            try:
+                self._pool.putconn(connection, close=close)
+            except psycopg2.pool.PoolError:
+                raise
+            except psycopg2.Error:
+                # psycopg2 rolls back an open transaction first; a broken connection can't
+                self.discarded += 1
+                self._pool.putconn(connection, close=True)
+            if not connection.closed:
+                self.idle += 1
+
+    def getconn(self):
+        start = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise PoolTimeout(f"No database connection available within {self.timeout}s")
+        try:
+            connection = self._take()
+            while not self._healthy(connection):
+                with self._lock:
+                    self.discarded += 1
+                self._returned_at.pop(id(connection), None)
+                self._give_back(connection, close=True)
+                connection = self._take()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.monotonic() - start
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        return connection
+
+    def putconn(self, connection):
+        """Return a connection; open transactions are rolled back, broken connections closed."""
+        try:
+            self._give_back(connection, close=bool(connection.closed))
+            if connection.closed:  # Closed by the pool (above minconn idle) or broken
+                self._returned_at.pop(id(connection), None)
+            else:
+                self._returned_at[id(connection)] = time.monotonic()
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self.getconn()
+        try:
+            yield connection
+        except Exception:
+            if not connection.closed:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    # A broken connection can't roll back; close it so putconn
+                    # discards it, and raise the error that broke the block
+                    connection.close()
+                    with self._lock:
+                        self.discarded += 1
+            raise
+        finally:
+            self.putconn(connection)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": self.in_use,
+                "idle": self.idle,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "discarded": self.discarded,
+                "avg_wait_ms": 1000 * self.total_wait / self.checkouts if self.checkouts else 0.0,
+                "max_wait_ms": 1000 * self.max_wait,
+            }
+
+    def close(self):
+        """Close every connection, idle or checked out."""
+        with self._lock:
+            self._pool.closeall()
+            self.idle = 0
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return this process's connection pool, created on first use. A forked
+    worker gets its own pool instead of sharing the parent's sockets.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ConnectionPool(
+                    os.getenv("DATABASE_URL"),
+                    # psycopg2 closes connections returned above minconn, so keep one per
+                    # request thread (gunicorn.conf.py's THREADS) to reuse them under load
+                    minconn=int(os.getenv("DB_POOL_MIN", os.getenv("THREADS", 4))),
+                    maxconn=int(os.getenv("DB_POOL_MAX", 20)),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", 5)),
+                    health_check_after=float(os.getenv("DB_POOL_HEALTH_CHECK_SECONDS", 30)),
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def close_pool():
+    """
+    Close this process's pool. A preloading server calls it in the master
+    before forking, so that no worker inherits its open sockets.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+        _pool_pid = None
+
+
+@contextmanager
+def db_connection():
+    """
+    Check a pooled connection out for the duration of the block. It is always
+    returned to the pool, and rolled back if the block raises or leaves a
+    transaction open.
+    """
+    with get_pool().connection() as connection:
+        yield connection
@@ -0,0 +1,38 @@
+import os
+
+# gunicorn -c gunicorn.conf.py wsgi:app (the default config file name, so
+# plain "gunicorn wsgi:app" picks it up too)
+
+bind = os.getenv("BIND", "0.0.0.0:5005")
+
+# Each worker process serves THREADS requests at once, so a slow
+# recommendation or cover lookup only holds up one thread
+workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+threads = int(os.getenv("THREADS", 4))
+worker_class = "gthread"
+
+# Load the app and the recommender once in the master; workers are forked
+# from it and share the model's pages copy-on-write
+preload_app = True
+
+timeout = int(os.getenv("WORKER_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+
+accesslog = os.getenv("ACCESS_LOG", "-")
+
+
+def on_reload(arbiter):
+    """
+    On SIGHUP, load the latest recommender artifact in the master before the
+    new workers are forked from it. Old workers finish their requests (up to
+    graceful_timeout) before exiting.
+    """
+    import wsgi
+    from recommender import load_or_fit, set_recommender
+
+    try:
+        set_recommender(load_or_fit())
+    except Exception as e:
+        arbiter.log.error("Reloading the recommender failed, keeping the current one: %s", e)
+    wsgi.preload()
@@ -0,0 +1,171 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from recommender import (
+    get_books_content_hash, get_loaded_recommender, latest_model_version, load_artifact, load_or_fit,
+    rebuild_lock, set_recommender,
+)
+
+# How often (seconds) to check whether the books table changed and rebuild the
+# recommender if it did; 0 only rebuilds when triggered
+REBUILD_INTERVAL = float(os.getenv("RECOMMENDER_REBUILD_INTERVAL", 0))
+
+# How often (seconds) to check model_dir/LATEST and load an artifact another
+# process saved, e.g. the worker that served an admin rebuild or ingest; the
+# check reads one small file. 0 turns it off
+RELOAD_INTERVAL = float(os.getenv("RECOMMENDER_RELOAD_INTERVAL", 10))
+
+
+class ModelValidationError(ValueError):
+    """A rebuilt model failed the checks it must pass before being swapped in."""
+
+
+def validate_model(model):
+    """Raise ModelValidationError unless model is consistent and answers a query."""
+    n_books = len(model.df)
+    if n_books == 0:
+        raise ModelValidationError("The catalog is empty")
+    if model.feature_matrix.shape[0] != n_books or len(model.isbn_to_row) != n_books:
+        raise ModelValidationError(
+            f"{model.feature_matrix.shape[0]} feature rows and {len(model.isbn_to_row)} isbn13s for {n_books} books"
+        )
+    if not np.isfinite(model.feature_matrix.data).all():
+        raise ModelValidationError("The feature matrix has non-finite values")
+    if n_books > 1 and model.get_recommendations([0], 5).empty:
+        raise ModelValidationError("A probe query returned no recommendations")
+
+
+class ModelManager:
+    """
+    Rebuilds the shared recommender in a background thread and swaps it in.
+
+    A rebuild (see load_or_fit) loads the latest artifact if it already
+    matches the books table, e.g. because another worker process built it;
+    otherwise it ingests the changed books or fits a new model, which must
+    pass validate_model() before it is saved. Only one process builds at a
+    time; a rebuild started while another process holds the artifact lock
+    does nothing. The result replaces the shared model with
+    set_recommender(); requests that already hold the old model finish on
+    it.
+
+    rebuild() starts a rebuild, and reload() loads a newer artifact saved by
+    another process. A scheduler thread calls reload() every reload_interval
+    seconds, so every worker process converges on the latest artifact. With
+    interval, it also checks every interval seconds for a changed books table
+    or a model that needs a refit, and rebuilds accordingly.
+    """
+
+    def __init__(self, interval=REBUILD_INTERVAL, reload_interval=RELOAD_INTERVAL):
+        self.interval = interval
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._building = False
+        self._scheduler_pid = None
+        self.builds = 0
+        self.failures = 0
+        self.last_build_seconds = None
+        self.last_swap_at = None
+        self.last_error = None
+
+    def start(self):
+        """Start the scheduler thread, once per process (threads do not survive a fork)."""
+        if not (self.interval or self.reload_interval) or self._scheduler_pid == os.getpid():
+            return
+        with self._lock:
+            if self._scheduler_pid == os.getpid():
+                return
+            threading.Thread(target=self._schedule, name="model-manager", daemon=True).start()
+            self._scheduler_pid = os.getpid()
+
+    def _schedule(self):
+        last_rebuild_check = time.monotonic()
+        while True:
+            time.sleep(min(interval for interval in (self.interval, self.reload_interval) if interval))
+            try:
+                # A newer artifact saved by another process is simply loaded
+                if self.reload() or not self.interval:
+                    continue
+                if time.monotonic() - last_rebuild_check < self.interval:
+                    continue
+                last_rebuild_check = time.monotonic()
+                model = get_loaded_recommender()
+                if model is None:
+                    continue
+                if model.needs_refit:
+                    self.rebuild(refit=True)
+                elif model.content_hash != get_books_content_hash():
+                    self.rebuild()
+            except Exception as e:
+                print("Scheduled recommender rebuild check failed:", e)
+
+    def reload(self):
+        """
+        Load the artifact model_dir/LATEST points at and swap it in, if it is
+        not the shared model's version. Returns whether it did; a process that
+        has not loaded a model yet loads the latest one on first use instead.
+        """
+        model = get_loaded_recommender()
+        if model is None or latest_model_version() in (None, model.model_version):
+            return False
+        with rebuild_lock:
+            version = latest_model_version()
+            if version == get_loaded_recommender().model_version:
+                return False
+            self._swap(load_artifact(version))
+        return True
+
+    def _swap(self, model):
+        set_recommender(model)
+        self.last_swap_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        print(f"Swapped in recommender model {model.model_version}")
+
+    def rebuild(self, refit=False):
+        """
+        Start a rebuild in the background. Returns False if one is already
+        running, in which case nothing new is started.
+        """
+        with self._lock:
+            if self._building:
+                return False
+            self._building = True
+        threading.Thread(target=self._build, args=(refit,), name="model-rebuild", daemon=True).start()
+        return True
+
+    def _build(self, refit):
+        start = time.perf_counter()
+        try:
+            with rebuild_lock:
+                # None if another process is building; the artifact it saves
+                # is loaded by the next scheduled check or rebuild
+                model = load_or_fit(refit=refit, validate=validate_model, wait=False)
+                current = get_loaded_recommender()
+                if model is not None and (current is None or model.model_version != current.model_version):
+                    self._swap(model)
+            self.builds += 1
+            self.last_error = None
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            print("Recommender rebuild failed, keeping the current model:", e)
+        finally:
+            self.last_build_seconds = time.perf_counter() - start
+            with self._lock:
+                self._building = False
+
+    def stats(self):
+        model = get_loaded_recommender()
+        return {
+            "model_version": model.model_version if model is not None else None,
+            "needs_refit": model.needs_refit if model is not None else None,
+            "building": self._building,
+            "builds": self.builds,
+            "failures": self.failures,
+            "last_build_seconds": self.last_build_seconds,
+            "last_swap_at": self.last_swap_at,
+            "last_error": self.last_error,
+            "rebuild_interval": self.interval,
+            "reload_interval": self.reload_interval,
+        }
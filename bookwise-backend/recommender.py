@@ -1,191 +1,1002 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import MinMaxScaler
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer, TfidfTransformer, TfidfVectorizer
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import normalize
 import numpy as np
-from sqlalchemy import create_engine
+import scipy.sparse as sp
+from sqlalchemy import create_engine, text
 from dotenv import load_dotenv
+from user_profiles import UserProfileStore
+from ann import ANN_MIN_BOOKS, IVFIndex
+import argparse
+from collections import defaultdict
+from contextlib import contextmanager
+import itertools
+import json
 import os 
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+# Bump whenever the on-disk layout written by BookRecommender.save changes
+ARTIFACT_FORMAT_VERSION = 5
+
+# Columns kept from the books table to build recommendation results, plus
+# row_hash, used to find rows that changed since the model was fit
+CATALOG_COLUMNS = ['isbn13', 'title', 'authors', 'categories', 'average_rating', 'thumbnail', 'description', 'row_hash']
+
+# Columns read from the books table to fit the model
+BOOK_COLUMNS = CATALOG_COLUMNS + ['subtitle', 'published_year']
+
+# row_hash is the md5 of the columns the text features and category filters
+# are built from. Rating aggregates and covers written back by the thumbnail
+# resolver change on every rating or lookup and are left out, so they do not
+# make a book look changed; they are picked up at the next refit
+HASHED_COLUMNS = ['isbn13', 'title', 'subtitle', 'authors', 'categories', 'description', 'published_year']
+ROW_HASH_SQL = f"md5(ROW({', '.join(f'b.{column}' for column in HASHED_COLUMNS)})::text)"
+
+# Books are read through a server-side cursor in chunks of this many rows, so
+# the memory used while reading is bounded by the chunk size
+LOAD_CHUNK_SIZE = int(os.getenv("RECOMMENDER_LOAD_CHUNK_SIZE", 10000))
+
+# Text features: 'tfidf' learns a vocabulary of the most frequent terms at fit
+# time; 'hashing' hashes terms into a fixed number of columns, so books ingested
+# later never fall outside the vocabulary
+TEXT_VECTORIZER = os.getenv("RECOMMENDER_VECTORIZER", "tfidf")
+TEXT_FEATURE_PARAMS = {'stop_words': 'english', 'ngram_range': (1, 2), 'dtype': np.float32}
+TFIDF_MAX_FEATURES = 5005
+HASHING_FEATURES = 2 ** 18
+
+# Ingested books are transformed against the vocabulary and idf of the last fit.
+# A full refit is due once the share of the terms of all books ingested since
+# the fit that the vocabulary covers is more than REFIT_DRIFT below the share
+# measured at fit time, or once more than REFIT_FRACTION of the catalog was
+# ingested since the fit.
+REFIT_DRIFT = float(os.getenv("RECOMMENDER_REFIT_DRIFT", 0.1))
+REFIT_FRACTION = float(os.getenv("RECOMMENDER_REFIT_FRACTION", 0.2))
+
+# Drift is only judged once this many books were ingested since the fit, so a
+# few unusual titles do not trigger a refit on their own
+REFIT_MIN_BOOKS = 100
+
+# Documents sampled to measure vocabulary coverage at fit time
+COVERAGE_SAMPLE = 2000
+
+DEFAULT_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model')
+
+# Number of model artifacts kept in the model directory; save() deletes older
+# ones. Processes still on a deleted artifact keep its memory-mapped pages
+MODEL_KEEP_VERSIONS = int(os.getenv("MODEL_KEEP_VERSIONS", 3))
+
+# Key of the PostgreSQL advisory lock held while a model artifact is built, so
+# that of several backend processes only one fits or ingests at a time
+ARTIFACT_LOCK_KEY = 0x626f6f6b
+
+def book_text(df):
+    """Combine the text columns of books into the single string their text features are built from."""
+    return (df['title'].fillna('') + ' ' + df['subtitle'].fillna('') + ' '
+            + df['authors'].fillna('') + ' ' + df['description'].fillna(''))
 
 class BookRecommender:
-    def __init__(self):
+    def __init__(self, vectorizer=TEXT_VECTORIZER):
+        if vectorizer not in ('tfidf', 'hashing'):
+            raise ValueError(f"Unknown text vectorizer {vectorizer!r}")
+        self.vectorizer = vectorizer
+        self.text_vectorizer = None
         self.df = None
-        self.tfidf_matrix = None
-        self.similarity_matrix = None
-        self.user_ratings = {}
+        self.feature_matrix = None
+        self.numeric_features = None
+        self.numeric_scaling = None
+        self.vocabulary = None
+        self.idf = None
+        self.vocabulary_coverage = 1.0
+        self.ingested_books = 0
+        self.ingested_terms = [0, 0]  # [in the vocabulary, total] over the books ingested since the fit
+        self.needs_refit = False
+        self.ann_index = None
+        self.isbn_to_row = {}
+        self.category_names = []
+        self.category_matrix = None
+        self.category_rows = {}
+        self.content_hash = None
+        self.model_version = None
+        self.user_profiles = UserProfileStore(self.isbn_to_row)
         
-    def prepare_data(self, df):
-        """Prepare the dataset for recommendation."""
-        self.df = df.copy()
-        
-        # Ensure categories is a list or set for each book
-        self.df['categories'] = self.df['categories'].fillna('').str.split(',')
-        
-        # Combine text features into a single string
-        self.df['text_features'] = self.df['title'].fillna('') + ' ' + \
-                                 self.df['subtitle'].fillna('') + ' ' + \
-                                 self.df['authors'].fillna('') + ' ' + \
-                                 self.df['description'].fillna('')
-        
-        # Fill missing values for numerical features with mean or median
-        self.df['published_year'] = self.df['published_year'].fillna(self.df['published_year'].median())
-        self.df['average_rating'] = self.df['average_rating'].fillna(self.df['average_rating'].mean())
+    def scan_books(self, chunks, spill_dir):
+        """
+        Read the books chunk by chunk: collect the catalog, the numeric
+        columns and the term statistics the vocabulary and idf are chosen
+        from. Each chunk's term counts are written to spill_dir, keyed by a
+        global term id, for create_feature_matrix(). Returns the numeric
+        features, the vocabulary column of every global term id (-1 if it is
+        not in the vocabulary) and the number of spilled chunks.
+        """
+        catalog, years, ratings = [], [], []
+        if self.vectorizer == 'hashing':
+            counter = HashingVectorizer(n_features=HASHING_FEATURES, alternate_sign=False, norm=None,
+                                        **TEXT_FEATURE_PARAMS)
+        else:
+            analyze = CountVectorizer(**TEXT_FEATURE_PARAMS).build_analyzer()
+        # Global id of every term seen so far, assigned in order of appearance
+        term_ids = defaultdict()
+        term_ids.default_factory = term_ids.__len__
+        term_freq = np.zeros(HASHING_FEATURES if self.vectorizer == 'hashing' else 0)
+        doc_freq = np.zeros(len(term_freq), dtype=np.int64)
+
+        n_chunks = 0
+        for chunk in chunks:
+            years.append(chunk['published_year'].to_numpy(np.float32, na_value=np.nan))
+            ratings.append(chunk['average_rating'].to_numpy(np.float64, na_value=np.nan))
+            catalog.append(chunk.reindex(columns=CATALOG_COLUMNS))
+
+            if self.vectorizer == 'hashing':
+                counts = counter.transform(book_text(chunk))
+            else:
+                counts = self.count_terms_by_id(book_text(chunk), analyze, term_ids)
+                term_freq = np.concatenate((term_freq, np.zeros(len(term_ids) - len(term_freq))))
+                doc_freq = np.concatenate((doc_freq, np.zeros(len(term_ids) - len(doc_freq), np.int64)))
+            term_freq += np.bincount(counts.indices, weights=counts.data, minlength=len(term_freq))
+            doc_freq += np.bincount(counts.indices, minlength=len(doc_freq))
+            for name in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(spill_dir, f'{n_chunks}_{name}.npy'), getattr(counts, name))
+            n_chunks += 1
+
+        n_books = sum(len(values) for values in years)
+        published_year, average_rating = np.concatenate(years), np.concatenate(ratings)
+        self.fit_numeric_scaling(published_year, average_rating)
+        self.df = pd.concat(catalog, ignore_index=True)
+        self.df['categories'] = self.df['categories'].fillna('').astype('category')
+        self.df['average_rating'] = self.df['average_rating'].fillna(self.numeric_scaling['average_rating_fill'])
 
-        # Normalize numerical features
-        scaler = MinMaxScaler()
-        self.df['norm_year'] = scaler.fit_transform(self.df[['published_year']].fillna(0))
-        self.df['norm_rating'] = scaler.fit_transform(self.df[['average_rating']].fillna(0))
+        if self.vectorizer == 'hashing':
+            self.vocabulary = None
+            term_columns = np.arange(HASHING_FEATURES)
+        else:
+            # The most frequent terms, indexed alphabetically, selected exactly
+            # as TfidfVectorizer(max_features=...) does (also among ties)
+            terms = np.array(list(term_ids), dtype=object)
+            alphabetical = np.argsort(terms)
+            top = alphabetical[(-term_freq[alphabetical]).argsort()[:TFIDF_MAX_FEATURES]]
+            top = top[np.argsort(terms[top])]
+            self.vocabulary = {term: col for col, term in enumerate(terms[top])}
+            term_columns = np.full(len(terms), -1)
+            term_columns[top] = np.arange(len(top))
+            doc_freq = doc_freq[top]
+        # Smoothed idf, as TfidfTransformer computes it
+        self.idf = np.log((1 + n_books) / (1 + doc_freq)) + 1
+        self.text_vectorizer = None
+        return self.numeric_rows(published_year, average_rating), term_columns, n_chunks
+
+    def count_terms_by_id(self, texts, analyze, term_ids):
+        """Return the term counts of texts as a CSR matrix over the global ids of term_ids."""
+        indices, values, indptr = [], [], [0]
+        for text_features in texts:
+            doc_counts = {}
+            for term in analyze(text_features):
+                term_id = term_ids[term]
+                doc_counts[term_id] = doc_counts.get(term_id, 0) + 1
+            indices.extend(doc_counts)
+            values.extend(doc_counts.values())
+            indptr.append(len(indices))
+        return sp.csr_matrix(
+            (np.asarray(values, dtype=np.float32), np.asarray(indices, dtype=np.int32), np.asarray(indptr)),
+            shape=(len(indptr) - 1, len(term_ids)),
+        )
+
+    def fit_numeric_scaling(self, published_year, average_rating):
+        """
+        Fill values and min/max of the numerical features, kept so that books
+        ingested later are scaled the same way.
+        """
+        self.numeric_scaling = {}
+        for column, values, fill in (('published_year', published_year, np.nanmedian),
+                                     ('average_rating', average_rating, np.nanmean)):
+            fill_value = float(fill(values)) if not np.isnan(values).all() else 0.0
+            filled = np.where(np.isnan(values), fill_value, values)
+            self.numeric_scaling[f'{column}_fill'] = fill_value
+            self.numeric_scaling[f'{column}_min'] = float(filled.min()) if len(filled) else 0.0
+            self.numeric_scaling[f'{column}_range'] = float(filled.max() - filled.min()) if len(filled) else 0.0
+
+    def prepare_rows(self, df):
+        """Derive the columns features are built from, using the fit-time numeric scaling."""
+        df = df.copy()
+        if 'row_hash' not in df:
+            df['row_hash'] = None
+
+        # Categories stay the comma-separated string, stored as integer codes:
+        # build_indexes() splits each distinct value once
+        df['categories'] = df['categories'].fillna('').astype('category')
+        df['text_features'] = book_text(df)
+        df['average_rating'] = df['average_rating'].fillna(self.numeric_scaling['average_rating_fill'])
+        return df
 
     def add_user_rating(self, user_id, isbn13, rating):
         """Add or update a user's rating for a book, if the ISBN exists in the dataset."""
-        # Check if the ISBN exists in the dataset
-        if isbn13 not in self.df['isbn13'].values:
+        if not self.user_profiles.set_rating(user_id, isbn13, rating):
             print(f"Warning: ISBN {isbn13} does not exist in the dataset. Rating not added.")
-            return  # Exit the function if ISBN doesn't exist
-    
-        # If the ISBN exists, proceed to add or update the rating
-        if user_id not in self.user_ratings:
-            self.user_ratings[user_id] = {}
-        self.user_ratings[user_id][isbn13] = rating
 
     def get_user_rated_books_in_category(self, user_id, category):
-        """Get books rated by user in a specific category."""
-        if user_id not in self.user_ratings:
+        """Get books rated or liked by user in a specific category."""
+        rows, ratings = self.user_profiles.get_signals(user_id)
+        category_rows = self.category_rows.get(category)
+        if category_rows is None:
             return []
         
-        rated_books = []
-        for isbn13, rating in self.user_ratings[user_id].items():
-            book_idx = self.df[self.df['isbn13'] == isbn13].index
-            if len(book_idx) > 0:
-                book_idx = book_idx[0]
-                book_categories = self.df.iloc[book_idx]['categories']
-                if category in book_categories:
-                    rated_books.append((isbn13, rating, book_idx))
-        
-        return rated_books
+        in_category = np.isin(rows, category_rows, assume_unique=True)
+        isbn13 = self.df['isbn13'].to_numpy()
+        return [(isbn13[book_idx], int(rating), int(book_idx))
+                for book_idx, rating in zip(rows[in_category], ratings[in_category])]
 
-    def create_feature_matrix(self):
-        """Create TF-IDF matrix from text features."""
-        tfidf = TfidfVectorizer(stop_words='english', 
-                               max_features=5005,
-                               ngram_range=(1, 2))
-        
-        # Create text feature matrix
-        self.tfidf_matrix = tfidf.fit_transform(self.df['text_features'])
+    def build_indexes(self):
+        """
+        Build the lookup indexes used at query time: isbn13 -> row, and category
+        membership as a sparse boolean (books x categories) matrix together with
+        a sorted array of row ids per category.
+        """
+        self.isbn_to_row = {isbn13: row for row, isbn13 in enumerate(self.df['isbn13'])}
         
-        # Add numerical features
-        numerical_features = np.column_stack((
-            self.df['norm_year'],
-            self.df['norm_rating']
-        ))
-        
-        # Combine text and numerical features
-        self.feature_matrix = np.hstack((
-            self.tfidf_matrix.toarray(),
-            numerical_features
-        ))
+        # Split each distinct categories string once, then select its row per book
+        categories = self.df['categories'].astype('category').cat
+        split = [value.split(',') for value in categories.categories]
+        codes, self.category_names = pd.factorize(
+            pd.Series(list(itertools.chain.from_iterable(split)), dtype=object), sort=True
+        )
+        by_value = sp.csr_matrix(
+            (np.ones(len(codes), dtype=bool), codes, np.concatenate(([0], np.cumsum([len(s) for s in split])))),
+            shape=(len(split), len(self.category_names)),
+        )
+        self.category_matrix = by_value[categories.codes.to_numpy()]
+        by_category = self.category_matrix.tocsc()
+        by_category.sort_indices()
+        self.category_rows = {
+            name: by_category.indices[by_category.indptr[code]:by_category.indptr[code + 1]]
+            for code, name in enumerate(self.category_names)
+        }
+
+    def create_feature_matrix(self, spill_dir, n_chunks, term_columns, numeric_features):
+        """
+        Turn the term counts scan_books() spilled into the feature matrix, one
+        chunk at a time: keep the vocabulary's columns, weight them by idf and
+        L2-normalize each row, as TfidfVectorizer does, and append the numeric
+        features. Finished chunks go back to spill_dir and are copied into the
+        final float32 CSR arrays, so the matrix is only held once.
+        """
+        rng = np.random.default_rng(0)
+        sample_rate = COVERAGE_SAMPLE / max(len(self.df), 1)
+        known, total = 0.0, 0.0
+        n_columns = len(self.idf) + numeric_features.shape[1]
+        nnz, first_row = 0, 0
+        for i in range(n_chunks):
+            data, indices, indptr = (np.load(os.path.join(spill_dir, f'{i}_{name}.npy'))
+                                     for name in ('data', 'indices', 'indptr'))
+            n_rows = len(indptr) - 1
+            rows = np.repeat(np.arange(n_rows), np.diff(indptr))
+            columns = term_columns[indices]
+            kept = columns >= 0
+            if self.vectorizer == 'tfidf':
+                # Vocabulary coverage of the terms of a sample of books
+                sampled = (rng.random(n_rows) < sample_rate)[rows]
+                known += float(data[sampled & kept].sum())
+                total += float(data[sampled].sum())
+            text_block = sp.csr_matrix((data[kept] * self.idf[columns[kept]], (rows[kept], columns[kept])),
+                                       shape=(n_rows, len(self.idf)), dtype=np.float32)
+            block = sp.hstack((normalize(text_block, norm='l2', copy=False),
+                               sp.csr_matrix(numeric_features[first_row:first_row + n_rows])), format='csr')
+            for name in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(spill_dir, f'{i}_{name}.npy'), getattr(block, name))
+            nnz += block.nnz
+            first_row += n_rows
+        self.vocabulary_coverage = known / total if total else 1.0
+
+        data = np.empty(nnz, dtype=np.float32)
+        indices = np.empty(nnz, dtype=np.int32)
+        indptr = np.empty(first_row + 1, dtype=np.int64)
+        indptr[0] = 0
+        nnz, first_row = 0, 0
+        for i in range(n_chunks):
+            block_data, block_indices, block_indptr = (np.load(os.path.join(spill_dir, f'{i}_{name}.npy'))
+                                                       for name in ('data', 'indices', 'indptr'))
+            data[nnz:nnz + len(block_data)] = block_data
+            indices[nnz:nnz + len(block_data)] = block_indices
+            indptr[first_row + 1:first_row + len(block_indptr)] = nnz + block_indptr[1:]
+            nnz += len(block_data)
+            first_row += len(block_indptr) - 1
+
+        self.numeric_features = numeric_features
+        self.feature_matrix = sp.csr_matrix((data, indices, indptr), shape=(first_row, n_columns), copy=False)
+
+    def numeric_rows(self, published_year, average_rating):
+        """Scale the numerical features to the fit-time [min, max] (as MinMaxScaler does), as float32."""
+        columns = []
+        for column, values in (('published_year', published_year), ('average_rating', average_rating)):
+            values = np.asarray(values, dtype=np.float64)
+            values = np.where(np.isnan(values), self.numeric_scaling[f'{column}_fill'], values)
+            value_range = self.numeric_scaling[f'{column}_range'] or 1.0
+            columns.append((values - self.numeric_scaling[f'{column}_min']) / value_range)
+        return np.column_stack(columns).astype(np.float32)
+
+    def get_text_vectorizer(self):
+        """
+        Return the fitted text vectorizer, rebuilding it from the stored
+        vocabulary and idf after load(). Its vocabulary and idf stay frozen.
+        """
+        if self.text_vectorizer is None:
+            if self.vectorizer == 'hashing':
+                transformer = TfidfTransformer()
+                transformer.idf_ = np.asarray(self.idf)
+                self.text_vectorizer = make_pipeline(
+                    HashingVectorizer(n_features=HASHING_FEATURES, alternate_sign=False, norm=None,
+                                      **TEXT_FEATURE_PARAMS),
+                    transformer,
+                )
+            else:
+                tfidf = TfidfVectorizer(vocabulary=self.vocabulary, **TEXT_FEATURE_PARAMS)
+                tfidf.idf_ = np.asarray(self.idf)
+                self.text_vectorizer = tfidf
+        return self.text_vectorizer
+
+    def count_terms(self, texts):
+        """
+        Return (terms in the vocabulary, all terms) of texts. Both are 0 for
+        the hashing vectorizer, which has no out-of-vocabulary terms.
+        """
+        if self.vectorizer == 'hashing':
+            return 0, 0
+        analyze = self.get_text_vectorizer().build_analyzer()
+        total = known = 0
+        for text_features in texts:
+            terms = analyze(text_features)
+            total += len(terms)
+            known += sum(term in self.vocabulary for term in terms)
+        return known, total
         
     def calculate_similarity(self):
-        """Calculate similarity matrix using cosine similarity."""
-        self.similarity_matrix = cosine_similarity(self.feature_matrix)
+        """
+        L2-normalize the feature rows so that cosine similarity becomes a plain
+        sparse dot product. Similarities are computed on demand for the query
+        rows only, so memory grows with the number of non-zeros instead of N².
+        """
+        self.feature_matrix = normalize(self.feature_matrix, norm='l2', copy=False)
+
+    def build_ann_index(self):
+        """Cluster the feature rows into an IVF index (see ann.py) used to narrow queries."""
+        self.ann_index = IVFIndex().fit(self.feature_matrix)
+
+    def query_profile(self, book_indices):
+        # The mean of the query rows' similarities equals the similarity to their
+        # mean vector, so averaging is one sparse mat-vec product instead of k
+        return self.feature_matrix[book_indices].mean(axis=0)
+
+    def score_profile(self, profile, rows=None):
+        """Return the similarity of every book, or of the books in rows only, to a query profile."""
+        features = self.feature_matrix if rows is None else self.feature_matrix[rows]
+        return np.asarray(features @ profile.T).ravel()
+
+    def score_books(self, book_indices):
+        """Return the mean cosine similarity of every book to the given rows."""
+        return self.score_profile(self.query_profile(book_indices))
+
+    def top_k(self, scores, k, exclude=None, candidates=None):
+        """
+        Return (indices, scores) of the k highest scores, best first. If candidates
+        (row ids) is given, only those rows are considered. Selection is an
+        O(N) argpartition followed by a sort of just the k winners.
+        """
+        if candidates is None:
+            candidate_scores = scores.copy()
+            if exclude is not None:
+                candidate_scores[exclude] = -np.inf
+        else:
+            candidate_scores = scores[candidates]  # fancy indexing copies
+            if exclude is not None:
+                candidate_scores[np.isin(candidates, exclude)] = -np.inf
+        k = min(k, len(candidate_scores))
+        if k <= 0:
+            return np.array([], dtype=np.intp), np.array([], dtype=scores.dtype)
+
+        top = np.argpartition(-candidate_scores, k - 1)[:k]
+        top = top[np.argsort(-candidate_scores[top], kind='stable')]
+        top = top[np.isfinite(candidate_scores[top])]
+        return (top if candidates is None else candidates[top]), candidate_scores[top]
         
     def get_available_categories(self):
         """Get list of all unique categories in the dataset."""
-        all_categories = set()
-        for cats in self.df['categories']:
-            all_categories.update(cats)
-        return sorted(list(all_categories))
-        
-    def get_recommendations(self, book_indices, n_recommendations=15):
-        """Get book recommendations based on similarity to multiple books."""
-        # If we have multiple books, combine their similarity scores
-        if isinstance(book_indices, list):
-            sim_scores = np.zeros(len(self.similarity_matrix))
-            for idx in book_indices:
-                sim_scores += self.similarity_matrix[idx]
-            sim_scores /= len(book_indices)  # Average the scores
-        else:
-            sim_scores = self.similarity_matrix[book_indices]
-        
-        # Convert to list of tuples (index, score)
-        sim_scores = list(enumerate(sim_scores))
-        
-        # Sort books by similarity score
-        sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-        
-        # Remove books that were in the input indices
-        if isinstance(book_indices, list):
-            sim_scores = [(i, score) for i, score in sim_scores if i not in book_indices]
-        else:
-            sim_scores = sim_scores[1:]  # Skip the first book (itself)
+        return list(self.category_names)
         
+    def get_recommendations(self, book_indices, n_recommendations=15, category=None):
+        """
+        Get book recommendations based on similarity to multiple books,
+        optionally restricted to one category.
+        """
+        # A single index and a list of indices are both scored as one profile
+        query_indices = np.atleast_1d(np.asarray(book_indices, dtype=np.intp))
+
+        # Skip the books that were used as input
+        return self.recommend_for_profile(
+            self.query_profile(query_indices), n_recommendations, category, exclude=query_indices
+        )
+
+    def recommend_for_profile(self, profile, n_recommendations=15, category=None, exclude=None):
+        """
+        Get the books most similar to a query profile (a 1 x features vector),
+        optionally restricted to one category and skipping the rows in exclude.
+        """
+        exclude = np.empty(0, np.intp) if exclude is None else exclude
+        candidates = None if category is None else self.category_rows.get(category, np.empty(0, np.int32))
+
+        if self.ann_index is not None:
+            # Score only the rows of the clusters closest to the query
+            candidates = self.ann_index.candidates(
+                profile, allowed=candidates, min_candidates=n_recommendations + len(exclude),
+            )
+            positions, top_scores = self.top_k(
+                self.score_profile(profile, candidates), n_recommendations,
+                exclude=np.flatnonzero(np.isin(candidates, exclude)),
+            )
+            return self.result_frame(candidates[positions], top_scores)
+
         # Get top N recommendations
-        sim_scores = sim_scores[:n_recommendations]
-        book_indices = [i[0] for i in sim_scores]
+        book_indices, top_scores = self.top_k(
+            self.score_profile(profile), n_recommendations, exclude=exclude, candidates=candidates
+        )
         
-        # Return recommended books with similarity scores
+        return self.result_frame(book_indices, top_scores)
+
+    def text_profile(self, query):
+        """
+        Return the query profile of a free text: its text features from the
+        fitted vectorizer, L2-normalized like the feature rows, with the
+        numeric features left at zero so that books are compared by text only.
+        """
+        text_features = self.get_text_vectorizer().transform([query]).astype(np.float32)
+        profile = np.zeros((1, self.feature_matrix.shape[1]), dtype=np.float32)
+        profile[:, :text_features.shape[1]] = text_features.toarray()
+        return normalize(profile, norm='l2', copy=False)
+
+    def recommend_for_text(self, query, category=None, n_recommendations=15):
+        """
+        Get the books most similar to a free-text query, such as a description
+        of the book the user wants, optionally restricted to one category.
+        The query is transformed once and scored in memory against the
+        catalog's features. Books sharing no term with it are left out.
+        """
+        recommendations = self.recommend_for_profile(self.text_profile(query), n_recommendations, category)
+        return recommendations[recommendations['similarity_score'] > 0]
+
+    def result_frame(self, book_indices, scores):
+        """Return recommended books with similarity scores."""
         recommendations = self.df.iloc[book_indices][
             ['isbn13', 'title', 'authors', 'categories', 'average_rating', 'thumbnail', 'description']
         ].copy()
-        recommendations['similarity_score'] = [i[1] for i in sim_scores]
+        recommendations['categories'] = recommendations['categories'].astype(object).str.split(',')
+        recommendations['similarity_score'] = scores
         
         return recommendations
 
-    def recommend_books(self, user_id, category, n_recommendations=30):
-        """Main recommendation function that combines user ratings and content-based approach."""
+    def query_rows(self, user_id, category):
+        """
+        Pick the books a user's recommendations in a category are based on.
+        Returns (row indices, recommendation basis), or (None, None) for an
+        unknown category.
+        """
         # First, check if user has rated any books in the category
         rated_books = self.get_user_rated_books_in_category(user_id, category)
         
-        # Filter books by category
-        category_mask = self.df['categories'].apply(lambda x: category in x)
-        self.df_filtered = self.df[category_mask].copy()
+        # Books in the category, from the fit-time inverted index
+        category_rows = self.category_rows.get(category, np.empty(0, np.int32))
         
         if rated_books:
             # Use rated books as basis for recommendations
-            rated_indices = [book[2] for book in rated_books]
-            # Get recommendations based on rated books
-            recommendations = self.get_recommendations(rated_indices, n_recommendations)
-            recommendations['recommendation_basis'] = 'Based on your ratings'
-        else:
+            return [book[2] for book in rated_books], 'Based on your ratings'
+        if len(category_rows):
             # Use top-rated books in category as fallback
-            top_book_idx = self.df_filtered.sort_values('average_rating', ascending=False).index[0]
-            recommendations = self.get_recommendations(top_book_idx, n_recommendations)
-            recommendations['recommendation_basis'] = 'Based on popular books in category'
+            average_rating = self.df['average_rating'].to_numpy()
+            return [category_rows[np.argmax(average_rating[category_rows])]], 'Based on popular books in category'
+        return None, None
+
+    def recommend_books(self, user_id, category, n_recommendations=30):
+        """Main recommendation function that combines user ratings and content-based approach."""
+        rows, basis = self.query_rows(user_id, category)
+        
+        if rows is None:
+            # Unknown category: nothing to recommend
+            recommendations = self.result_frame([], [])
+        else:
+            recommendations = self.get_recommendations(rows, n_recommendations, category)
+        recommendations['recommendation_basis'] = basis
             
         return recommendations
 
-    def fit(self, df):
-        """Fit the recommender system to the data."""
-        self.prepare_data(df)
-        self.create_feature_matrix()
+    def iter_recommend_batch(self, pairs, n_recommendations=30, chunk_size=64):
+        """
+        Yield ((user_id, category), recommendations) for every pair, like
+        recommend_books. The query profiles of each chunk of pairs are stacked
+        into one sparse matrix and scored against the catalog with a single
+        sparse product; only the books x pairs scores are dense.
+        """
+        pairs = list(pairs)
+        for start in range(0, len(pairs), chunk_size):
+            chunk = pairs[start:start + chunk_size]
+            queries = [self.query_rows(user_id, category) for user_id, category in chunk]
+
+            # Averaging matrix: row p holds 1/k at the k query rows of pair p
+            weight_rows, weight_cols, weights = [], [], []
+            for position, (rows, _) in enumerate(queries):
+                if rows:
+                    weight_rows.extend([position] * len(rows))
+                    weight_cols.extend(rows)
+                    weights.extend([1.0 / len(rows)] * len(rows))
+            averaging = sp.csr_matrix(
+                (weights, (weight_rows, weight_cols)), shape=(len(chunk), self.feature_matrix.shape[0])
+            )
+            profiles = averaging @ self.feature_matrix
+            scores = (self.feature_matrix @ profiles.T).toarray()  # books x pairs
+
+            for position, ((user_id, category), (rows, basis)) in enumerate(zip(chunk, queries)):
+                if rows is None:
+                    recommendations = self.result_frame([], [])
+                else:
+                    book_indices, top_scores = self.top_k(
+                        scores[:, position], n_recommendations,
+                        exclude=np.asarray(rows, dtype=np.intp), candidates=self.category_rows[category],
+                    )
+                    recommendations = self.result_frame(book_indices, top_scores)
+                recommendations['recommendation_basis'] = basis
+                yield (user_id, category), recommendations
+
+    def recommend_batch(self, pairs, n_recommendations=30):
+        """Recommend books for many (user_id, category) pairs at once."""
+        return [recommendations for _, recommendations in self.iter_recommend_batch(pairs, n_recommendations)]
+
+    def fit(self, df, content_hash=None):
+        """Fit the recommender system to the books in a DataFrame."""
+        self.fit_chunks([df], content_hash)
+
+    def fit_chunks(self, chunks, content_hash=None):
+        """
+        Fit the recommender system to books given as an iterable of DataFrame
+        chunks (BOOK_COLUMNS). Only one chunk of their text is held in memory
+        at a time; term counts go through a temporary directory.
+        """
+        with tempfile.TemporaryDirectory(prefix='bookwise-fit-') as spill_dir:
+            numeric_features, term_columns, n_chunks = self.scan_books(chunks, spill_dir)
+            self.create_feature_matrix(spill_dir, n_chunks, term_columns, numeric_features)
         self.calculate_similarity()
+        self.build_indexes()
+        self.ann_index = None
+        if len(self.df) >= ANN_MIN_BOOKS:
+            self.build_ann_index()
+        self.user_profiles = UserProfileStore(self.isbn_to_row)
+        self.content_hash = content_hash
+        self.model_version = time.strftime('%Y%m%d%H%M%S') + '-' + (content_hash or 'unhashed')[:12]
+        self.ingested_books = 0
+        self.ingested_terms = [0, 0]
+        self.needs_refit = False
+
+    def ingest(self, df, content_hash=None):
+        """
+        Return a new model with the books in df added, or updated if their
+        isbn13 is already in the catalog, without refitting.
+
+        Only the rows of df are transformed, against the frozen vocabulary, idf
+        and numeric scaling of the last fit. Updated books keep their row, so
+        user profiles stay valid; new books are appended. needs_refit is set
+        once vocabulary drift or the number of ingested books calls for a full
+        fit. The user profile store is shared with the new model.
+        """
+        rows = self.prepare_rows(df.drop_duplicates('isbn13', keep='last').reset_index(drop=True))
+        numeric_features = self.numeric_rows(rows['published_year'], rows['average_rating'])
+        features = sp.hstack(
+            (self.get_text_vectorizer().transform(rows['text_features']).astype(np.float32),
+             sp.csr_matrix(numeric_features)),
+            format='csr',
+        )
+        features = normalize(features, norm='l2', copy=False)
+
+        # Rows of the stacked (current + ingested) arrays, in the new catalog order
+        existing_rows = rows['isbn13'].map(self.isbn_to_row)
+        is_new = existing_rows.isna().to_numpy()
+        n_books = self.feature_matrix.shape[0]
+        ingested_rows = n_books + np.arange(len(rows))
+        order = np.concatenate((np.arange(n_books), ingested_rows[is_new]))
+        order[existing_rows[~is_new].to_numpy(dtype=np.intp)] = ingested_rows[~is_new]
+
+        model = BookRecommender(self.vectorizer)
+        model.feature_matrix = sp.vstack((self.feature_matrix, features), format='csr')[order]
+        model.numeric_features = np.vstack((self.numeric_features, numeric_features))[order]
+        model.df = pd.concat(
+            (self.df[CATALOG_COLUMNS], rows[CATALOG_COLUMNS]), ignore_index=True
+        ).iloc[order].reset_index(drop=True)
+        model.df['categories'] = model.df['categories'].astype(object).astype('category')
+        model.numeric_scaling = self.numeric_scaling
+        model.vocabulary = self.vocabulary
+        model.idf = self.idf
+        model.text_vectorizer = self.get_text_vectorizer()
+        model.vocabulary_coverage = self.vocabulary_coverage
+        model.build_indexes()
+        if self.ann_index is not None:
+            # Ingested rows join the cluster of their nearest centroid
+            model.ann_index = IVFIndex(self.ann_index.n_lists, self.ann_index.n_probe)
+            model.ann_index.centroids = self.ann_index.centroids
+            model.ann_index.set_assignments(
+                np.concatenate((self.ann_index.assignments, self.ann_index.nearest(features)))[order]
+            )
+
+        # Existing books keep their rows, so the profiles only need the new isbn13s
+        model.user_profiles = self.user_profiles
+        model.user_profiles.isbn_to_row = model.isbn_to_row
+
+        model.ingested_books = self.ingested_books + len(rows)
+        known, total = self.count_terms(rows['text_features'])
+        model.ingested_terms = [self.ingested_terms[0] + known, self.ingested_terms[1] + total]
+        drift = 0.0
+        if model.ingested_terms[1] and model.ingested_books >= REFIT_MIN_BOOKS:
+            drift = self.vocabulary_coverage - model.ingested_terms[0] / model.ingested_terms[1]
+        model.needs_refit = (self.needs_refit or drift > REFIT_DRIFT
+                             or model.ingested_books > REFIT_FRACTION * len(model.df))
+        model.content_hash = content_hash
+        model.model_version = time.strftime('%Y%m%d%H%M%S') + '-' + (content_hash or 'unhashed')[:12]
+        print(f"Ingested {len(rows)} books ({int(is_new.sum())} new), vocabulary drift {drift:.3f}"
+              + (", refit needed" if model.needs_refit else ""))
+        return model
+
+    def save(self, model_dir=DEFAULT_MODEL_DIR):
+        """
+        Write the fitted model as a versioned artifact under model_dir and point
+        model_dir/LATEST at it. Arrays are stored as plain .npy files so that
+        load() can memory-map them.
+        """
+        path = os.path.join(model_dir, self.model_version)
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'features_data.npy'), self.feature_matrix.data)
+        np.save(os.path.join(tmp_path, 'features_indices.npy'), self.feature_matrix.indices)
+        np.save(os.path.join(tmp_path, 'features_indptr.npy'), self.feature_matrix.indptr)
+        np.save(os.path.join(tmp_path, 'numeric_features.npy'), self.numeric_features)
+        np.save(os.path.join(tmp_path, 'idf.npy'), np.asarray(self.idf))
+        with open(os.path.join(tmp_path, 'vocabulary.json'), 'w') as f:
+            json.dump(self.vocabulary, f)
+        self.df[CATALOG_COLUMNS].to_pickle(os.path.join(tmp_path, 'catalog.pkl'))
+
+        manifest = {
+            'format_version': ARTIFACT_FORMAT_VERSION,
+            'model_version': self.model_version,
+            'content_hash': self.content_hash,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'n_books': self.feature_matrix.shape[0],
+            'n_features': self.feature_matrix.shape[1],
+            'vectorizer': self.vectorizer,
+            'numeric_scaling': self.numeric_scaling,
+            'vocabulary_coverage': self.vocabulary_coverage,
+            'ingested_books': self.ingested_books,
+            'ingested_terms': self.ingested_terms,
+            'needs_refit': self.needs_refit,
+            'ann': self.ann_index.save(tmp_path) if self.ann_index is not None else None,
+        }
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another process already published the same version
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        latest_tmp = os.path.join(model_dir, f"LATEST.tmp-{os.getpid()}")
+        with open(latest_tmp, 'w') as f:
+            f.write(self.model_version)
+        os.replace(latest_tmp, os.path.join(model_dir, 'LATEST'))
+        prune_artifacts(model_dir, keep=self.model_version)
+        return path
+
+    @classmethod
+    def load(cls, model_dir=DEFAULT_MODEL_DIR, model_version=None):
+        """
+        Load a model artifact written by save(). Feature arrays are opened with
+        mmap_mode='r', so processes loading the same artifact share its pages
+        through the OS page cache. Raises FileNotFoundError if there is none.
+        """
+        if model_version is None:
+            with open(os.path.join(model_dir, 'LATEST')) as f:
+                model_version = f.read().strip()
+        path = os.path.join(model_dir, model_version)
+
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest['format_version'] != ARTIFACT_FORMAT_VERSION:
+            raise ValueError(f"Unsupported model artifact format {manifest['format_version']} in {path}")
+
+        model = cls(manifest['vectorizer'])
+        model.feature_matrix = sp.csr_matrix((
+            np.load(os.path.join(path, 'features_data.npy'), mmap_mode='r'),
+            np.load(os.path.join(path, 'features_indices.npy'), mmap_mode='r'),
+            np.load(os.path.join(path, 'features_indptr.npy'), mmap_mode='r'),
+        ), shape=(manifest['n_books'], manifest['n_features']), copy=False)
+        model.numeric_features = np.load(os.path.join(path, 'numeric_features.npy'), mmap_mode='r')
+        model.idf = np.load(os.path.join(path, 'idf.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'vocabulary.json')) as f:
+            model.vocabulary = json.load(f)
+        model.df = pd.read_pickle(os.path.join(path, 'catalog.pkl'))
+        model.build_indexes()
+        model.user_profiles = UserProfileStore(model.isbn_to_row)
+        model.numeric_scaling = manifest['numeric_scaling']
+        model.vocabulary_coverage = manifest['vocabulary_coverage']
+        model.ingested_books = manifest['ingested_books']
+        model.ingested_terms = manifest.get('ingested_terms', [0, 0])
+        model.needs_refit = manifest['needs_refit']
+        if manifest['ann'] is not None:
+            model.ann_index = IVFIndex.load(path, manifest['ann'])
+        model.content_hash = manifest['content_hash']
+        model.model_version = manifest['model_version']
+        return model
 
 
 load_dotenv()
 
+_engine = None
+
+def get_engine():
+    """Return a SQLAlchemy engine for DATABASE_URL, created once per process."""
+    global _engine
+    if _engine is None:
+        # Get the DATABASE_URL from the .env file
+        _engine = create_engine(os.getenv("DATABASE_URL"))
+    return _engine
+
+def iter_books(connection, columns=BOOK_COLUMNS, isbn13_list=None, chunk_size=LOAD_CHUNK_SIZE):
+    """
+    Yield books (all of them, or those in isbn13_list) as DataFrame chunks of
+    the given columns, ordered by isbn13; row_hash is ROW_HASH_SQL. On a
+    connection with stream_results, rows come from a server-side cursor, so
+    only one chunk is in memory at a time.
+    """
+    select = ', '.join(f'{ROW_HASH_SQL} AS row_hash' if column == 'row_hash' else f'b.{column}' for column in columns)
+    where = '' if isbn13_list is None else 'WHERE b.isbn13 = ANY(:isbn13_list)'
+    query = text(f"SELECT {select} FROM books b {where} ORDER BY b.isbn13")
+    dtype = {column: dtype for column, dtype in (('published_year', 'float32'), ('average_rating', 'float64'))
+             if column in columns}
+    yield from pd.read_sql(query, connection, params={'isbn13_list': list(isbn13_list or [])},
+                           chunksize=chunk_size, dtype=dtype)
+
 # PostgreSQL database connection
-def get_data_from_postgresql():
-    # Get the DATABASE_URL from the .env file
-    database_url = os.getenv("DATABASE_URL")
-    
-    # Set up your PostgreSQL connection details
-    engine = create_engine(database_url)
-    
-    # Fetch data from the database
-    query = "SELECT * FROM books"
-    df = pd.read_sql(query, engine)
-    
-    return df
-
-# Fetch data from PostgreSQL
-df = get_data_from_postgresql()
-
-# Initialize and fit the recommender
-recommender = BookRecommender()
-recommender.fit(df)
-
-
-# # Get recommendations for a user in a specific category
-# 
-# print(recommendations)
+def get_data_from_postgresql(isbn13_list=None):
+    """Read books (all of them, or those in isbn13_list) with the row_hash of each."""
+    with get_engine().connect().execution_options(stream_results=True) as connection:
+        chunks = list(iter_books(connection, isbn13_list=isbn13_list))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(columns=BOOK_COLUMNS)
+
+def fit_from_postgresql(content_hash=None, chunk_size=LOAD_CHUNK_SIZE):
+    """Fit a new model on the books table, streamed in chunks of chunk_size books."""
+    model = BookRecommender()
+    with get_engine().connect().execution_options(stream_results=True) as connection:
+        model.fit_chunks(iter_books(connection, chunk_size=chunk_size), content_hash)
+    return model
+
+def get_books_content_hash():
+    """Return an md5 over the row_hash of every book, used to detect stale model artifacts."""
+    engine = get_engine()
+    query = text(f"""
+        SELECT md5(COALESCE(string_agg({ROW_HASH_SQL}, '' ORDER BY b.isbn13), ''))
+        FROM books b
+    """)
+    with engine.connect() as connection:
+        return connection.execute(query).scalar()
+
+def ingest_changes(model, content_hash=None):
+    """
+    Bring a model up to date with the books table by ingesting the books that
+    are new or changed since it was built. Returns the new model (check its
+    needs_refit), the model itself if nothing changed, or None if books were
+    deleted, which only a full refit handles.
+    """
+    content_hash = content_hash or get_books_content_hash()
+    if model.content_hash == content_hash:
+        return model
+
+    current = pd.read_sql(f"SELECT b.isbn13, {ROW_HASH_SQL} AS row_hash FROM books b", get_engine())
+    known = dict(zip(model.df['isbn13'], model.df['row_hash']))
+    if len(known.keys() - set(current['isbn13'])):
+        return None
+    changed = current.loc[current['row_hash'] != current['isbn13'].map(known), 'isbn13']
+    return model.ingest(get_data_from_postgresql(changed.tolist()), content_hash)
+
+@contextmanager
+def artifact_lock(wait=True):
+    """
+    Hold the PostgreSQL advisory lock on building model artifacts. Yields True
+    once it is held, or False right away if wait is False and another process
+    holds it.
+    """
+    with get_engine().connect() as connection:
+        params = {'key': ARTIFACT_LOCK_KEY}
+        acquired = connection.execute(text("SELECT pg_try_advisory_lock(:key)"), params).scalar()
+        if not acquired and wait:
+            connection.execute(text("SELECT pg_advisory_lock(:key)"), params)
+            acquired = True
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                connection.execute(text("SELECT pg_advisory_unlock(:key)"), params)
+
+def prune_artifacts(model_dir, keep=None, n_versions=MODEL_KEEP_VERSIONS):
+    """
+    Delete all but the n_versions newest model artifacts in model_dir. The
+    version keep (the one LATEST points at) is never deleted.
+    """
+    versions = sorted(
+        (name for name in os.listdir(model_dir)
+         if '.tmp-' not in name and os.path.isfile(os.path.join(model_dir, name, 'manifest.json'))),
+        reverse=True,
+    )
+    for version in versions[max(n_versions, 1):]:
+        if version != keep:
+            shutil.rmtree(os.path.join(model_dir, version), ignore_errors=True)
+
+def load_latest(model_dir):
+    """Load the latest model artifact in model_dir, or return None if there is no usable one."""
+    try:
+        return BookRecommender.load(model_dir)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"No usable recommender model in {model_dir} ({e}).")
+        return None
+
+def load_or_fit(model_dir=None, refit=False, validate=None, wait=True):
+    """
+    Load the latest model artifact if it matches the current books table,
+    otherwise ingest the changed books into it or, when that is not enough,
+    fit a new model from PostgreSQL, and save the result as the new artifact.
+    With refit, always fit a new model. validate, if given, is called with a
+    newly built model before it is saved and may raise to reject it.
+
+    Models are only built while holding artifact_lock(). A process that waited
+    for it loads the artifact saved meanwhile instead of building its own;
+    with wait False, None is returned if another process holds the lock.
+    """
+    model_dir = model_dir or os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR)
+    content_hash = get_books_content_hash()
+
+    model = None if refit else load_latest(model_dir)
+    if model is not None and model.content_hash == content_hash:
+        print(f"Loaded recommender model {model.model_version}")
+    else:
+        seen_version = latest_model_version(model_dir)
+        with artifact_lock(wait) as acquired:
+            if not acquired:
+                print("Another process is building the recommender model.")
+                return None
+            if latest_model_version(model_dir) != seen_version:
+                # Another process saved an artifact while this one waited
+                model = load_latest(model_dir)
+            model = build_model(model, content_hash, model_dir, validate)
+
+    model.user_profiles.load(get_engine())
+    return model
+
+def build_model(model, content_hash, model_dir, validate=None):
+    """
+    Bring model (or None) up to date with content_hash: keep it if it matches,
+    ingest the changed books into it if that is enough, otherwise fit a new
+    model. A new model is validated and saved to model_dir.
+    """
+    if model is not None and model.content_hash == content_hash:
+        print(f"Loaded recommender model {model.model_version}")
+        return model
+    try:
+        if model is not None:
+            print(f"Recommender model {model.model_version} is stale, ingesting changed books.")
+            model = ingest_changes(model, content_hash)
+            if model is None or model.needs_refit:
+                print("Catalog changed too much to ingest, refitting.")
+                model = None
+            else:
+                if validate:
+                    validate(model)
+                model.save(model_dir)
+                print(f"Saved recommender model {model.model_version}")
+    except ValueError as e:
+        print(f"Ingesting changed books failed ({e}), fitting.")
+        model = None
+
+    if model is None:
+        model = fit_from_postgresql(content_hash)
+        if validate:
+            validate(model)
+        model.save(model_dir)
+        print(f"Saved recommender model {model.model_version}")
+    return model
+
+def load_artifact(model_version, model_dir=None):
+    """Load a saved model version, e.g. one another process built, with the current user profiles."""
+    model = BookRecommender.load(model_dir or os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR), model_version)
+    model.user_profiles.load(get_engine())
+    return model
+
+def latest_model_version(model_dir=None):
+    """Return the version model_dir/LATEST points at, or None if there is none."""
+    try:
+        with open(os.path.join(model_dir or os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR), 'LATEST')) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+# Process-wide recommender, created on first use instead of at import time
+_recommender = None
+_recommender_lock = threading.Lock()
+
+def get_recommender():
+    """Return the shared recommender, loading (or fitting) it on first use."""
+    global _recommender
+    if _recommender is None:
+        with _recommender_lock:
+            if _recommender is None:
+                start = time.perf_counter()
+                _recommender = load_or_fit()
+                message = f"Recommender ready in {time.perf_counter() - start:.2f}s"
+                if resource:
+                    message += f" (max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB)"
+                print(message)
+    return _recommender
+
+def get_loaded_recommender():
+    """Return the shared recommender if it has been loaded already, without loading it."""
+    return _recommender
+
+def set_recommender(model):
+    """Replace the shared recommender; requests already running keep the old one."""
+    global _recommender
+    _recommender = model
+
+# Held while the shared recommender is ingested into or rebuilt, so that one
+# update at a time builds on the current model
+rebuild_lock = threading.Lock()
+
+def ingest_recommender():
+    """
+    Ingest the books changed since the shared recommender was built, save the
+    result as the new artifact and swap it in. Returns (model, number of books
+    ingested), or (None, 0) if books were deleted and only a refit will do.
+    """
+    with rebuild_lock, artifact_lock():
+        model = get_recommender()
+        updated = ingest_changes(model)
+        if updated is None:
+            return None, 0
+        if updated is not model:
+            updated.save(os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR))
+            set_recommender(updated)
+        return updated, updated.ingested_books - model.ingested_books
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the book recommender and write the model artifact.")
+    parser.add_argument('command', choices=['fit', 'ingest'],
+                        help="fit: refit if stale; ingest: only ingest books changed since the latest artifact")
+    parser.add_argument('--model-dir', default=os.getenv("MODEL_DIR", DEFAULT_MODEL_DIR))
+    parser.add_argument('--force', action='store_true', help="Refit even if the latest artifact is up to date.")
+    parser.add_argument('--chunk-size', type=int, default=LOAD_CHUNK_SIZE, help="Books read per chunk when fitting.")
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        with artifact_lock():
+            model = ingest_changes(BookRecommender.load(args.model_dir))
+            if model is None:
+                raise SystemExit("Books were deleted, which needs a full refit; run 'fit --force' instead.")
+            print(f"Saved recommender model to {model.save(args.model_dir)}")
+        if model.needs_refit:
+            print("Vocabulary drift or ingested volume calls for a full refit ('fit --force').")
+    elif args.force:
+        with artifact_lock():
+            model = fit_from_postgresql(get_books_content_hash(), args.chunk_size)
+            print(f"Saved recommender model to {model.save(args.model_dir)}")
+    else:
+        load_or_fit(args.model_dir)
+    if resource:
+        print(f"Peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
@@ -0,0 +1,134 @@
+"""
+Ranked book search over the columns maintained by migration 007_book_search.sql.
+
+A book matches a search text when its search_vector (title, subtitle, authors
+and description) matches the text as a web-style query ("quoted phrases",
+-excluded words, or), or when its title or authors are similar to the text
+by pg_trgm word similarity, which catches typos the full-text match misses.
+Every condition is served by an index, so only matching books are read.
+"""
+import os
+
+# Text search configuration books.search_vector is built with; queries must be
+# parsed with the same one or stemmed words would not match
+SEARCH_CONFIG = 'english'
+
+# Word similarity (0-1) a title or author needs to count as a fuzzy match;
+# pg_trgm's default of 0.6 misses common typos such as "tolkein"
+FUZZY_THRESHOLD = float(os.getenv("SEARCH_FUZZY_THRESHOLD", 0.5))
+
+# WHERE condition on books b: authors similar to the %s parameter (apply
+# set_fuzzy_threshold first)
+FUZZY_AUTHOR_SQL = "%s <%% b.authors"
+
+# Longest search text accepted
+MAX_SEARCH_LENGTH = 200
+
+# Most matches of each kind read from its index. A search for a very common
+# word stops reading after this many instead of ranking every match, so its
+# latency does not grow with the catalog; searches with fewer matches read
+# all of them
+MAX_MATCHES = int(os.getenv("SEARCH_MAX_MATCHES", 1000))
+
+# Most books kept from the matches of each kind read, the most relevant ones
+# (highest ts_rank_cd, or highest word similarity of the title or authors),
+# to be ranked together
+MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", 500))
+
+# Title (with subtitle and authors) part of books.search_vector; it has its own
+# index so that title matches are collected before description-only ones
+TITLE_VECTOR_SQL = "public.book_search_vector(b.title, b.subtitle, b.authors, NULL)"
+
+# Matches rank by full-text relevance (ts_rank_cd, normalized to 0-1) plus the
+# best word similarity of the title or authors (0-1), so an exact title or
+# author match ranks first, and a typo still ranks by how close it is
+SCORE_SQL = """
+    ts_rank_cd(b.search_vector, query, 32)
+    + greatest(word_similarity(%(text)s, b.title), word_similarity(%(text)s, b.authors))
+"""
+
+
+def set_fuzzy_threshold(cursor):
+    """Use FUZZY_THRESHOLD for the word similarity matches of the current transaction."""
+    cursor.execute("SELECT set_config('pg_trgm.word_similarity_threshold', %s, true);", (str(FUZZY_THRESHOLD),))
+
+
+def search_books(cursor, text, category=None, limit=20, after=None):
+    """
+    Rank the books matching a search text.
+
+    Candidates are collected from the title, full-text, title similarity and
+    author similarity indexes: of the first MAX_MATCHES matches of each kind,
+    the MAX_CANDIDATES most relevant (title and description matches
+    together). They are then ranked together.
+
+    Args:
+        text (str): The search text.
+        category (str): Only return books in this category.
+        limit (int): Number of books to return.
+        after (tuple): (score, isbn13) of the last book of the previous page;
+            books are returned by descending score, then descending isbn13.
+
+    Returns:
+        list: (isbn13, score) tuples, best match first.
+    """
+    set_fuzzy_threshold(cursor)
+    cursor.execute(*search_query(text, category, limit, after))
+    return cursor.fetchall()
+
+
+def search_query(text, category=None, limit=20, after=None):
+    """Query and parameters of search_books(); run set_fuzzy_threshold() first."""
+    params = {
+        'text': text, 'config': SEARCH_CONFIG, 'category': category,
+        'max_matches': MAX_MATCHES, 'max_candidates': MAX_CANDIDATES, 'limit': limit,
+    }
+    if after is not None:
+        params['score'], params['isbn13'] = after
+    in_category = (
+        "AND EXISTS (SELECT 1 FROM book_categories bc WHERE bc.category = %(category)s AND bc.isbn13 = b.isbn13)"
+        if category else ""
+    )
+
+    query = f"""
+        WITH query AS (
+            SELECT websearch_to_tsquery(%(config)s::regconfig, %(text)s) AS query
+        ), title_matches AS (
+            SELECT m.isbn13
+            FROM (SELECT b.isbn13, b.search_vector FROM books b, query
+                  WHERE {TITLE_VECTOR_SQL} @@ query {in_category}
+                  LIMIT %(max_matches)s) m, query
+            ORDER BY ts_rank_cd(m.search_vector, query, 32) DESC
+            LIMIT %(max_candidates)s
+        ), candidates AS (
+            SELECT isbn13 FROM title_matches
+            UNION
+            -- Description-only matches rank below title matches, so they only fill up the rest
+            (SELECT m.isbn13
+             FROM (SELECT b.isbn13, b.search_vector FROM books b, query
+                   WHERE b.search_vector @@ query {in_category}
+                   LIMIT %(max_matches)s) m, query
+             ORDER BY ts_rank_cd(m.search_vector, query, 32) DESC
+             LIMIT %(max_candidates)s - (SELECT count(*) FROM title_matches))
+            UNION
+            (SELECT m.isbn13
+             FROM (SELECT b.isbn13, b.title FROM books b
+                   WHERE %(text)s <%% b.title {in_category} LIMIT %(max_matches)s) m
+             ORDER BY %(text)s <<-> m.title LIMIT %(max_candidates)s)
+            UNION
+            (SELECT m.isbn13
+             FROM (SELECT b.isbn13, b.authors FROM books b
+                   WHERE %(text)s <%% b.authors {in_category} LIMIT %(max_matches)s) m
+             ORDER BY %(text)s <<-> m.authors LIMIT %(max_candidates)s)
+        ), matches AS (
+            SELECT b.isbn13, ({SCORE_SQL})::float8 AS score
+            FROM candidates c
+            JOIN books b ON b.isbn13 = c.isbn13, query
+        )
+        SELECT isbn13, score
+        FROM matches
+        {"WHERE (score, isbn13) < (%(score)s, %(isbn13)s)" if after is not None else ""}
+        ORDER BY score DESC, isbn13 DESC
+        LIMIT %(limit)s;
+    """
+    return query, params
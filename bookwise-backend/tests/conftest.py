@@ -0,0 +1,90 @@
+import os
+import sys
+
+import psycopg2
+import pytest
+from dotenv import load_dotenv
+
+# The backend modules live in the parent directory, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+load_dotenv()
+
+# ISBN13s of the books created by tests; no real ISBN13 starts with 999
+TEST_ISBN13_PREFIX = "999"
+
+
+@pytest.fixture(scope="session")
+def database_url():
+    """DATABASE_URL of a database with every migration applied; tests needing it are skipped without one."""
+    url = os.getenv("DATABASE_URL")
+    if not url:
+        pytest.skip("DATABASE_URL is not set")
+    try:
+        psycopg2.connect(url).close()
+    except psycopg2.Error as e:
+        pytest.skip(f"Database is not available: {e}")
+    return url
+
+
+@pytest.fixture
+def connection(database_url):
+    connection = psycopg2.connect(database_url)
+    yield connection
+    connection.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def make_book(connection):
+    """Insert a book with a test ISBN13 and return the ISBN13; the books are deleted after the test."""
+    created = []
+
+    def make(**columns):
+        isbn13 = f"{TEST_ISBN13_PREFIX}{os.getpid() % 10000:04d}{len(created):06d}"
+        columns = {"isbn13": isbn13, "title": f"Test book {isbn13}", **columns}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO books ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                list(columns.values()),
+            )
+        connection.commit()
+        created.append(isbn13)
+        return isbn13
+
+    yield make
+    connection.rollback()
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM books WHERE isbn13 = ANY(%s)", (created,))
+    connection.commit()
+
+
+@pytest.fixture
+def make_user(connection):
+    """Insert a user and return the id; users (and their likes and reviews) are deleted after the test."""
+    created = []
+
+    def make():
+        with connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO users (username, email, password)
+                VALUES ('test-' || gen_random_uuid(), gen_random_uuid() || '@test', 'x')
+                RETURNING user_id
+            """)
+            created.append(cursor.fetchone()[0])
+        connection.commit()
+        return created[-1]
+
+    yield make
+    connection.rollback()
+    with connection.cursor() as cursor:
+        cursor.execute("DELETE FROM users WHERE user_id = ANY(%s)", (created,))
+    connection.commit()
+
+
+def fetch_one(connection, query, params=()):
+    """Run a query in a fresh snapshot and return its first row."""
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+    connection.commit()
+    return row
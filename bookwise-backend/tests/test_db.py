@@ -0,0 +1,45 @@
+import pytest
+
+from db import ConnectionPool
+
+
+@pytest.fixture
+def pool(database_url):
+    pool = ConnectionPool(database_url, minconn=2, maxconn=4, timeout=1.0)
+    yield pool
+    pool.close()
+
+
+def test_stats_count_idle_connections(pool):
+    assert pool.stats()['idle'] == 2
+
+    connections = [pool.getconn() for _ in range(3)]
+    assert pool.stats()['idle'] == 0
+    assert pool.stats()['in_use'] == 3
+
+    # psycopg2 keeps minconn idle connections and closes the rest
+    for connection in connections:
+        pool.putconn(connection)
+    assert pool.stats()['idle'] == 2
+    assert pool.stats()['in_use'] == 0
+
+
+def test_broken_connection_keeps_the_original_error(pool, connection):
+    with pytest.raises(ValueError, match="block failed"):
+        with pool.connection() as broken:
+            with broken.cursor() as cursor:
+                cursor.execute("SELECT pg_backend_pid()")
+                pid = cursor.fetchone()[0]
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+            raise ValueError("block failed")
+
+    assert broken.closed
+    stats = pool.stats()
+    assert stats['discarded'] == 1
+    assert stats['in_use'] == 0
+    assert stats['idle'] == 1
+
+    with pool.connection() as healthy, healthy.cursor() as cursor:
+        cursor.execute("SELECT 1")
+        assert cursor.fetchone() == (1,)
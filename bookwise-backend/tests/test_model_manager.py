@@ -0,0 +1,34 @@
+import pytest
+
+import recommender
+from model_manager import ModelManager
+from recommender import get_loaded_recommender, load_or_fit, set_recommender
+
+
+@pytest.fixture
+def model_dir(database_url, tmp_path, monkeypatch):
+    """An empty MODEL_DIR; the shared recommender is restored after the test."""
+    monkeypatch.setenv("MODEL_DIR", str(tmp_path))
+    monkeypatch.setattr(recommender, '_recommender', None)
+    return tmp_path
+
+
+def test_second_manager_loads_artifact_saved_by_first(model_dir):
+    # Two worker processes serve the same model; each has its own manager
+    first, second = ModelManager(reload_interval=0), ModelManager(reload_interval=0)
+    old = load_or_fit()
+    set_recommender(old)
+    assert not second.reload()
+
+    # The first worker serves an admin rebuild, which saves a new artifact
+    first._build(refit=True)
+    new_version = get_loaded_recommender().model_version
+    assert new_version != old.model_version
+    assert (model_dir / 'LATEST').read_text() == new_version
+
+    # The second worker still holds the old model until it reloads
+    set_recommender(old)
+    assert second.reload()
+    assert get_loaded_recommender().model_version == new_version
+    assert second.last_swap_at is not None
+    assert not second.reload()
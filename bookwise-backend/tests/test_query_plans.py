@@ -0,0 +1,143 @@
+import pytest
+
+from app import keyset_page_query, offset_page_query
+from search import search_query, set_fuzzy_threshold
+
+FIELDS = ['isbn13', 'title', 'authors', 'thumbnail']
+AFTER_ISBN13 = '9780000000000'
+
+# Both unique indexes on books.isbn13 serve isbn13 lookups and order
+ISBN13_INDEXES = {'books_pkey', 'unique_isbn13'}
+
+# Query name -> (query and parameters, index groups): every group must have
+# one of its indexes used somewhere in the plan
+PLANS = {
+    "page": (offset_page_query(FIELDS, '', 50, 100), [ISBN13_INDEXES]),
+    "category page": (offset_page_query(FIELDS, 'Fiction', 50, 100), [{'book_categories_pkey'}]),
+    "keyset": (keyset_page_query(FIELDS, 'isbn13', '', [AFTER_ISBN13], 50), [ISBN13_INDEXES]),
+    "keyset by rating": (
+        keyset_page_query(FIELDS, 'rating', '', [3.5, AFTER_ISBN13], 50), [{'books_rating_isbn13_idx'}],
+    ),
+    "category keyset": (
+        keyset_page_query(FIELDS, 'isbn13', 'Fiction', [AFTER_ISBN13], 50), [{'book_categories_pkey'}],
+    ),
+    "category keyset by rating": (
+        keyset_page_query(FIELDS, 'rating', 'Fiction', [3.5, AFTER_ISBN13], 50),
+        [{'book_categories_pkey', 'books_rating_isbn13_idx'}],
+    ),
+    "search": (search_query('tolkein'), [
+        {'books_title_search_vector_idx'}, {'books_search_vector_idx'},
+        {'books_title_trgm_idx'}, {'books_authors_trgm_idx'},
+    ]),
+    "category search page": (search_query('tolkien', 'Fiction', after=(0.5, AFTER_ISBN13)), [
+        {'books_title_search_vector_idx'}, {'books_search_vector_idx'},
+        {'books_title_trgm_idx'}, {'books_authors_trgm_idx'},
+        {'book_categories_pkey', 'book_categories_isbn13_idx'},
+    ]),
+}
+
+# Per-user queries of the likes/reviews routes -> (query, table, index it
+# must use for that table)
+USER_PLANS = {
+    "liked books": ("""
+        SELECT b.isbn13 FROM books b JOIN book_likes bl ON b.isbn13 = bl.isbn13
+        WHERE bl.user_id = %(user_id)s
+    """, 'book_likes', 'unique_user_book'),
+    "unlike": ("""
+        DELETE FROM book_likes WHERE user_id = %(user_id)s AND isbn13 = %(isbn13)s
+    """, 'book_likes', 'unique_user_book'),
+    "user reviews": ("""
+        SELECT b.isbn13, br.rating FROM book_reviews br JOIN books b ON b.isbn13 = br.isbn13
+        WHERE br.user_id = %(user_id)s
+    """, 'book_reviews', 'unique_user_book_review'),
+    "user review": ("""
+        SELECT b.isbn13, br.rating FROM book_reviews br JOIN books b ON b.isbn13 = br.isbn13
+        WHERE br.user_id = %(user_id)s AND br.isbn13 = %(isbn13)s
+    """, 'book_reviews', 'unique_user_book_review'),
+}
+
+
+def explain(connection, query, params):
+    """Return the JSON plan of a query, with sequential scans disabled."""
+    with connection.cursor() as cursor:
+        # Small tables are cheapest to scan sequentially; this checks that the
+        # indexes *can* serve each query, whatever the table size
+        cursor.execute("SET enable_seqscan = off")
+        set_fuzzy_threshold(cursor)
+        cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        return cursor.fetchone()[0][0]['Plan']
+
+
+def plan_nodes(plan):
+    """Yield (node type, index) for every node of a JSON plan."""
+    yield plan['Node Type'], plan.get('Index Name')
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def table_scans(plan, table):
+    """
+    Yield (node type, index) for every scan of table in a JSON plan; a bitmap
+    heap scan yields the indexes of its bitmap index scans.
+    """
+    if plan.get('Relation Name') == table and 'Scan' in plan['Node Type']:
+        if plan['Node Type'] == 'Bitmap Heap Scan':
+            for _, index in plan_nodes(plan):
+                if index is not None:
+                    yield plan['Node Type'], index
+        else:
+            yield plan['Node Type'], plan.get('Index Name')
+    for child in plan.get('Plans', []):
+        yield from table_scans(child, table)
+
+
+@pytest.mark.parametrize("name", PLANS)
+def test_query_uses_indexes(connection, name):
+    (query, params), index_groups = PLANS[name]
+    nodes = list(plan_nodes(explain(connection, query, params)))
+
+    assert ('Seq Scan', None) not in nodes
+    indexes = {index for node, index in nodes if node in ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')}
+    for group in index_groups:
+        assert indexes & group, f"{name} uses none of {sorted(group)}, only {sorted(indexes)}"
+
+
+@pytest.fixture
+def rated_books(connection):
+    """
+    Give book_likes and book_reviews 200 users with 20 books each, analyzed,
+    in the test's transaction, so plans are chosen for tables of a realistic
+    shape rather than a few rows. Yields a (user_id, isbn13) pair from them;
+    the rows are rolled back and the tables analyzed again afterwards.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO users (username, email, password)
+            SELECT 'plan-test-' || i, 'plan-test-' || i || '@test', 'x' FROM generate_series(1, 200) i
+            RETURNING user_id
+        """)
+        user_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT isbn13 FROM books ORDER BY isbn13 LIMIT 100")
+        isbn13s = [row[0] for row in cursor.fetchall()]
+        rows = [(user_id, isbn13s[(i * 7 + j) % len(isbn13s)])
+                for i, user_id in enumerate(user_ids) for j in range(20)]
+        cursor.executemany("INSERT INTO book_likes (user_id, isbn13) VALUES (%s, %s)", rows)
+        cursor.executemany("INSERT INTO book_reviews (user_id, isbn13, rating) VALUES (%s, %s, 4)", rows)
+        cursor.execute("ANALYZE book_likes, book_reviews")
+    yield rows[0]
+    connection.rollback()
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE book_likes, book_reviews")
+    connection.commit()
+
+
+@pytest.mark.parametrize("name", USER_PLANS)
+def test_user_query_uses_index(connection, rated_books, name):
+    query, table, index = USER_PLANS[name]
+    user_id, isbn13 = rated_books
+    plan = explain(connection, query, {'user_id': user_id, 'isbn13': isbn13})
+    scans = list(table_scans(plan, table))
+
+    assert scans, f"{name} does not read {table}"
+    assert all(node != 'Seq Scan' for node, _ in scans)
+    assert all(scan_index == index for _, scan_index in scans), f"{name} scans {table} with {scans}"
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import psycopg2
+
+from app import rate_books
+from conftest import fetch_one
+
+
+def rate(database_url, ratings):
+    connection = psycopg2.connect(database_url)
+    try:
+        with connection.cursor() as cursor:
+            rate_books(cursor, ratings)
+        connection.commit()
+    finally:
+        connection.close()
+
+
+def rate_concurrently(database_url, first, second, while_waiting=None):
+    """
+    Rate first in an open transaction, start rating second on another
+    connection while it is still open, then commit first and wait for second.
+    while_waiting, if given, is called while second waits.
+    """
+    connection = psycopg2.connect(database_url)
+    try:
+        with connection.cursor() as cursor:
+            rate_books(cursor, first)
+        other = threading.Thread(target=rate, args=(database_url, second))
+        other.start()
+        time.sleep(0.5)
+        assert other.is_alive(), "the second rating did not wait for the first"
+        if while_waiting:
+            while_waiting()
+        connection.commit()
+        other.join(timeout=10)
+        assert not other.is_alive()
+    finally:
+        connection.close()
+
+
+def aggregates(connection, isbn13):
+    return fetch_one(connection, "SELECT ratings_count, rating_sum, average_rating FROM books WHERE isbn13 = %s", (isbn13,))
+
+
+def test_concurrent_first_ratings_of_one_user_count_once(database_url, connection, make_book, make_user):
+    isbn13, user_id = make_book(ratings_count=0, rating_sum=0), make_user()
+
+    rate_concurrently(database_url, [(user_id, isbn13, 5)], [(user_id, isbn13, 3)])
+
+    assert aggregates(connection, isbn13) == (1, 3.0, 3.0)
+    assert fetch_one(connection, "SELECT rating FROM book_reviews WHERE user_id = %s AND isbn13 = %s",
+                     (user_id, isbn13)) == (3,)
+
+
+def test_concurrent_changes_of_one_rating_use_the_latest_old_rating(database_url, connection, make_book, make_user):
+    isbn13, user_id = make_book(ratings_count=0, rating_sum=0), make_user()
+    rate(database_url, [(user_id, isbn13, 2)])
+
+    rate_concurrently(database_url, [(user_id, isbn13, 5)], [(user_id, isbn13, 4)])
+
+    assert aggregates(connection, isbn13) == (1, 4.0, 4.0)
+
+
+def test_concurrent_ratings_of_different_users_all_count(database_url, connection, make_book, make_user):
+    isbn13, first_user, second_user = make_book(ratings_count=10, rating_sum=30), make_user(), make_user()
+
+    rate_concurrently(database_url, [(first_user, isbn13, 5)], [(second_user, isbn13, 1)])
+
+    assert aggregates(connection, isbn13) == (12, 36.0, 3.0)
+
+
+def test_batch_ratings_of_many_books(database_url, connection, make_book, make_user):
+    books, user_id = [make_book(ratings_count=1, rating_sum=4) for _ in range(3)], make_user()
+
+    rate(database_url, [(user_id, isbn13, rating) for isbn13, rating in zip(books, (1, 2, 3))])
+    rate(database_url, [(user_id, books[0], 5)])
+
+    assert [aggregates(connection, isbn13) for isbn13 in books] == [(2, 9.0, 4.5), (2, 6.0, 3.0), (2, 7.0, 3.5)]
+
+
+def test_concurrent_batches_sharing_users_lock_users_before_books(database_url, connection, make_book, make_user):
+    first_book, second_book = make_book(ratings_count=0, rating_sum=0), make_book(ratings_count=0, rating_sum=0)
+    first_user, second_user = make_user(), make_user()
+
+    def second_book_is_not_locked():
+        # The second batch waits for the users the first holds before it locks
+        # any book, so batches sharing users cannot deadlock on users
+        probe = psycopg2.connect(database_url)
+        try:
+            with probe.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM books WHERE isbn13 = %s FOR UPDATE NOWAIT", (second_book,))
+        finally:
+            probe.close()
+
+    rate_concurrently(
+        database_url,
+        [(first_user, first_book, 5), (second_user, first_book, 4)],
+        [(second_user, second_book, 2), (first_user, second_book, 3)],
+        while_waiting=second_book_is_not_locked,
+    )
+
+    assert aggregates(connection, first_book) == (2, 9.0, 4.5)
+    assert aggregates(connection, second_book) == (2, 5.0, 2.5)
+
+
+def test_concurrent_batches_sharing_users_all_complete(database_url, connection, make_book, make_user):
+    books, users = [make_book(ratings_count=0, rating_sum=0) for _ in range(8)], [make_user() for _ in range(4)]
+    errors = []
+
+    def rate_book(position, isbn13):
+        # Every batch rates its own book by all users, listed in a different order
+        order = users[position % len(users):] + users[:position % len(users)]
+        try:
+            rate(database_url, [(user_id, isbn13, 1 + (user_id + position) % 5) for user_id in order])
+        except psycopg2.Error as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=rate_book, args=item) for item in enumerate(books)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=30)
+
+    assert errors == []
+    assert [aggregates(connection, isbn13)[0] for isbn13 in books] == [len(users)] * len(books)
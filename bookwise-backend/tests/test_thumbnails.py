@@ -0,0 +1,127 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from conftest import fetch_one
+from thumbnails import ThumbnailResolver
+
+# Seconds the resolver waits for the stand-in cover server, and how long a slow answer takes
+TIMEOUT = 0.3
+SLOW_ANSWER = 2.0
+
+
+class CoverHandler(BaseHTTPRequestHandler):
+    """Open Library stand-in: answers HEAD /b/isbn/<isbn13>-L.jpg with the status set for that ISBN13."""
+
+    def do_HEAD(self):
+        self.server.requests.append(self.path)
+        path = self.path.split('?')[0]
+        isbn13 = path.rsplit('/', 1)[-1].removesuffix('-L.jpg')
+        status = self.server.covers.get(isbn13, 404)
+        if status == 'timeout':
+            time.sleep(SLOW_ANSWER)
+            status = 200
+        try:
+            self.send_response(status)
+            self.end_headers()
+        except OSError:
+            pass  # The resolver gave up on a slow answer
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def cover_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), CoverHandler)
+    server.daemon_threads = True
+    server.covers = {}    # isbn13 -> HTTP status, or 'timeout'
+    server.requests = []  # paths asked for, with their query string
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def resolver(cover_server, database_url):
+    return ThumbnailResolver(base_url=f"http://127.0.0.1:{cover_server.server_port}", timeout=TIMEOUT, workers=1)
+
+
+def lookup(connection, isbn13):
+    return fetch_one(connection, "SELECT thumbnail FROM book_thumbnail_lookups WHERE isbn13 = %s", (isbn13,))
+
+
+def book_thumbnail(connection, isbn13):
+    return fetch_one(connection, "SELECT thumbnail FROM books WHERE isbn13 = %s", (isbn13,))[0]
+
+
+def test_known_thumbnail_is_returned_without_lookup(resolver, cover_server):
+    assert resolver.resolve('9780002005883', 'http://example.com/cover.jpg') == 'http://example.com/cover.jpg'
+    resolver.wait()
+    assert cover_server.requests == []
+
+
+def test_found_cover_is_written_back(resolver, cover_server, connection, make_book):
+    isbn13 = make_book()
+    cover_server.covers[isbn13] = 200
+
+    assert resolver.resolve(isbn13) is None  # Not known yet: queued, not waited for
+    resolver.wait()
+
+    url = resolver.cover_url(isbn13)
+    assert cover_server.requests == [f"/b/isbn/{isbn13}-L.jpg?default=false"]
+    assert resolver.resolve(isbn13) == url
+    assert lookup(connection, isbn13) == (url,)
+    assert book_thumbnail(connection, isbn13) == url
+    assert resolver.stats()['found'] == 1
+
+
+def test_missing_cover_is_remembered(resolver, cover_server, connection, make_book):
+    isbn13 = make_book()
+    cover_server.covers[isbn13] = 404
+
+    assert resolver.resolve(isbn13) is None
+    resolver.wait()
+
+    assert lookup(connection, isbn13) == (None,)
+    assert book_thumbnail(connection, isbn13) is None
+    assert resolver.stats()['not_found'] == 1
+
+    # Neither this process nor another one reading the stored lookup asks again
+    assert resolver.resolve(isbn13) is None
+    other = ThumbnailResolver(base_url=resolver.base_url, timeout=TIMEOUT, workers=1)
+    assert other.resolve(isbn13, lookup_age=0.0) is None
+    resolver.wait()
+    other.wait()
+    assert len(cover_server.requests) == 1
+
+
+def test_expired_missing_cover_is_looked_up_again(resolver, cover_server, make_book):
+    isbn13 = make_book()
+    resolver.negative_ttl = 60
+    assert resolver.resolve(isbn13, lookup_age=61.0) is None
+    resolver.wait()
+    assert len(cover_server.requests) == 1
+
+
+def test_timeout_is_retried(resolver, cover_server, connection, make_book):
+    isbn13 = make_book()
+    cover_server.covers[isbn13] = 'timeout'
+
+    started = time.monotonic()
+    assert resolver.resolve(isbn13) is None  # Requests never wait for the cover server
+    assert time.monotonic() - started < TIMEOUT
+    resolver.wait()
+
+    assert resolver.stats()['errors'] == 1
+    assert lookup(connection, isbn13) is None  # Nothing recorded, so a later request retries
+    assert book_thumbnail(connection, isbn13) is None
+
+    cover_server.covers[isbn13] = 200
+    assert resolver.resolve(isbn13) is None
+    resolver.wait()
+    assert resolver.resolve(isbn13) == resolver.cover_url(isbn13)
+    assert len(cover_server.requests) == 2
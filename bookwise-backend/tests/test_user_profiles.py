@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import create_engine
+
+from user_profiles import UserProfileStore
+
+
+@pytest.fixture
+def engine(database_url):
+    engine = create_engine(database_url)
+    yield engine
+    engine.dispose()
+
+
+def like(connection, user_id, isbn13):
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO book_likes (user_id, isbn13) VALUES (%s, %s)", (user_id, isbn13))
+    connection.commit()
+
+
+def test_refresh_reads_only_changed_users(connection, engine, make_book, make_user):
+    first, second = make_book(), make_book()
+    unchanged, changed = make_user(), make_user()
+    like(connection, unchanged, first)
+    store = UserProfileStore({first: 0, second: 1})
+    store.load(engine)
+    assert list(store.get_signals(unchanged)[0]) == [0]
+
+    # Another process likes a book
+    like(connection, changed, second)
+    read_at = store._versions_read_at
+    assert store.refresh() == {changed}
+    assert list(store.get_signals(changed)[0]) == [1]
+    assert store.refresh() == set()
+
+    # The poll reads the users changed since shortly before the last one, not every user
+    versions, _ = store._read_versions(engine, read_at)
+    assert changed in versions and unchanged not in versions
@@ -0,0 +1,166 @@
+import os
+import queue
+import threading
+import time
+
+import psycopg2
+import requests
+from requests.adapters import HTTPAdapter
+
+from db import db_connection
+
+# Open Library covers; point this at a local server for testing
+COVERS_BASE_URL = os.getenv("COVERS_BASE_URL", "https://covers.openlibrary.org")
+
+# Seconds to wait for the cover server to connect and to answer
+COVERS_TIMEOUT = float(os.getenv("COVERS_TIMEOUT", 3))
+
+# How long (seconds) a "no cover" result is trusted before the ISBN is looked up again
+NEGATIVE_TTL = float(os.getenv("THUMBNAIL_NEGATIVE_TTL", 7 * 24 * 3600))
+
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", 2))
+
+# Select expression for resolve()'s lookup_age, with book_thumbnail_lookups joined as tl
+LOOKUP_AGE_SQL = "EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - tl.checked_at)::float"
+
+
+class ThumbnailResolver:
+    """
+    Resolves missing book covers without blocking requests.
+
+    resolve() answers from what is already known (books.thumbnail, the
+    book_thumbnail_lookups table and an in-memory cache) and queues unknown
+    ISBNs for background workers. A worker asks the cover server once, with a
+    timeout, and records the outcome: found covers are written back to
+    books.thumbnail, missing ones are remembered for NEGATIVE_TTL seconds.
+    """
+
+    def __init__(self, base_url=COVERS_BASE_URL, timeout=COVERS_TIMEOUT,
+                 negative_ttl=NEGATIVE_TTL, workers=THUMBNAIL_WORKERS, max_queue=10000):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.negative_ttl = negative_ttl
+        self.workers = workers
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_maxsize=workers))
+        self.session.mount('https://', HTTPAdapter(pool_maxsize=workers))
+        self._known = {}  # isbn13 -> (thumbnail URL or None, time.time() it was checked)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._threads_pid = None
+        self.found = 0
+        self.not_found = 0
+        self.errors = 0
+        self.dropped = 0
+
+    def cover_url(self, isbn13):
+        return f"{self.base_url}/b/isbn/{isbn13}-L.jpg"
+
+    def resolve(self, isbn13, thumbnail=None, lookup_age=None):
+        """
+        Return the thumbnail URL to show right now, or None if it is not known
+        yet. thumbnail is the books.thumbnail value and lookup_age the age in
+        seconds of a stored lookup (see LOOKUP_AGE_SQL), both read by the
+        caller together with the book.
+        """
+        if thumbnail:
+            return thumbnail
+        known = self._known.get(isbn13)
+        if known is not None:
+            url, checked = known
+            if url or time.time() - checked < self.negative_ttl:
+                return url
+        elif lookup_age is not None and lookup_age < self.negative_ttl:
+            return None
+        self.enqueue(isbn13)
+        return None
+
+    def enqueue(self, isbn13):
+        """Queue a background lookup; duplicates and overflow are dropped."""
+        with self._lock:
+            if isbn13 in self._pending:
+                return
+            try:
+                self._queue.put_nowait(isbn13)
+            except queue.Full:
+                self.dropped += 1
+                return
+            self._pending.add(isbn13)
+        self._start_workers()
+
+    def _start_workers(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        if self._threads_pid == os.getpid():
+            return
+        with self._lock:
+            if self._threads_pid == os.getpid():
+                return
+            for _ in range(self.workers):
+                threading.Thread(target=self._work, name="thumbnail-resolver", daemon=True).start()
+            self._threads_pid = os.getpid()
+
+    def _work(self):
+        while True:
+            isbn13 = self._queue.get()
+            try:
+                url = self.lookup(isbn13)
+                self.record(isbn13, url)
+            except (requests.RequestException, psycopg2.Error) as e:
+                # Transient failure: leave it unrecorded so a later request retries
+                self.errors += 1
+                print(f"Thumbnail lookup failed for {isbn13}: {e}")
+            finally:
+                with self._lock:
+                    self._pending.discard(isbn13)
+                self._queue.task_done()
+
+    def lookup(self, isbn13):
+        """
+        Ask the cover server whether a cover exists. default=false makes it
+        answer 404 instead of serving a blank placeholder image.
+        """
+        url = self.cover_url(isbn13)
+        response = self.session.head(url, params={'default': 'false'},
+                                     timeout=self.timeout, allow_redirects=True)
+        if response.status_code == 200:
+            return url
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        raise requests.RequestException(f"Unexpected status {response.status_code}")
+
+    def record(self, isbn13, url):
+        """Store a lookup result in memory and in the database."""
+        self._known[isbn13] = (url, time.time())
+        if url:
+            self.found += 1
+        else:
+            self.not_found += 1
+        with db_connection() as connection, connection.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO book_thumbnail_lookups (isbn13, thumbnail, checked_at)
+                SELECT isbn13, %s, CURRENT_TIMESTAMP FROM books WHERE isbn13 = %s
+                ON CONFLICT (isbn13) DO UPDATE
+                SET thumbnail = EXCLUDED.thumbnail, checked_at = EXCLUDED.checked_at
+            """, (url, isbn13))
+            if url:
+                cursor.execute("""
+                    UPDATE books SET thumbnail = %s
+                    WHERE isbn13 = %s AND (thumbnail IS NULL OR thumbnail = '')
+                """, (url, isbn13))
+            connection.commit()
+
+    def wait(self):
+        """Block until every queued lookup has finished."""
+        self._queue.join()
+
+    def stats(self):
+        return {
+            "known": len(self._known),
+            "queued": self._queue.qsize(),
+            "found": self.found,
+            "not_found": self.not_found,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,206 @@
+import os
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# Implicit rating given to a liked book the user has not rated explicitly
+LIKE_RATING = 4
+
+# How often (seconds) to poll users.state_version for writes made by other processes
+REFRESH_INTERVAL = float(os.getenv("PROFILE_REFRESH_SECONDS", 30))
+
+# A poll reads the users whose state_updated_at (migration 009) is later than
+# this many seconds before the previous poll, so writes whose transaction
+# committed up to this long after their trigger ran are still picked up
+COMMIT_LAG = timedelta(seconds=60)
+
+
+class UserProfileStore:
+    """
+    Ratings and likes of every user, held as small numpy arrays of book row
+    indices (rows of the recommender's feature matrix).
+
+    The store is bulk-loaded once from book_reviews and book_likes. After that,
+    the write endpoints apply their changes directly, and writes made by other
+    processes are picked up by polling users.state_version (migration 006),
+    which every statement writing a user's reviews or likes bumps in the same
+    transaction: the profiles of users whose version changed are reloaded
+    whole, so deletes and late commits are picked up too. A poll only reads
+    the users whose state_updated_at (migration 009) is recent, through its
+    index. Deleted users are not seen by a poll; their profiles go at the
+    next load. Arrays are replaced rather than modified in place, so readers
+    never need the lock.
+    """
+
+    def __init__(self, isbn_to_row):
+        self.isbn_to_row = isbn_to_row
+        self._ratings = {}  # user_id -> (int32 row indices, int8 ratings)
+        self._likes = {}    # user_id -> sorted int32 row indices
+        self._versions = {}  # user_id -> users.state_version the profile was read at
+        self._versions_read_at = None  # Database time of the last read of versions
+        self._lock = threading.Lock()
+        self.engine = None
+        self.last_refresh = 0.0
+
+    def _rows(self, isbn13_series):
+        return isbn13_series.map(self.isbn_to_row)
+
+    def _read_versions(self, engine, since=None):
+        """
+        Return the state_version of every user, or of the users whose state
+        changed after since, and the database time they were read at.
+        """
+        where = "" if since is None else "WHERE state_updated_at > :since"
+        with engine.connect() as connection:
+            read_at = connection.execute(text("SELECT now()")).scalar()
+            rows = connection.execute(text(f"SELECT user_id, state_version FROM users {where}"), {'since': since})
+            return {int(user_id): int(version) for user_id, version in rows}, read_at
+
+    def _read_profiles(self, engine, user_ids=None):
+        """Read the ratings and likes of some users (all if user_ids is None) into arrays."""
+        where, params = ("", {}) if user_ids is None else ("AND user_id = ANY(:user_ids)", {'user_ids': list(user_ids)})
+        reviews = pd.read_sql(
+            text(f"SELECT user_id, isbn13, rating FROM book_reviews WHERE rating IS NOT NULL {where}"),
+            engine, params=params,
+        )
+        likes = pd.read_sql(
+            text(f"SELECT user_id, isbn13 FROM book_likes WHERE true {where}"),
+            engine, params=params,
+        )
+
+        ratings = {}
+        reviews['row'] = self._rows(reviews['isbn13'])
+        reviews = reviews.dropna(subset=['row', 'user_id']).sort_values(['user_id', 'row'])
+        for user_id, group in reviews.groupby('user_id', sort=False):
+            ratings[int(user_id)] = (
+                group['row'].to_numpy(dtype=np.int32),
+                group['rating'].to_numpy(dtype=np.int8),
+            )
+
+        liked = {}
+        likes['row'] = self._rows(likes['isbn13'])
+        likes = likes.dropna(subset=['row', 'user_id']).sort_values(['user_id', 'row'])
+        for user_id, group in likes.groupby('user_id', sort=False):
+            liked[int(user_id)] = group['row'].to_numpy(dtype=np.int32)
+        return ratings, liked
+
+    def load(self, engine):
+        """Bulk-load all ratings and likes from PostgreSQL."""
+        # Versions first: the profiles read after them are at least as new
+        versions, read_at = self._read_versions(engine)
+        ratings, liked = self._read_profiles(engine)
+
+        with self._lock:
+            self._ratings = ratings
+            self._likes = liked
+            self._versions = versions
+            self._versions_read_at = read_at
+            self.engine = engine
+            self.last_refresh = time.monotonic()
+
+    def refresh(self):
+        """
+        Reload the profiles of users whose state_version changed since the
+        last load or refresh and return their ids.
+        """
+        if self.engine is None:
+            return set()
+        self.last_refresh = time.monotonic()
+
+        versions, read_at = self._read_versions(self.engine, self._versions_read_at - COMMIT_LAG)
+        changed = {user_id for user_id, version in versions.items() if self._versions.get(user_id) != version}
+        ratings, liked = self._read_profiles(self.engine, changed) if changed else ({}, {})
+
+        with self._lock:
+            for user_id in changed:
+                self._set_profile(user_id, ratings.get(user_id), liked.get(user_id))
+                self._versions[user_id] = versions[user_id]
+            self._versions_read_at = read_at
+        return changed
+
+    def _set_profile(self, user_id, ratings, liked):
+        # Called with the lock held
+        if ratings is None:
+            self._ratings.pop(user_id, None)
+        else:
+            self._ratings[user_id] = ratings
+        if liked is None:
+            self._likes.pop(user_id, None)
+        else:
+            self._likes[user_id] = liked
+
+    def maybe_refresh(self):
+        """
+        Refresh if the polling interval has elapsed and return the users whose
+        signals changed; failures only log.
+        """
+        if self.engine is None or time.monotonic() - self.last_refresh < REFRESH_INTERVAL:
+            return set()
+        try:
+            return self.refresh()
+        except Exception as e:
+            print("Could not refresh user profiles:", e)
+            return set()
+
+    def set_rating(self, user_id, isbn13, rating):
+        """Add or update a user's rating. Unknown ISBNs are ignored."""
+        row = self.isbn_to_row.get(isbn13)
+        if row is None:
+            return False
+        user_id = int(user_id)
+        with self._lock:
+            rows, ratings = self._ratings.get(user_id, (np.empty(0, np.int32), np.empty(0, np.int8)))
+            position = np.searchsorted(rows, row)
+            if position < len(rows) and rows[position] == row:
+                ratings = ratings.copy()
+                ratings[position] = rating
+            else:
+                rows = np.insert(rows, position, row)
+                ratings = np.insert(ratings, position, rating)
+            self._ratings[user_id] = (rows, ratings)
+        return True
+
+    def add_like(self, user_id, isbn13):
+        row = self.isbn_to_row.get(isbn13)
+        if row is None:
+            return False
+        user_id = int(user_id)
+        with self._lock:
+            rows = self._likes.get(user_id, np.empty(0, np.int32))
+            position = np.searchsorted(rows, row)
+            if position == len(rows) or rows[position] != row:
+                self._likes[user_id] = np.insert(rows, position, row)
+        return True
+
+    def remove_like(self, user_id, isbn13):
+        row = self.isbn_to_row.get(isbn13)
+        user_id = int(user_id)
+        with self._lock:
+            if row is not None and user_id in self._likes:
+                self._likes[user_id] = self._likes[user_id][self._likes[user_id] != row]
+
+    def remove_user(self, user_id):
+        user_id = int(user_id)
+        with self._lock:
+            self._ratings.pop(user_id, None)
+            self._likes.pop(user_id, None)
+
+    def get_signals(self, user_id):
+        """
+        Return (rows, ratings) for everything the user rated or liked. Liked
+        books without an explicit rating count as LIKE_RATING.
+        """
+        empty_rows = np.empty(0, np.int32)
+        rows, ratings = self._ratings.get(user_id, (empty_rows, np.empty(0, np.int8)))
+        liked = self._likes.get(user_id, empty_rows)
+        liked_only = np.setdiff1d(liked, rows, assume_unique=True)
+        if len(liked_only) == 0:
+            return rows, ratings
+        return (
+            np.concatenate((rows, liked_only)),
+            np.concatenate((ratings, np.full(len(liked_only), LIKE_RATING, dtype=np.int8))),
+        )
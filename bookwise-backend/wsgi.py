@@ -0,0 +1,31 @@
+"""
+WSGI entry point for production serving:
+
+    gunicorn wsgi:app
+
+gunicorn.conf.py preloads this module in the master, so the recommender is
+loaded (or fitted) once there and shared copy-on-write by the forked workers.
+"""
+import gc
+
+from app import app
+from db import close_pool
+from recommender import get_engine, get_recommender
+
+
+def preload():
+    """
+    Load the recommender in the master and leave it ready to fork: database
+    connections are closed so that no worker inherits their sockets, and the
+    loaded objects are frozen out of the garbage collector, whose bookkeeping
+    writes would otherwise copy their pages into every worker.
+    """
+    get_recommender()
+    close_pool()
+    get_engine().dispose()
+    gc.unfreeze()
+    gc.collect()
+    gc.freeze()
+
+
+preload()
@@ -0,0 +1,14 @@
+--
+-- Persistent cache of cover lookups made by the backend's thumbnail resolver.
+-- Covers that were found are also written back to books.thumbnail; rows with
+-- a NULL thumbnail record that no cover exists, so it is not looked up again
+-- until the negative result expires.
+--
+
+CREATE TABLE IF NOT EXISTS public.book_thumbnail_lookups (
+    isbn13 character varying(13) PRIMARY KEY REFERENCES public.books(isbn13) ON DELETE CASCADE,
+    thumbnail text,
+    checked_at timestamp without time zone NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+ALTER TABLE public.book_thumbnail_lookups OWNER TO postgres;
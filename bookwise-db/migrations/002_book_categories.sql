@@ -0,0 +1,88 @@
+--
+-- One row per (book, category), split from the comma-separated
+-- books.categories column, and the number of books in each category.
+-- Both are kept in sync by triggers, so category filters are index lookups
+-- and category listings never rescan books.
+--
+
+CREATE TABLE IF NOT EXISTS public.book_categories (
+    isbn13 character varying(13) NOT NULL REFERENCES public.books(isbn13) ON UPDATE CASCADE ON DELETE CASCADE,
+    category text NOT NULL,
+    PRIMARY KEY (category, isbn13)
+);
+
+CREATE INDEX IF NOT EXISTS book_categories_isbn13_idx ON public.book_categories (isbn13);
+
+CREATE TABLE IF NOT EXISTS public.category_counts (
+    category text PRIMARY KEY,
+    book_count integer NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS category_counts_book_count_idx ON public.category_counts (book_count DESC, category);
+
+ALTER TABLE public.book_categories OWNER TO postgres;
+ALTER TABLE public.category_counts OWNER TO postgres;
+
+
+-- Categories of a books.categories value: split on commas, trimmed, without blanks or duplicates
+CREATE OR REPLACE FUNCTION public.split_categories(categories text) RETURNS SETOF text
+    LANGUAGE sql IMMUTABLE AS $$
+    SELECT DISTINCT btrim(category)
+    FROM regexp_split_to_table(categories, ',') AS category
+    WHERE btrim(category) <> ''
+$$;
+
+-- books -> book_categories (deletes are handled by ON DELETE CASCADE)
+CREATE OR REPLACE FUNCTION public.sync_book_categories() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.categories IS NOT DISTINCT FROM OLD.categories THEN
+            RETURN NULL;
+        END IF;
+        DELETE FROM public.book_categories WHERE isbn13 = NEW.isbn13;
+    END IF;
+    INSERT INTO public.book_categories (isbn13, category)
+    SELECT NEW.isbn13, category FROM public.split_categories(NEW.categories) AS category;
+    RETURN NULL;
+END;
+$$;
+
+-- book_categories -> category_counts
+CREATE OR REPLACE FUNCTION public.sync_category_counts() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO public.category_counts (category, book_count) VALUES (NEW.category, 1)
+        ON CONFLICT (category) DO UPDATE SET book_count = category_counts.book_count + 1;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE public.category_counts SET book_count = book_count - 1 WHERE category = OLD.category;
+        DELETE FROM public.category_counts WHERE category = OLD.category AND book_count <= 0;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS books_sync_categories ON public.books;
+CREATE TRIGGER books_sync_categories
+    AFTER INSERT OR UPDATE OF categories ON public.books
+    FOR EACH ROW EXECUTE FUNCTION public.sync_book_categories();
+
+DROP TRIGGER IF EXISTS book_categories_sync_counts ON public.book_categories;
+CREATE TRIGGER book_categories_sync_counts
+    AFTER INSERT OR DELETE ON public.book_categories
+    FOR EACH ROW EXECUTE FUNCTION public.sync_category_counts();
+
+
+-- Backfill existing books
+INSERT INTO public.book_categories (isbn13, category)
+SELECT b.isbn13, category
+FROM public.books b, public.split_categories(b.categories) AS category
+ON CONFLICT DO NOTHING;
+
+INSERT INTO public.category_counts (category, book_count)
+SELECT category, COUNT(*) FROM public.book_categories GROUP BY category
+ON CONFLICT (category) DO UPDATE SET book_count = EXCLUDED.book_count;
+
+ANALYZE public.book_categories;
+ANALYZE public.category_counts;
@@ -0,0 +1,9 @@
+--
+-- Index for keyset pagination of /books?sort=rating, which orders on
+-- (COALESCE(average_rating, 0), isbn13). Sorting by isbn13 uses the
+-- primary key.
+--
+
+CREATE INDEX IF NOT EXISTS books_rating_isbn13_idx ON public.books ((COALESCE(average_rating, 0)), isbn13);
+
+ANALYZE public.books;
@@ -0,0 +1,38 @@
+--
+-- book_likes.user_id and book_reviews.user_id become integer foreign keys to
+-- users, so lookups by user compare integers and use the (user_id, isbn13)
+-- unique indexes instead of casting every row. Rows that do not belong to
+-- an existing user are dropped, and deleting a user now cascades to their
+-- likes and reviews.
+--
+
+BEGIN;
+
+DELETE FROM public.book_likes bl
+WHERE bl.user_id::text !~ '^[0-9]+$'
+   OR NOT EXISTS (SELECT 1 FROM public.users u WHERE u.user_id::text = bl.user_id::text);
+
+DELETE FROM public.book_reviews br
+WHERE br.user_id::text !~ '^[0-9]+$'
+   OR NOT EXISTS (SELECT 1 FROM public.users u WHERE u.user_id::text = br.user_id::text);
+
+-- The unique (user_id, isbn13) constraints are rebuilt on the new type
+ALTER TABLE public.book_likes ALTER COLUMN user_id TYPE integer USING user_id::integer;
+ALTER TABLE public.book_reviews ALTER COLUMN user_id TYPE integer USING user_id::integer;
+
+ALTER TABLE public.book_likes DROP CONSTRAINT IF EXISTS book_likes_user_id_fkey;
+ALTER TABLE public.book_reviews DROP CONSTRAINT IF EXISTS book_reviews_user_id_fkey;
+
+ALTER TABLE public.book_likes
+    ADD CONSTRAINT book_likes_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(user_id) ON DELETE CASCADE;
+ALTER TABLE public.book_reviews
+    ADD CONSTRAINT book_reviews_user_id_fkey FOREIGN KEY (user_id) REFERENCES public.users(user_id) ON DELETE CASCADE;
+
+-- Per-book lookups (likes and reviews of a book, cascades from books)
+CREATE INDEX IF NOT EXISTS book_likes_isbn13_idx ON public.book_likes (isbn13);
+CREATE INDEX IF NOT EXISTS book_reviews_isbn13_idx ON public.book_reviews (isbn13);
+
+COMMIT;
+
+ANALYZE public.book_likes;
+ANALYZE public.book_reviews;
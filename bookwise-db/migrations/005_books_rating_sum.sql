@@ -0,0 +1,11 @@
+--
+-- Running sum of ratings next to ratings_count, so a rating write can keep
+-- average_rating = rating_sum / ratings_count current without rescanning
+-- book_reviews. Existing books start from their imported average.
+--
+
+ALTER TABLE public.books ADD COLUMN IF NOT EXISTS rating_sum double precision;
+
+UPDATE public.books
+SET rating_sum = COALESCE(average_rating, 0) * COALESCE(ratings_count, 0)
+WHERE rating_sum IS NULL;
@@ -0,0 +1,50 @@
+--
+-- Version stamp of each user's likes and ratings. Every statement that
+-- inserts, updates or deletes a user's book_likes or book_reviews rows
+-- (including cascades from deleted books) bumps users.state_version, so
+-- a client holding the user's liked and rated ISBN13s can ask whether
+-- they changed with a primary key lookup instead of downloading them.
+--
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS state_version bigint NOT NULL DEFAULT 0;
+
+-- book_likes / book_reviews -> users.state_version, once per affected user and statement
+CREATE OR REPLACE FUNCTION public.bump_user_state_version() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE public.users SET state_version = state_version + 1
+        WHERE user_id IN (SELECT user_id FROM old_rows);
+    ELSE
+        UPDATE public.users SET state_version = state_version + 1
+        WHERE user_id IN (SELECT user_id FROM new_rows);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+-- A trigger with transition tables handles a single event, hence one per event
+DROP TRIGGER IF EXISTS book_likes_insert_state_version ON public.book_likes;
+CREATE TRIGGER book_likes_insert_state_version
+    AFTER INSERT ON public.book_likes REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.bump_user_state_version();
+
+DROP TRIGGER IF EXISTS book_likes_delete_state_version ON public.book_likes;
+CREATE TRIGGER book_likes_delete_state_version
+    AFTER DELETE ON public.book_likes REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.bump_user_state_version();
+
+DROP TRIGGER IF EXISTS book_reviews_insert_state_version ON public.book_reviews;
+CREATE TRIGGER book_reviews_insert_state_version
+    AFTER INSERT ON public.book_reviews REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.bump_user_state_version();
+
+DROP TRIGGER IF EXISTS book_reviews_update_state_version ON public.book_reviews;
+CREATE TRIGGER book_reviews_update_state_version
+    AFTER UPDATE ON public.book_reviews REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.bump_user_state_version();
+
+DROP TRIGGER IF EXISTS book_reviews_delete_state_version ON public.book_reviews;
+CREATE TRIGGER book_reviews_delete_state_version
+    AFTER DELETE ON public.book_reviews REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION public.bump_user_state_version();
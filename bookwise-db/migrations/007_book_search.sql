@@ -0,0 +1,52 @@
+--
+-- Book search. books.search_vector holds the weighted full-text document of
+-- each book (title and authors A, subtitle B, description D), kept in sync
+-- by a trigger and indexed with GIN, so /search never parses descriptions at
+-- query time; a second GIN index covers the title part alone. Trigram
+-- indexes on title and authors serve typo-tolerant matches (pg_trgm's word
+-- similarity) and make authors ILIKE '%name%' an index lookup instead of a
+-- sequential scan.
+--
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Full-text document of a book; the text search configuration is fixed so the
+-- function is immutable and the query side (search.py) must use the same one
+CREATE OR REPLACE FUNCTION public.book_search_vector(title text, subtitle text, authors text, description text)
+    RETURNS tsvector
+    LANGUAGE sql IMMUTABLE AS $$
+    SELECT setweight(to_tsvector('english'::regconfig, coalesce(title, '')), 'A')
+        || setweight(to_tsvector('english'::regconfig, replace(coalesce(authors, ''), ';', ' ')), 'A')
+        || setweight(to_tsvector('english'::regconfig, coalesce(subtitle, '')), 'B')
+        || setweight(to_tsvector('english'::regconfig, coalesce(description, '')), 'D')
+$$;
+
+ALTER TABLE public.books ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+-- books -> books.search_vector
+CREATE OR REPLACE FUNCTION public.sync_book_search_vector() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.search_vector := public.book_search_vector(NEW.title, NEW.subtitle, NEW.authors, NEW.description);
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS books_sync_search_vector ON public.books;
+CREATE TRIGGER books_sync_search_vector
+    BEFORE INSERT OR UPDATE OF title, subtitle, authors, description ON public.books
+    FOR EACH ROW EXECUTE FUNCTION public.sync_book_search_vector();
+
+-- Backfill existing books
+UPDATE public.books
+SET search_vector = public.book_search_vector(title, subtitle, authors, description)
+WHERE search_vector IS NULL;
+
+CREATE INDEX IF NOT EXISTS books_search_vector_idx ON public.books USING gin (search_vector);
+-- Title, subtitle and authors only, so title matches can be collected first
+CREATE INDEX IF NOT EXISTS books_title_search_vector_idx
+    ON public.books USING gin (public.book_search_vector(title, subtitle, authors, NULL));
+CREATE INDEX IF NOT EXISTS books_title_trgm_idx ON public.books USING gin (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS books_authors_trgm_idx ON public.books USING gin (authors gin_trgm_ops);
+
+ANALYZE public.books;
@@ -0,0 +1,40 @@
+--
+-- Version stamp of the book catalog. Every statement that inserts, deletes
+-- or truncates books, or updates their catalog columns (including covers
+-- found by the thumbnail resolver and, through the category triggers, the
+-- category counts) bumps catalog_version.version and sets updated_at. The
+-- backend derives the ETag and Last-Modified of its catalog responses from
+-- this row and caches those responses under the version, so a repeat request
+-- costs a primary key lookup instead of the query and its serialization.
+--
+-- Updates of the rating aggregates (average_rating, ratings_count,
+-- rating_sum) leave the version alone: every rating writes them, and bumping
+-- the single row each time would serialize rating writers on its lock and
+-- empty the response cache. The backend picks them up within
+-- CATALOG_RATINGS_LAG seconds instead.
+--
+
+CREATE TABLE IF NOT EXISTS public.catalog_version (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),  -- Single row
+    version bigint NOT NULL DEFAULT 0,
+    updated_at timestamptz NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO public.catalog_version DEFAULT VALUES ON CONFLICT DO NOTHING;
+
+-- books -> catalog_version, once per statement that changes catalog columns
+CREATE OR REPLACE FUNCTION public.bump_catalog_version() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE public.catalog_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS books_catalog_version ON public.books;
+CREATE TRIGGER books_catalog_version
+    AFTER INSERT OR DELETE OR TRUNCATE
+       OR UPDATE OF isbn13, isbn10, title, subtitle, authors, categories, thumbnail, description,
+                    published_year, num_pages
+    ON public.books
+    FOR EACH STATEMENT EXECUTE FUNCTION public.bump_catalog_version();
@@ -0,0 +1,25 @@
+--
+-- Time of the last change to each user's likes and ratings, set with
+-- users.state_version (migration 006). Backend processes poll it to pick up
+-- writes made by other processes; with the index, a poll reads only the
+-- users that changed since the previous one instead of every user.
+--
+
+ALTER TABLE public.users ADD COLUMN IF NOT EXISTS state_updated_at timestamptz NOT NULL DEFAULT CURRENT_TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS users_state_updated_at_idx ON public.users (state_updated_at);
+
+-- book_likes / book_reviews -> users.state_version and state_updated_at, once per affected user and statement
+CREATE OR REPLACE FUNCTION public.bump_user_state_version() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        UPDATE public.users SET state_version = state_version + 1, state_updated_at = clock_timestamp()
+        WHERE user_id IN (SELECT user_id FROM old_rows);
+    ELSE
+        UPDATE public.users SET state_version = state_version + 1, state_updated_at = clock_timestamp()
+        WHERE user_id IN (SELECT user_id FROM new_rows);
+    END IF;
+    RETURN NULL;
+END;
+$$;
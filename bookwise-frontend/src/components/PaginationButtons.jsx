@@ -1,5 +1,5 @@
 // src/components/PaginationButtons.jsx
-function PaginationButtons({ page, nextPage, prevPage }) {
+function PaginationButtons({ page, nextPage, prevPage, hasNextPage = true }) {
   // Accepts the current page number and functions for navigating to next/previous pages
   return (
     <div className="flex items-center mt-6 gap-x-2 justify-center w-fulln">
@@ -19,7 +19,8 @@ function PaginationButtons({ page, nextPage, prevPage }) {
       {/* Next Button */}
       <button
         onClick={nextPage} // Call the nextPage function when clicked
-        className="bg-blue-500 text-white px-4 py-2 rounded" // Styling
+        className="bg-blue-500 text-white px-4 py-2 rounded disabled:bg-gray-400" // Styling
+        disabled={!hasNextPage} // Disable the button on the last page
       >
         Next {/* Display "Next" */}
       </button>
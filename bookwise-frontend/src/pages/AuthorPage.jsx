@@ -14,16 +14,8 @@ function AuthorPage() {
   useEffect(() => {
     const fetchBooksByAuthor = async () => {
       try {
-        // Get the ISBN13 numbers of the author's books
-        const isbn13List = await apiService.getBooksByAuthor(authorName);
-
-        // Get detailed information of the books by ISBN13
-        const booksData = await Promise.all(
-          isbn13List.map(async (isbn13) => {
-            const book = await apiService.getBookByIsbn(isbn13);
-            return book;
-          })
-        );
+        // Get the author's books with their details in a single request
+        const booksData = await apiService.getBooksByAuthor(authorName);
 
         // Save the books to the state
         setBooks(booksData);
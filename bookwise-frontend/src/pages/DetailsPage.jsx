@@ -23,12 +23,13 @@ function DetailsPage() {
         const detailsData = await apiService.getBookByIsbn(isbn13);
         setBook(detailsData);
 
-        // Use apiService to fetch user reviews
-        const reviewData = await apiService.getUserReviews(userId);
-        const userReview = reviewData.reviews.find(
-          (review) => review.isbn13 === isbn13
-        );
-        setUserRating(userReview ? userReview.user_rating : 0);
+        // Fetch only this book's like and rating instead of the user's whole history
+        if (userId) {
+          const stateData = await apiService.getBookStates(userId, [isbn13]);
+          const state = stateData.books[0];
+          setLikedBooks(state?.liked ? [isbn13] : []);
+          setUserRating(state?.rating || 0);
+        }
       } catch (e) {
         console.error("Error fetching book:", e);
         setError(e);
@@ -40,36 +41,13 @@ function DetailsPage() {
     fetchBook();
   }, [isbn13]);
 
-  useEffect(() => {
-    const fetchUserData = async () => {
-      try {
-        const userId = JSON.parse(sessionStorage.getItem("user"))?.user_id;
-        if (userId) {
-          // Use apiService to fetch liked books
-          const likedBooksData = await apiService.getLikedBooks(userId);
-          setLikedBooks(likedBooksData.liked_books.map((book) => book.isbn13));
-        }
-      } catch (error) {
-        console.error("Error getting user data:", error);
-      }
-    };
-
-    fetchUserData();
-  }, []);
-
   const handleRatingChange = async (isbn13, newRating) => {
     try {
       const userId = JSON.parse(sessionStorage.getItem("user"))?.user_id;
 
-      // Use apiService to post the book review
-      await apiService.postBookReview(userId, isbn13, newRating);
-
-      // Update the user rating state after successful rating
-      const reviewData = await apiService.getUserReviews(userId);
-      const updatedUserRating = reviewData.reviews.find(
-        (review) => review.isbn13 === isbn13
-      )?.user_rating;
-      setUserRating(updatedUserRating || 0);
+      // Use apiService to post the book review; the response carries the saved rating
+      const reviewData = await apiService.postBookReview(userId, isbn13, newRating);
+      setUserRating(reviewData.reviews[0]?.user_rating || 0);
     } catch (error) {
       console.error("An error occurred while rating the book:", error);
     }
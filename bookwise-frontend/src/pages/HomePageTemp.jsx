@@ -9,6 +9,9 @@ import apiService from "../services/apiService";
 function HomePage() {
   const [books, setBooks] = useState([]);
   const [page, setPage] = useState(1);
+  // cursors[i] is the cursor of page i + 1; the first page has an empty cursor
+  const [cursors, setCursors] = useState([""]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [categories, setCategories] = useState([]);
   const [selectedCategory, setSelectedCategory] = useState("");
@@ -24,9 +27,9 @@ function HomePage() {
   useEffect(() => {
     const fetchUserData = async () => {
       try {
-        // Use apiService to fetch liked books
-        const likedBooksData = await apiService.getLikedBooks(userId);
-        setLikedBooks(likedBooksData.liked_books.map((book) => book.isbn13));
+        // Only the liked ISBN13s are needed; unchanged ones are not downloaded again
+        const bookIds = await apiService.getUserBookIds(userId);
+        setLikedBooks(bookIds.liked);
       } catch (error) {
         console.error("Error fetching user data:", error);
       }
@@ -62,16 +65,21 @@ function HomePage() {
           setAiSuggestions(suggestions); // No need for formatting, apiService already returns the correct format
         } else if (selectedCategory) {
           // Use apiService to fetch books with category filter
-          const booksData = await apiService.getBooks(
-            page,
+          const booksData = await apiService.getBooksPage(
+            cursors[page - 1],
             booksPerPage,
             selectedCategory
           );
-          setBooks(booksData);
+          setBooks(booksData.books);
+          setNextCursor(booksData.next_cursor);
         } else {
           // Use apiService to fetch all books
-          const booksData = await apiService.getBooks(page, booksPerPage);
-          setBooks(booksData);
+          const booksData = await apiService.getBooksPage(
+            cursors[page - 1],
+            booksPerPage
+          );
+          setBooks(booksData.books);
+          setNextCursor(booksData.next_cursor);
         }
       } catch (error) {
         console.error("Error fetching data:", error);
@@ -81,16 +89,20 @@ function HomePage() {
     };
 
     fetchData();
-  }, [page, selectedCategory, userId, aiPowered]);
+  }, [page, cursors, selectedCategory, userId, aiPowered]);
 
   // useEffect hook to reset the page to 1 when the selectedCategory changes.
   useEffect(() => {
     setPage(1);
+    setCursors([""]);
   }, [selectedCategory]);
 
   // Functions to handle pagination
   const nextPage = () => {
-    setPage(page + 1);
+    if (nextCursor) {
+      setCursors([...cursors.slice(0, page), nextCursor]);
+      setPage(page + 1);
+    }
   };
 
   const prevPage = () => {
@@ -148,6 +160,7 @@ function HomePage() {
             page={page}
             nextPage={nextPage}
             prevPage={prevPage}
+            hasNextPage={Boolean(nextCursor)}
           />
         )}
       </div>
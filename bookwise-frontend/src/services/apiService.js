@@ -3,6 +3,12 @@ import qs from "qs";
 
 const API_BASE_URL = "http://localhost:5005";
 
+// Book fields shown by BookCard; book lists are fetched with only these
+const BOOK_CARD_FIELDS = "isbn13,title,authors,thumbnail,description";
+
+// Last liked and rated ISBN13 set fetched per user, refreshed only when its version changes
+const userBookIdsCache = {};
+
 const apiService = {
   //USER OPERATIONS
   register: async (userData) => {
@@ -141,11 +147,35 @@ const apiService = {
     }
   },
 
-  // API service function: Get the isbn13 numbers of books by author's name
+  // GET a page of books by cursor; returns { books, next_cursor } (next_cursor is null on the last page)
+  getBooksPage: async (cursor = "", limit = 50, category = "", sort = "isbn13") => {
+    try {
+      const params = new URLSearchParams({
+        cursor,
+        limit,
+        category,
+        sort,
+        fields: BOOK_CARD_FIELDS,
+      });
+      const response = await fetch(`${API_BASE_URL}/books?${params}`);
+      const data = await response.json();
+
+      if (!response.ok) {
+        throw new Error(data.error || "Error fetching books.");
+      }
+
+      return data;
+    } catch (error) {
+      console.error("Error fetching books:", error);
+      throw error; // Rethrow the error to be handled by the calling function
+    }
+  },
+
+  // API service function: Get the books of an author, with full details, in one request
   getBooksByAuthor: async (authorName) => {
     try {
       const response = await fetch(
-        `${API_BASE_URL}/books/by-author/${authorName}`
+        `${API_BASE_URL}/books/by-author/${encodeURIComponent(authorName)}?expand=1`
       );
 
       // If the response is not successful, throw an error
@@ -157,8 +187,8 @@ const apiService = {
       // Return the JSON data
       const data = await response.json();
 
-      // Return the list of ISBN13 numbers for the author's books
-      return data.isbn13_list;
+      // Return the author's books with their details
+      return data.books;
     } catch (error) {
       console.error(`Error fetching books by author: ${authorName}`, error);
       throw error; // Rethrow the error for further handling
@@ -205,12 +235,15 @@ const apiService = {
   // GET list of books liked by the user
   getLikedBooks: async (userId) => {
     try {
-      const response = await fetch(`${API_BASE_URL}/books/liked/${userId}`, {
-        method: "GET",
-        headers: {
-          "Content-Type": "application/json",
-        },
-      });
+      const response = await fetch(
+        `${API_BASE_URL}/books/liked/${userId}?fields=${BOOK_CARD_FIELDS}`,
+        {
+          method: "GET",
+          headers: {
+            "Content-Type": "application/json",
+          },
+        }
+      );
 
       if (!response.ok) {
         if (response.status === 404) {
@@ -327,6 +360,52 @@ const apiService = {
       throw error; // Rethrow the error to be handled by the calling function
     }
   },
+  // GET the user's like and rating of each of the given books; returns { version, books: [{ isbn13, liked, rating }] }
+  getBookStates: async (userId, isbn13List) => {
+    try {
+      const params = new URLSearchParams();
+      isbn13List.forEach((isbn13) => params.append("isbn13", isbn13));
+      const response = await fetch(
+        `${API_BASE_URL}/books/state/${userId}?${params}`
+      );
+      const data = await response.json();
+
+      if (!response.ok) {
+        throw new Error(data.error || "Error fetching book states.");
+      }
+
+      return data; // Book states, in the requested order
+    } catch (error) {
+      console.error("Error fetching book states:", error);
+      throw error; // Rethrow the error to be handled by the calling function
+    }
+  },
+  // GET the ISBN13s the user liked and rated; returns { version, liked: [isbn13], ratings: { isbn13: rating } }
+  getUserBookIds: async (userId) => {
+    try {
+      const cached = userBookIdsCache[userId];
+      const params = cached ? `?version=${cached.version}` : "";
+      const response = await fetch(
+        `${API_BASE_URL}/books/state/${userId}/ids${params}`
+      );
+
+      if (response.status === 304) {
+        return cached; // Nothing changed since the cached version
+      }
+
+      const data = await response.json();
+
+      if (!response.ok) {
+        throw new Error(data.error || "Error fetching user book ids.");
+      }
+
+      userBookIdsCache[userId] = data;
+      return data;
+    } catch (error) {
+      console.error("Error fetching user book ids:", error);
+      throw error; // Rethrow the error to be handled by the calling function
+    }
+  },
   // GET top 5 categories with the most books
   getTopCategories: async () => {
     try {